@@ -0,0 +1,138 @@
+# actor_index.py
+
+import re
+from typing import Dict, Iterable, List, Set, Tuple
+from db import locked
+from table_index import TableIndex
+import sql_queries as sql
+
+_NOT_ALNUM = re.compile(r"[^0-9a-z]")
+
+
+def normalize_name(name: str) -> str:
+    """
+    Lower-cases a name and drops everything but letters and digits.
+    """
+    return _NOT_ALNUM.sub("", name.lower())
+
+
+def _trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _padded_trigrams(text: str) -> Set[str]:
+    return _trigrams(f"  {text} ")
+
+
+class ActorIndex(TableIndex):
+    """
+    An in-process index of normalized actor names.
+
+    Each actor is indexed under "firstlast" and "lastfirst" with spaces and
+    punctuation removed, matching how ``ui.get_actor_and_year`` strips its
+    input. resolve() first looks for the input as a substring of a name (the
+    old ``LIKE '%name%'`` behaviour) and, when nothing matches, falls back to
+    trigram similarity so misspelled names still find their actor.
+    """
+    sql_all = sql.sql_actor_names_all
+    sql_since = sql.sql_actor_names_since
+    sql_count = sql.sql_actor_count
+    data_attributes = ("keys", "grams", "postings")
+
+    def __init__(self, refresh_interval: float = 60.0, threshold: float = 0.4,
+                 full_reload_interval: float = 3600.0) -> None:
+        super().__init__(refresh_interval, full_reload_interval)
+        self.threshold = threshold
+        self.keys: Dict[int, Tuple[str, str]] = {}
+        self.grams: Dict[int, Tuple[Set[str], Set[str]]] = {}
+        self.postings: Dict[str, Set[int]] = {}
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Dict], threshold: float = 0.4) -> "ActorIndex":
+        """
+        Builds an index over the given actor rows instead of the database,
+        e.g. the actors of a catalog snapshot.
+        """
+        index = cls(threshold=threshold)
+        index._add_rows(list(rows))
+        return index
+
+    def resolve(self, name: str) -> List[int]:
+        """
+        Returns the ids of the actors matching a name.
+
+        :param name: The actor's name in any order and case, with or without spaces.
+        """
+        needle = normalize_name(name)
+        if not needle:
+            return []
+        with locked(self._lock):
+            exact = self._substring_matches(needle)
+            if exact:
+                return sorted(exact)
+            return self._fuzzy_matches(needle)
+
+    def _substring_matches(self, needle: str) -> Set[int]:
+        grams = _trigrams(needle)
+        if grams:
+            candidates = None
+            for gram in grams:
+                posting = self.postings.get(gram)
+                if not posting:
+                    return set()
+                candidates = set(posting) if candidates is None else candidates & posting
+        else:
+            candidates = self.keys
+        return {actor_id for actor_id in candidates
+                if any(needle in key for key in self.keys[actor_id])}
+
+    def _fuzzy_matches(self, needle: str) -> List[int]:
+        grams = _padded_trigrams(needle)
+        candidates: Set[int] = set()
+        for gram in grams:
+            candidates.update(self.postings.get(gram, ()))
+        best: Dict[int, float] = {}
+        for actor_id in candidates:
+            # Jaccard similarity of the trigram sets, the better of the two name orders.
+            best[actor_id] = max(len(grams & key_grams) / len(grams | key_grams)
+                                 for key_grams in self.grams[actor_id])
+        if not best:
+            return []
+        top = max(best.values())
+        if top < self.threshold:
+            return []
+        return sorted(actor_id for actor_id, score in best.items() if score == top)
+
+    def _clear(self) -> None:
+        self.keys = {}
+        self.grams = {}
+        self.postings = {}
+
+    def _add_rows(self, rows: List[Dict]) -> None:
+        for row in rows:
+            actor_id = row['actor_id']
+            if actor_id in self.keys:
+                self._unindex(actor_id)
+            first = normalize_name(row['first_name'] or "")
+            last = normalize_name(row['last_name'] or "")
+            self.keys[actor_id] = (first + last, last + first)
+            self.grams[actor_id] = (_padded_trigrams(first + last), _padded_trigrams(last + first))
+            for key_grams in self.grams[actor_id]:
+                for gram in key_grams:
+                    self.postings.setdefault(gram, set()).add(actor_id)
+
+    def _unindex(self, actor_id: int) -> None:
+        del self.keys[actor_id]
+        for key_grams in self.grams.pop(actor_id):
+            for gram in key_grams:
+                posting = self.postings.get(gram)
+                if posting is not None:
+                    posting.discard(actor_id)
+                    if not posting:
+                        del self.postings[gram]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _ids(self) -> Iterable[int]:
+        return self.keys.keys()
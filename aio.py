@@ -0,0 +1,270 @@
+# aio.py
+
+import asyncio
+import functools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Union
+import db
+import func
+import setting as se
+from db import PendingQuery, WouldBlock, async_results, metrics
+from my_exceptions import DatabaseConnectionError, QueryExecutionError, QueryTimeoutError
+from paging import MoviePage
+
+try:
+    import aiomysql
+except ImportError:
+    aiomysql = None
+
+_executor: Optional[ThreadPoolExecutor] = None
+_pool: Optional["asyncio.Future"] = None
+_pool_loop: Optional[asyncio.AbstractEventLoop] = None
+
+# Passed as timeout to wait without a limit; None means the ASYNC_TIMEOUT setting.
+NO_TIMEOUT = 0
+
+
+def _native() -> bool:
+    """
+    Tells whether the searches fetch from MySQL with aiomysql rather than in threads.
+    """
+    driver = os.getenv('SAKILA_ASYNC_DRIVER', se.ASYNC_DRIVER)
+    if driver not in ('auto', 'aiomysql', 'executor'):
+        raise ValueError(f"Invalid async driver: {driver}")
+    if driver == 'executor' or db.get_connection_factory() is not None:
+        return False
+    if aiomysql is None:
+        if driver == 'aiomysql':
+            raise DatabaseConnectionError("The aiomysql driver is not installed.")
+        return False
+    return True
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """
+    Returns the worker threads, one per pooled connection by default, so a
+    running call never waits for a connection and the rest queue up here.
+    """
+    global _executor
+    if _executor is None:
+        workers = int(os.getenv('SAKILA_ASYNC_WORKERS', se.ASYNC_WORKERS or os.getenv('DB_POOL_SIZE', se.POOL_SIZE)))
+        _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="aio")
+    return _executor
+
+
+async def _get_pool():
+    """
+    Returns the aiomysql pool of the running loop, creating it on first use.
+    """
+    global _pool, _pool_loop
+    loop = asyncio.get_running_loop()
+    if _pool is None or _pool_loop is not loop:
+        _pool_loop = loop
+        _pool = asyncio.ensure_future(aiomysql.create_pool(
+            host=os.getenv('DB_HOST'),
+            port=int(os.getenv('DB_PORT', 3306)),
+            user=os.getenv('DB_USER'),
+            password=os.getenv('DB_PASSWORD'),
+            db=os.getenv('DB_NAME'),
+            autocommit=True,
+            minsize=0,
+            maxsize=int(os.getenv('DB_POOL_SIZE', se.POOL_SIZE)),
+            pool_recycle=int(float(os.getenv('DB_POOL_MAX_IDLE', se.POOL_MAX_IDLE)))
+        ))
+    pool = _pool
+    try:
+        # Shielded so that a cancelled caller does not cancel the shared creation.
+        return await asyncio.shield(pool)
+    except aiomysql.Error as e:
+        if _pool is pool:
+            _pool = None
+        raise DatabaseConnectionError(f"Database connection error: {e}")
+
+
+async def _fetch(pending: PendingQuery) -> List[Dict]:
+    """
+    Runs the query a search is waiting for on the aiomysql pool.
+    """
+    pool = await _get_pool()
+    start = time.perf_counter()
+    try:
+        connection = await pool.acquire()
+    except aiomysql.Error as e:
+        raise DatabaseConnectionError(f"Database connection error: {e}")
+    borrow = time.perf_counter() - start
+    try:
+        async with connection.cursor(aiomysql.DictCursor) as cursor:
+            start = time.perf_counter()
+            await cursor.execute(pending.query, pending.params)
+            executed = time.perf_counter()
+            rows = await cursor.fetchall()
+    except asyncio.CancelledError:
+        # The reply may still be on its way; the connection cannot be reused.
+        connection.close()
+        raise
+    except aiomysql.Error as e:
+        metrics.observe_error(pending.name)
+        raise QueryExecutionError(f"Query execution error: {e}, {pending.params}", query=pending.name,
+                                  error_code=e.args[0] if e.args else None)
+    finally:
+        pool.release(connection)
+    fetch = time.perf_counter() - executed
+    if metrics.observe(pending.name, borrow, executed - start, fetch, len(rows)):
+        metrics.log_slow(pending.name, pending.query, pending.params, borrow + executed - start + fetch)
+    return list(rows)
+
+
+def _in_memory(function: Callable, args: tuple, kwargs: Dict, fetched: Dict) -> Any:
+    token = async_results.set(fetched)
+    try:
+        return function(*args, **kwargs)
+    finally:
+        async_results.reset(token)
+
+
+async def _run(function: Callable, args: tuple, kwargs: Dict, search: bool) -> Any:
+    """
+    Runs a func.py function without blocking the event loop.
+
+    With aiomysql a search runs on the loop itself: it answers from the cache
+    and the in-process indexes, and the query it is missing is awaited on the
+    aiomysql pool before it runs again. Anything else that needs the database
+    (an index refresh, recording) or would wait on the loop (a lock held by a
+    loading thread, a check of the snapshot file) runs in a worker thread.
+    """
+    if search and _native():
+        fetched: Dict = {}
+        while True:
+            try:
+                return _in_memory(function, args, kwargs, fetched)
+            except PendingQuery as pending:
+                fetched[pending.key] = await _fetch(pending)
+            except WouldBlock:
+                break
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), functools.partial(function, *args, **kwargs))
+
+
+async def _call(function: Callable, *args: Any, timeout: Optional[float] = None, search: bool = False,
+                **kwargs: Any) -> Any:
+    """
+    Runs a func.py function with a timeout.
+
+    :raises QueryTimeoutError: If it does not finish in time. A call already
+                               running in a worker thread finishes there; its
+                               result is discarded.
+    """
+    if timeout is None:
+        timeout = se.ASYNC_TIMEOUT
+    try:
+        return await asyncio.wait_for(_run(function, args, kwargs, search), timeout or None)
+    except asyncio.TimeoutError:
+        raise QueryTimeoutError(f"No result within {timeout} s.", query=function.__name__) from None
+
+
+async def search_movies(rating: Optional[Union[int, str]] = None, genre: Optional[str] = None,
+                        year: Optional[int] = None, year_from: Optional[int] = None, year_to: Optional[int] = None,
+                        actor: Optional[str] = None, keyword: Optional[str] = None, order: str = "film_id",
+                        page_size: int = se.PAGE_SIZE, after: Optional[str] = None,
+                        timeout: Optional[float] = None) -> MoviePage:
+    """
+    Awaitable func.search_movies().
+
+    :param timeout: Seconds to wait (ASYNC_TIMEOUT by default, NO_TIMEOUT for no limit).
+    """
+    return await _call(func.search_movies, rating, genre, year, year_from, year_to, actor, keyword, order,
+                       page_size=page_size, after=after, timeout=timeout, search=True)
+
+
+async def search_movies_by_rating(rating: int, page_size: int = se.PAGE_SIZE, after: Optional[str] = None,
+                                  timeout: Optional[float] = None) -> MoviePage:
+    """
+    Awaitable func.search_movies_by_rating().
+    """
+    return await _call(func.search_movies_by_rating, rating, page_size=page_size, after=after,
+                       timeout=timeout, search=True)
+
+
+async def search_movies_by_keyword(keyword: str, page_size: int = se.PAGE_SIZE, after: Optional[str] = None,
+                                   timeout: Optional[float] = None) -> MoviePage:
+    """
+    Awaitable func.search_movies_by_keyword().
+    """
+    return await _call(func.search_movies_by_keyword, keyword, page_size=page_size, after=after,
+                       timeout=timeout, search=True)
+
+
+async def search_movies_by_genre_and_year(genre: str, year: int, page_size: int = se.PAGE_SIZE,
+                                          after: Optional[str] = None,
+                                          timeout: Optional[float] = None) -> MoviePage:
+    """
+    Awaitable func.search_movies_by_genre_and_year().
+    """
+    return await _call(func.search_movies_by_genre_and_year, genre, year, page_size=page_size, after=after,
+                       timeout=timeout, search=True)
+
+
+async def search_movies_by_actor_and_year(actor: str, year: int, page_size: int = se.PAGE_SIZE,
+                                          after: Optional[str] = None,
+                                          timeout: Optional[float] = None) -> MoviePage:
+    """
+    Awaitable func.search_movies_by_actor_and_year().
+    """
+    return await _call(func.search_movies_by_actor_and_year, actor, year, page_size=page_size, after=after,
+                       timeout=timeout, search=True)
+
+
+async def search_similar_movies(title: str, page_size: int = se.PAGE_SIZE, after: Optional[str] = None,
+                                timeout: Optional[float] = None) -> MoviePage:
+    """
+    Awaitable func.search_similar_movies().
+    """
+    return await _call(func.search_similar_movies, title, page_size=page_size, after=after,
+                       timeout=timeout, search=True)
+
+
+async def record_user_query(query_name: str, timeout: Optional[float] = None) -> None:
+    """
+    Awaitable func.record_user_query().
+    """
+    await _call(func.record_user_query, query_name, timeout=timeout)
+
+
+async def flush_recorded_queries(timeout: Optional[float] = None) -> int:
+    """
+    Awaitable func.flush_recorded_queries().
+    """
+    return await _call(func.flush_recorded_queries, timeout=timeout)
+
+
+async def get_popular_queries(window: Optional[str] = None,
+                              timeout: Optional[float] = None) -> List[Dict[str, Union[str, int]]]:
+    """
+    Awaitable func.get_popular_queries().
+    """
+    return await _call(func.get_popular_queries, window, timeout=timeout)
+
+
+async def warm_up(timeout: Optional[float] = NO_TIMEOUT) -> None:
+    """
+    Awaitable func.warm_up(); call it at service start-up so the searches are
+    answered from memory on the loop.
+    """
+    await _call(func.warm_up, timeout=timeout)
+
+
+async def close() -> None:
+    """
+    Closes the aiomysql pool and the worker threads, flushing the recorded queries.
+    """
+    global _pool, _executor
+    await flush_recorded_queries(timeout=NO_TIMEOUT)
+    pool, _pool = _pool, None
+    if pool is not None and pool.done() and not pool.cancelled() and pool.exception() is None:
+        pool.result().close()
+        await pool.result().wait_closed()
+    executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False)
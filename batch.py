@@ -0,0 +1,230 @@
+# batch.py
+
+import argparse
+import csv
+import functools
+import json
+import sys
+import time
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+import func
+import setting as se
+from planner import SearchCriteria
+from rows import as_dicts
+from user_exceptions import UserInputError
+
+# Scenario names and the menu numbers accepted for them
+SCENARIOS = {
+    "rating": "rating", "1": "rating",
+    "keyword": "keyword", "2": "keyword",
+    "genre_year": "genre_year", "3": "genre_year",
+    "actor_year": "actor_year", "4": "actor_year",
+    "popular": "popular", "5": "popular",
+    "similar": "similar", "7": "similar",
+    "search": "search",
+}
+
+# Fields converted to integers when read from CSV or given as strings
+INTEGER_FIELDS = ("year", "year_from", "year_to", "page_size")
+
+# The filters of the "search" scenario (func.search_movies)
+SEARCH_FIELDS = ("rating", "genre", "year", "year_from", "year_to", "actor", "keyword", "order")
+
+
+def read_requests(file: TextIO, fmt: str) -> Iterator[Tuple[int, Any]]:
+    """
+    Yields (line number, request) for every request in a JSONL or CSV file.
+    A line that cannot be parsed yields the exception instead of a request.
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, {key: value for key, value in row.items() if key and value not in (None, "")}
+        return
+    for number, line in enumerate(file, start=1):
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            yield number, UserInputError(f"Invalid JSON: {e}", line.strip())
+            continue
+        if not isinstance(request, dict):
+            request = UserInputError("A request must be a JSON object.", line.strip())
+        yield number, request
+
+
+def _field(request: Dict[str, Any], name: str) -> Any:
+    if name not in request:
+        raise UserInputError(f"Missing field '{name}'.", request.get("scenario"))
+    value = request[name]
+    if name in INTEGER_FIELDS:
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise UserInputError(f"The field '{name}' must be a number.", value)
+    return value
+
+
+def run_request(request: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[str]]:
+    """
+    Runs one search request.
+
+    :return: The response fields and the query name to record, as main.py
+             records it (None for requests that are not recorded).
+    """
+    scenario = SCENARIOS.get(str(request.get("scenario", "")).lower())
+    if scenario is None:
+        raise UserInputError(f"Unknown scenario. Use one of: {', '.join(sorted(set(SCENARIOS.values())))}.",
+                             request.get("scenario"))
+    if scenario == "popular":
+        return {"results": func.get_popular_queries(request.get("window"))}, None
+
+    if scenario == "search":
+        filters = {field: _field(request, field) for field in SEARCH_FIELDS if field in request}
+        search, args = functools.partial(func.search_movies, **filters), ()
+        name = str(SearchCriteria(**filters))
+    elif scenario == "rating":
+        rating = _field(request, "rating")
+        search, args, name = func.search_movies_by_rating, (rating,), f"Rating: {rating}"
+    elif scenario == "keyword":
+        keyword = str(_field(request, "keyword")).strip()
+        search, args, name = func.search_movies_by_keyword, (keyword,), f"Keyword: {keyword}"
+    elif scenario == "similar":
+        title = str(_field(request, "title")).strip()
+        search, args, name = func.search_similar_movies, (title,), f"Similar: {title}"
+    elif scenario == "genre_year":
+        genre, year = str(_field(request, "genre")).strip(), _field(request, "year")
+        search, args, name = func.search_movies_by_genre_and_year, (genre, year), f"Genre: {genre}; Year: {year}"
+    else:
+        # Names are matched without spaces, as ui.get_actor_and_year() reads them.
+        actor, year = str(_field(request, "actor")).replace(" ", ""), _field(request, "year")
+        search, args = func.search_movies_by_actor_and_year, (actor, year)
+        name = f"Actor: {actor.title()}; Year: {year}"
+
+    page_size = _field(request, "page_size") if "page_size" in request else se.PAGE_SIZE
+    if request.get("all"):
+        return {"results": as_dicts(func.iter_search(search, *args, page_size=max(page_size, 100)))}, name
+    page = search(*args, page_size=page_size, after=request.get("after"))
+    return {"results": as_dicts(page), "next_token": page.next_token}, name
+
+
+def _respond(line: int, request: Any, future: "Future") -> Tuple[Dict[str, Any], Optional[str]]:
+    response: Dict[str, Any] = {"line": line}
+    if isinstance(request, dict):
+        for key in ("id", "scenario"):
+            if key in request:
+                response[key] = request[key]
+    try:
+        fields, name = future.result()
+    except Exception as e:
+        response["ok"] = False
+        response["error"] = {"type": type(e).__name__, "message": str(e)}
+        return response, None
+    response["ok"] = True
+    response.update(fields)
+    return response, name
+
+
+def run_batch(requests: Iterable[Tuple[int, Any]], out: TextIO, workers: int = se.POOL_SIZE,
+              ordered: bool = True, record: bool = True) -> Dict[str, int]:
+    """
+    Runs requests on a thread pool and writes one JSON line per request.
+
+    At most ``4 * workers`` requests are in flight, so any number of requests
+    runs in bounded memory. Failed requests are reported inline. The searches
+    that succeeded are recorded as user queries in one bulk update.
+
+    :param ordered: Write the responses in input order instead of completion order.
+    :return: The number of requests, errors and recorded queries.
+    """
+    counts: Counter = Counter()
+    summary = {"requests": 0, "errors": 0}
+
+    def fail(request: Exception) -> None:
+        raise request
+
+    def emit(line: int, request: Any, future: "Future") -> None:
+        response, name = _respond(line, request, future)
+        summary["requests"] += 1
+        if not response["ok"]:
+            summary["errors"] += 1
+        elif name is not None:
+            counts[name] += 1
+        out.write(json.dumps(response, default=str) + "\n")
+
+    pending: deque = deque()
+
+    def drain(limit: int) -> None:
+        while len(pending) > limit:
+            if ordered:
+                emit(*pending.popleft())
+                continue
+            wait([future for _, _, future in pending], return_when=FIRST_COMPLETED)
+            for item in [item for item in pending if item[2].done()]:
+                pending.remove(item)
+                emit(*item)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch") as executor:
+        for line, request in requests:
+            if isinstance(request, Exception):
+                future = executor.submit(fail, request)
+            else:
+                future = executor.submit(run_request, request)
+            pending.append((line, request, future))
+            drain(4 * workers - 1)
+        drain(0)
+    out.flush()
+
+    if record and counts:
+        func.record_user_queries(counts)
+        func.flush_recorded_queries()
+    summary["recorded"] = sum(counts.values())
+    return summary
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Command-line entry point for non-interactive searches.
+    """
+    parser = argparse.ArgumentParser(
+        description="Run many searches from JSONL or CSV and write the results as JSONL.",
+        epilog='Example request: {"scenario": "genre_year", "genre": "Comedy", "year": 2006}')
+    parser.add_argument("files", nargs="*", help="request files (default: standard input; '-' also reads it)")
+    parser.add_argument("--format", choices=("jsonl", "csv"),
+                        help="input format (default: csv for .csv files, jsonl otherwise)")
+    parser.add_argument("--workers", type=int, default=se.POOL_SIZE,
+                        help=f"concurrent requests (default: {se.POOL_SIZE}, the pool size)")
+    parser.add_argument("--order", choices=("input", "completion"), default="input",
+                        help="write responses in input order or as they complete (default: input)")
+    parser.add_argument("--no-record", action="store_true", help="do not record the searches as user queries")
+    parser.add_argument("--output", help="write the responses to this file (default: standard output)")
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error("--workers must be positive")
+
+    def requests() -> Iterator[Tuple[int, Any]]:
+        for path in args.files or ["-"]:
+            fmt = args.format or ("csv" if path.lower().endswith(".csv") else "jsonl")
+            if path == "-":
+                yield from read_requests(sys.stdin, fmt)
+            else:
+                with open(path, newline="") as file:
+                    yield from read_requests(file, fmt)
+
+    started = time.perf_counter()
+    out = open(args.output, "w") if args.output else sys.stdout
+    try:
+        summary = run_batch(requests(), out, args.workers, args.order == "input", not args.no_record)
+    finally:
+        if args.output:
+            out.close()
+    print(f"{summary['requests']} requests, {summary['errors']} errors, {summary['recorded']} recorded "
+          f"in {time.perf_counter() - started:.2f}s", file=sys.stderr)
+    return 1 if summary["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,386 @@
+# benchmark.py
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+import db
+import func
+import sql_queries as sql
+from rows import ROW_FORMATS, project
+from standin import StandInDatabase
+from user_exceptions import MovieNotFoundError
+
+CATEGORIES = ('Action', 'Animation', 'Children', 'Classics', 'Comedy', 'Documentary', 'Drama', 'Family',
+              'Foreign', 'Games', 'Horror', 'Music', 'New', 'Sci-Fi', 'Sports', 'Travel')
+FIRST_NAMES = ('PENELOPE', 'NICK', 'ED', 'JENNIFER', 'JOHNNY', 'BETTE', 'GRACE', 'MATTHEW', 'JOE',
+               'CHRISTIAN', 'ZERO', 'KARL', 'UMA', 'VIVIEN', 'CUBA', 'FRED', 'HELEN', 'DAN', 'BOB', 'LUCILLE')
+LAST_NAMES = ('GUINESS', 'WAHLBERG', 'CHASE', 'DAVIS', 'LOLLOBRIGIDA', 'NICHOLSON', 'MOSTEL', 'JOHANSSON',
+              'SWANK', 'GABLE', 'CAGE', 'BERRY', 'WOOD', 'BERGEN', 'OLIVIER', 'COSTNER', 'VOIGHT', 'TORN',
+              'FAWCETT', 'TRACY')
+ADJECTIVES = ('ACADEMY', 'ACE', 'ADAPTATION', 'AFFAIR', 'AGENT', 'ALABAMA', 'ALIEN', 'AMERICAN', 'ANGELS',
+              'ANNIE', 'APOLLO', 'ARABIA', 'ARMY', 'ATLANTIS', 'BAKED', 'BALLROOM', 'BEAST', 'BEDAZZLED')
+NOUNS = ('DINOSAUR', 'GOLDFINGER', 'HOLES', 'PREJUDICE', 'TRUMAN', 'EGG', 'SPLENDOR', 'CENTER', 'PAST',
+         'IDENTITY', 'TEEN', 'CLEOPATRA', 'DOCTOR', 'VIRGINIAN', 'SQUAD', 'PACIFIC', 'CHARADE', 'SAGA')
+STORY_WORDS = ('Epic', 'Drama', 'Astounding', 'Epistle', 'Fanciful', 'Documentary', 'Mindless', 'Saga',
+               'Feminist', 'Scientist', 'Database Administrator', 'Explorer', 'Boat', 'Moose', 'Crocodile',
+               'Shark', 'Dentist', 'Robot', 'Pioneer', 'Monastery', 'Canadian Rockies', 'Gulf of Mexico')
+RATINGS = ('G', 'PG', 'PG-13', 'R', 'NC-17')
+LAST_UPDATE = '2006-02-15 05:03:42'
+
+# Rows per scale factor 1, matching the Sakila sample database
+FILMS_PER_SCALE = 1000
+ACTORS_PER_SCALE = 200
+ACTORS_PER_FILM = (1, 10)
+
+
+def generate_catalog(scale: float, seed: int = 42) -> Dict[str, Tuple[Tuple[str, ...], Iterator[tuple]]]:
+    """
+    Generates synthetic Sakila-schema rows.
+
+    :param scale: 1 gives Sakila's size (1,000 films, 200 actors, ~5,500
+                  film_actor rows); 100 and 10000 scale every table linearly.
+    :return: For every table its columns and a lazy iterator of rows.
+    """
+    films = max(1, int(FILMS_PER_SCALE * scale))
+    actors = max(1, int(ACTORS_PER_SCALE * scale))
+
+    def film_rows() -> Iterator[tuple]:
+        rnd = random.Random(seed)
+        for film_id in range(1, films + 1):
+            title = f"{rnd.choice(ADJECTIVES)} {rnd.choice(NOUNS)}"
+            if film_id > len(ADJECTIVES) * len(NOUNS):
+                title += f" {film_id}"
+            words = rnd.sample(STORY_WORDS, 4)
+            description = f"A {words[0]} {words[1]} of a {words[2]} And a {words[3]}"
+            yield film_id, title, description, rnd.randint(1990, 2023), rnd.choice(RATINGS), LAST_UPDATE
+
+    def actor_rows() -> Iterator[tuple]:
+        rnd = random.Random(seed + 1)
+        for actor_id in range(1, actors + 1):
+            yield actor_id, rnd.choice(FIRST_NAMES), rnd.choice(LAST_NAMES), LAST_UPDATE
+
+    def film_actor_rows() -> Iterator[tuple]:
+        rnd = random.Random(seed + 2)
+        for film_id in range(1, films + 1):
+            cast = rnd.sample(range(1, actors + 1), min(actors, rnd.randint(*ACTORS_PER_FILM)))
+            for actor_id in cast:
+                yield actor_id, film_id, LAST_UPDATE
+
+    def film_category_rows() -> Iterator[tuple]:
+        rnd = random.Random(seed + 3)
+        for film_id in range(1, films + 1):
+            yield film_id, rnd.randint(1, len(CATEGORIES)), LAST_UPDATE
+
+    return {
+        "category": (("category_id", "name", "last_update"),
+                     ((i, name, LAST_UPDATE) for i, name in enumerate(CATEGORIES, start=1))),
+        "film": (("film_id", "title", "description", "release_year", "rating", "last_update"), film_rows()),
+        "actor": (("actor_id", "first_name", "last_name", "last_update"), actor_rows()),
+        "film_actor": (("actor_id", "film_id", "last_update"), film_actor_rows()),
+        "film_category": (("film_id", "category_id", "last_update"), film_category_rows()),
+    }
+
+
+def _chunks(rows: Iterator[tuple], size: int = 10000) -> Iterator[List[tuple]]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def populate_standin(path: str, scale: float, seed: int = 42) -> StandInDatabase:
+    """
+    Creates a SQLite stand-in database with synthetic data.
+    """
+    database = StandInDatabase(path)
+    for table, (columns, rows) in generate_catalog(scale, seed).items():
+        for chunk in _chunks(rows):
+            database.insert_rows(table, columns, chunk)
+    return database
+
+
+def populate_mysql(scale: float, seed: int = 42) -> None:
+    """
+    Loads synthetic data into the MySQL database from the environment. Rows
+    with the same keys are overwritten, so point DB_NAME at a scratch copy of
+    the Sakila schema, never at a database you care about.
+
+    Tables are loaded parents first, and existing rows are updated in place:
+    REPLACE would delete them first, which Sakila's foreign keys reject.
+    """
+    with db.MySakilaConnection() as base:
+        for table, (columns, rows) in generate_catalog(scale, seed).items():
+            if table == "film":
+                # Sakila requires a language; id 1 ('English') ships with the schema.
+                columns = columns + ("language_id",)
+                rows = (row + (1,) for row in rows)
+            placeholders = ", ".join(["%s"] * len(columns))
+            updates = ", ".join(f"{column} = VALUES({column})" for column in columns)
+            statement = (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+                         f" ON DUPLICATE KEY UPDATE {updates}")
+            for chunk in _chunks(rows, 1000):
+                base.cursor.executemany(statement, chunk)
+            base.connection.commit()
+
+
+def percentiles(samples: Sequence[float]) -> Dict[str, float]:
+    """
+    Summarizes latencies in seconds as milliseconds.
+    """
+    ordered = sorted(samples)
+
+    def pick(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+    total = sum(ordered)
+    return {
+        "count": len(ordered),
+        "mean_ms": total / len(ordered) * 1000,
+        "p50_ms": pick(0.50),
+        "p90_ms": pick(0.90),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": ordered[-1] * 1000,
+        "ops_per_sec": len(ordered) / total if total else 0.0,
+    }
+
+
+def _workload() -> Dict[str, Callable[[random.Random], object]]:
+    """
+    Returns the benchmarked calls, each drawing its parameters from ``rnd``.
+    """
+    actors = [f"{first}{last}".lower() for first in FIRST_NAMES[:5] for last in LAST_NAMES[:5]]
+    words = [word.lower() for word in NOUNS + ADJECTIVES[:6]] + ['drama', 'shark']
+    sample_movies = [{"film_id": i, "title": f"{ADJECTIVES[i % 18]} {NOUNS[i % 18]}", "release_year": 2006,
+                      "actor_name": f"{FIRST_NAMES[i % 20]} {LAST_NAMES[i % 20]}"} for i in range(10)]
+    sample_queries = [{"query": f"Keyword: {word}", "count": 100 - i} for i, word in enumerate(NOUNS[:10])]
+
+    def quiet(render: Callable, rows: List[Dict]) -> Callable[[random.Random], None]:
+        def call(rnd: random.Random) -> None:
+            with contextlib.redirect_stdout(io.StringIO()):
+                render(rows)
+        return call
+
+    return {
+        "search_movies_by_rating": lambda rnd: func.search_movies_by_rating(rnd.randint(1, 5)),
+        "search_movies_by_keyword": lambda rnd: func.search_movies_by_keyword(rnd.choice(words)),
+        "search_movies_by_genre_and_year": lambda rnd: func.search_movies_by_genre_and_year(
+            rnd.choice(CATEGORIES), rnd.randint(1990, 2023)),
+        "search_movies_by_actor_and_year": lambda rnd: func.search_movies_by_actor_and_year(
+            rnd.choice(actors), rnd.randint(1990, 2023)),
+        "record_user_query": lambda rnd: func.record_user_query(f"Keyword: {rnd.choice(words)}"),
+        "flush_recorded_queries": lambda rnd: (
+            [func.record_user_query(f"Keyword: {rnd.choice(words)}") for _ in range(10)],
+            func.flush_recorded_queries()),
+        "get_popular_queries": lambda rnd: func.get_popular_queries(),
+        "display_table": quiet(func.display_table, sample_queries),
+        "display_movies_table": quiet(func.display_movies_table, sample_movies),
+        "display_movies_actors_table": quiet(func.display_movies_actors_table, sample_movies),
+    }
+
+
+def run_benchmarks(repeat: int = 200, warmup: int = 20, cold: bool = False, seed: int = 42,
+                   only: Optional[Sequence[str]] = None) -> Dict:
+    """
+    Times every func.py entry point against the current database.
+
+    :param cold: Clear the search result cache before every call, so the
+                 searches measure the database path instead of cache hits.
+    :param only: Names of the benchmarks to run (all when empty).
+    """
+    results = {}
+    for name, call in _workload().items():
+        if only and name not in only:
+            continue
+        rnd = random.Random(seed)
+        samples = []
+        for i in range(warmup + repeat):
+            if cold:
+                func.invalidate_search_cache()
+            started = time.perf_counter()
+            try:
+                call(rnd)
+            except MovieNotFoundError:
+                pass
+            elapsed = time.perf_counter() - started
+            if i >= warmup:
+                samples.append(elapsed)
+        results[name] = percentiles(samples)
+    return results
+
+
+# Full-table reads used to compare the row formats: mixed column types, and integers only
+ROW_FORMAT_QUERIES = {
+    "film": (sql.sql_snapshot_film_all, ("film_id", "title")),
+    "film_actor": (sql.sql_snapshot_film_actor_all, ("actor_id", "film_id")),
+}
+
+
+def compare_row_formats(repeat: int = 20) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """
+    Reads whole tables in every row format of MySakilaConnection.execute_query().
+
+    Per table and format: the median time to fetch the rows and to scan two of
+    their columns, the memory the result keeps alive (measured with
+    tracemalloc) and the number of objects it adds for the garbage collector.
+    """
+    results: Dict[str, Dict[str, Dict[str, float]]] = {}
+    for table, (query, keys) in ROW_FORMAT_QUERIES.items():
+        results[table] = {}
+        for row_format in ROW_FORMATS:
+            name = f"bench_{table}_{row_format}"
+
+            def fetch():
+                with db.MySakilaConnection() as base:
+                    return base.execute_query(query, name=name, row_format=row_format)
+
+            fetch()
+            fetches, scans = [], []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                rows = fetch()
+                fetched = time.perf_counter()
+                for _ in project(rows, keys):
+                    pass
+                scans.append(time.perf_counter() - fetched)
+                fetches.append(fetched - started)
+                del rows
+
+            gc.collect()
+            objects = len(gc.get_objects())
+            tracemalloc.start()
+            try:
+                before = tracemalloc.get_traced_memory()[0]
+                rows = fetch()
+                gc.collect()
+                retained = tracemalloc.get_traced_memory()[0] - before
+            finally:
+                tracemalloc.stop()
+            tracked = len(gc.get_objects()) - objects
+            count = len(rows)
+            del rows
+
+            fetch_ms = percentiles(fetches)["p50_ms"]
+            results[table][row_format] = {
+                "rows": count,
+                "fetch_ms": fetch_ms,
+                "rows_per_sec": count / fetch_ms * 1000 if fetch_ms else 0.0,
+                "scan_ms": percentiles(scans)["p50_ms"],
+                "bytes": retained,
+                "bytes_per_row": retained / count if count else 0.0,
+                "gc_objects": tracked,
+            }
+    return results
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float = 0.2,
+            metrics: Sequence[str] = ("p50_ms", "p95_ms")) -> List[str]:
+    """
+    Lists the benchmarks that are slower than the baseline by more than
+    ``tolerance`` (0.2 = 20%) on any of ``metrics``.
+    """
+    regressions = []
+    for name, current in results["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if previous is None:
+            continue
+        for metric in metrics:
+            if previous[metric] > 0 and current[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f"{name}: {metric} {previous[metric]:.3f} -> {current[metric]:.3f} ms "
+                                   f"(+{(current[metric] / previous[metric] - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Command-line entry point: generate data, run the benchmarks, save and compare.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the func.py entry points.")
+    parser.add_argument("--scale", type=float, default=1, help="data scale factor: 1, 100, 10000 ... (default: 1)")
+    parser.add_argument("--target", choices=("standin", "mysql"), default="standin",
+                        help="an in-process SQLite stand-in or the MySQL database from the environment")
+    parser.add_argument("--database", help="stand-in database file to create or reuse (default: temporary)")
+    parser.add_argument("--skip-generate", action="store_true", help="reuse the data already in the target")
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--cold", action="store_true", help="bypass the search result cache")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--only", nargs="*", help="run only these benchmarks ('row_formats' for the row format "
+                                                  "comparison)")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="compare with the results stored in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown (default: 0.2 = 20%%)")
+    parser.add_argument("--metrics", choices=("summary", "json", "prometheus"),
+                        help="also print the per-statement query metrics in this format")
+    args = parser.parse_args(argv)
+
+    if args.target == "standin":
+        path = args.database or os.path.join(tempfile.mkdtemp(prefix="sakila-bench-"), "sakila.db")
+        database = StandInDatabase(path) if args.skip_generate else populate_standin(path, args.scale, args.seed)
+        db.use_connection_factory(database.connect)
+    elif not args.skip_generate:
+        populate_mysql(args.scale, args.seed)
+
+    results = {
+        "meta": {
+            "scale": args.scale,
+            "target": args.target,
+            "repeat": args.repeat,
+            "cold": args.cold,
+            "prepared": db.statements.prepared,
+            "python": platform.python_version(),
+            "created": datetime.now().isoformat(timespec="seconds"),
+        },
+        "results": run_benchmarks(args.repeat, args.warmup, args.cold, args.seed, args.only),
+    }
+    if not args.only or "row_formats" in args.only:
+        results["row_formats"] = compare_row_formats(max(1, min(args.repeat, 20)))
+
+    print(f"{'benchmark':36} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} {'ops/s':>10}")
+    for name, row in results["results"].items():
+        print(f"{name:36} {row['p50_ms']:9.3f} {row['p95_ms']:9.3f} {row['p99_ms']:9.3f} "
+              f"{row['max_ms']:9.3f} {row['ops_per_sec']:10.0f}")
+    if "row_formats" in results:
+        print()
+        print(f"{'row format':36} {'rows':>9} {'fetch ms':>9} {'rows/s':>10} {'scan ms':>9} "
+              f"{'bytes/row':>10} {'gc objects':>11}")
+        for table, formats in results["row_formats"].items():
+            for row_format, row in formats.items():
+                print(f"{table + ' / ' + row_format:36} {row['rows']:9} {row['fetch_ms']:9.3f} "
+                      f"{row['rows_per_sec']:10.0f} {row['scan_ms']:9.3f} {row['bytes_per_row']:10.1f} "
+                      f"{row['gc_objects']:11}")
+    if args.metrics:
+        print()
+        print(func.get_query_statistics(args.metrics))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        if regressions:
+            print("Regressions against the baseline:")
+            print("\n".join(regressions))
+            return 1
+        print("No regressions against the baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+# cache.py
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Tuple
+
+
+class CacheStats:
+    """
+    Counters describing how a result cache is being used.
+    """
+    def __init__(self) -> None:
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        """
+        Returns the counters as a plain dictionary.
+        """
+        return dict(vars(self))
+
+
+class QueryCache:
+    """
+    A bounded LRU cache of query results with a per-entry time to live.
+
+    Entries are keyed by the query name and its normalized parameters and
+    remember which tables they were read from, so that a change to a table
+    can drop exactly the entries built from it.
+    """
+    def __init__(self, max_size: int = 256, ttl: float = 300.0, negative_ttl: float = 60.0) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.stats = CacheStats()
+        self._entries: "OrderedDict[Hashable, Tuple[Any, float, Tuple[str, ...]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(name: str, params: Iterable[Any]) -> Tuple:
+        """
+        Builds a cache key, normalizing string parameters.
+
+        :param name: The query name.
+        :param params: The query parameters.
+        """
+        return (name,) + tuple(p.strip().lower() if isinstance(p, str) else p for p in params)
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """
+        Looks up a key.
+
+        :return: A (found, value) pair.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats.misses += 1
+                return False, None
+            value, expires_at, _ = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.stats.expirations += 1
+                self.stats.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            if value:
+                self.stats.hits += 1
+            else:
+                self.stats.negative_hits += 1
+            return True, value
+
+    def put(self, key: Hashable, value: Any, tables: Iterable[str] = (), ttl: Optional[float] = None) -> None:
+        """
+        Stores a value. Empty ("not found") values use the negative TTL and are
+        not stored at all when it is zero.
+
+        :param key: The key from make_key().
+        :param value: The query result.
+        :param tables: The tables the result was read from.
+        :param ttl: Overrides the default time to live, in seconds.
+        """
+        if ttl is None:
+            ttl = self.ttl if value else self.negative_ttl
+        if ttl <= 0 or self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl, tuple(tables))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any], tables: Iterable[str] = ()) -> Any:
+        """
+        Returns the cached value for a key, calling ``loader`` on a miss.
+        """
+        found, value = self.get(key)
+        if found:
+            return value
+        value = loader()
+        self.put(key, value, tables)
+        return value
+
+    def invalidate(self, name: Optional[str] = None) -> int:
+        """
+        Drops the entries of one query name, or every entry.
+
+        :return: The number of dropped entries.
+        """
+        with self._lock:
+            if name is None:
+                keys = list(self._entries)
+            else:
+                keys = [key for key in self._entries if key[0] == name]
+            for key in keys:
+                del self._entries[key]
+            self.stats.invalidations += len(keys)
+            return len(keys)
+
+    def invalidate_tables(self, *tables: str) -> int:
+        """
+        Drops every entry that was read from any of the given tables.
+
+        :return: The number of dropped entries.
+        """
+        changed = {table.lower() for table in tables}
+        with self._lock:
+            keys = [key for key, (_, _, used) in self._entries.items() if changed.intersection(used)]
+            for key in keys:
+                del self._entries[key]
+            self.stats.invalidations += len(keys)
+            return len(keys)
+
+    def __len__(self) -> int:
+        return len(self._entries)
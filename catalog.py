@@ -0,0 +1,87 @@
+# catalog.py
+
+import re
+import threading
+from typing import Dict, List, Optional, Union
+from db import MySakilaConnection, locked
+import setting as se
+import sql_queries as sql
+
+_RATING_LABEL = re.compile(r'(\d+)\.\s*"([^"]+)"')
+
+
+def normalize(text: str) -> str:
+    """
+    Lower-cases a dimension value and collapses its whitespace.
+    """
+    return " ".join(text.lower().split())
+
+
+class CatalogCache:
+    """
+    A small cache of the catalog dimensions: film categories and ratings.
+
+    Categories are read from the ``category`` table once and mapped from their
+    normalized name to ``category_id``. Ratings need no database at all: the
+    menu numbers, the labels in ``setting.RATING_TEXT`` and the enum values in
+    ``setting.RATINGS`` all map to the enum value stored in ``film.rating``.
+    """
+    def __init__(self) -> None:
+        self.categories: Dict[str, int] = {}
+        self.category_names: Dict[int, str] = {}
+        self.ratings: Dict[str, str] = self._rating_lookup()
+        self.loaded = False
+        self._lock = threading.Lock()
+        self._load_lock = threading.RLock()
+
+    def load(self) -> None:
+        """
+        Reads the categories from the database, replacing the cached ones.
+        """
+        with self._load_lock:
+            with MySakilaConnection(read_only=True) as base:
+                rows = base.execute_query(sql.sql_categories)
+            with self._lock:
+                self.categories = {normalize(row['name']): row['category_id'] for row in rows}
+                self.category_names = {row['category_id']: row['name'] for row in rows}
+                self.loaded = True
+
+    def ensure_loaded(self) -> None:
+        """
+        Loads the categories on first use.
+        """
+        if self.loaded:
+            return
+        with locked(self._load_lock):
+            # Checked again: another thread may have loaded them while this one waited.
+            if not self.loaded:
+                self.load()
+
+    def category_id(self, genre: str) -> Optional[int]:
+        """
+        Returns the id of a category by name, or None if there is no such category.
+        """
+        return self.categories.get(normalize(genre))
+
+    def genres(self) -> List[str]:
+        """
+        Returns the category names in alphabetical order.
+        """
+        return sorted(self.category_names.values())
+
+    def rating_value(self, rating: Union[int, str]) -> Optional[str]:
+        """
+        Returns the ``film.rating`` enum value for a menu number, a label such
+        as "Parental Guidance Suggested" or the enum value itself.
+        """
+        return self.ratings.get(normalize(str(rating)))
+
+    @staticmethod
+    def _rating_lookup() -> Dict[str, str]:
+        lookup = {}
+        for number, value in enumerate(se.RATINGS, start=1):
+            lookup[str(number)] = value
+            lookup[normalize(value)] = value
+        for number, label in _RATING_LABEL.findall(se.RATING_TEXT):
+            lookup[normalize(label)] = se.RATINGS[int(number) - 1]
+        return lookup
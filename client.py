@@ -0,0 +1,133 @@
+# client.py
+
+import os
+import socket
+from typing import Any, Dict, List, Optional, Union
+import setting as se
+from my_exceptions import DatabaseConnectionError
+from paging import MoviePage
+from protocol import ProtocolError, decode_error, recv_message, send_message, socket_path
+from user_exceptions import UserInputError
+# The tables are rendered locally; render.py only needs the standard library.
+from render import display_table, display_movies_table, display_movies_actors_table
+
+_sock: Optional[socket.socket] = None
+
+
+def connect() -> bool:
+    """
+    Connects to the daemon if it is running.
+
+    :return: False when no daemon listens on the socket; the operations then
+             run in this process instead.
+    """
+    global _sock
+    if _sock is not None:
+        return True
+    path = socket_path()
+    if not os.path.exists(path):
+        return False
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(se.DAEMON_TIMEOUT)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return False
+    _sock = sock
+    return True
+
+
+def close() -> None:
+    global _sock
+    if _sock is not None:
+        _sock.close()
+        _sock = None
+
+
+def _call(operation: str, *args: Any, **kwargs: Any) -> Any:
+    """
+    Runs an operation on the daemon, or locally through func.py when the
+    daemon is not running.
+    """
+    if not connect():
+        import func
+        return getattr(func, operation)(*args, **kwargs)
+    try:
+        send_message(_sock, {"op": operation, "args": args, "kwargs": kwargs})
+        response = recv_message(_sock)
+    except (OSError, ProtocolError) as e:
+        # The request may have run, so it is not retried locally.
+        close()
+        raise DatabaseConnectionError(f"Lost the connection to the Sakila daemon: {e}")
+    if response is None:
+        close()
+        raise DatabaseConnectionError("The Sakila daemon closed the connection.")
+    if "error" in response:
+        raise decode_error(response)
+    if "next_token" in response:
+        return MoviePage(response["result"], response["next_token"])
+    return response["result"]
+
+
+def search_movies(rating: Optional[Union[int, str]] = None, genre: Optional[str] = None,
+                  year: Optional[int] = None, year_from: Optional[int] = None, year_to: Optional[int] = None,
+                  actor: Optional[str] = None, keyword: Optional[str] = None, order: str = "film_id",
+                  page_size: int = se.PAGE_SIZE, after: Optional[str] = None) -> MoviePage:
+    return _call("search_movies", rating=rating, genre=genre, year=year, year_from=year_from, year_to=year_to,
+                 actor=actor, keyword=keyword, order=order, page_size=page_size, after=after)
+
+
+def search_movies_by_rating(rating: int, page_size: int = se.PAGE_SIZE,
+                            after: Optional[str] = None) -> MoviePage:
+    return _call("search_movies_by_rating", rating, page_size=page_size, after=after)
+
+
+def search_movies_by_keyword(keyword: str, page_size: int = se.PAGE_SIZE,
+                             after: Optional[str] = None) -> MoviePage:
+    return _call("search_movies_by_keyword", keyword, page_size=page_size, after=after)
+
+
+def search_movies_by_genre_and_year(genre: str, year: int, page_size: int = se.PAGE_SIZE,
+                                    after: Optional[str] = None) -> MoviePage:
+    return _call("search_movies_by_genre_and_year", genre, year, page_size=page_size, after=after)
+
+
+def search_movies_by_actor_and_year(actor: str, year: int, page_size: int = se.PAGE_SIZE,
+                                    after: Optional[str] = None) -> MoviePage:
+    return _call("search_movies_by_actor_and_year", actor, year, page_size=page_size, after=after)
+
+
+def search_similar_movies(title: str, page_size: int = se.PAGE_SIZE, after: Optional[str] = None) -> MoviePage:
+    return _call("search_similar_movies", title, page_size=page_size, after=after)
+
+
+def record_user_query(query_name: str) -> None:
+    _call("record_user_query", query_name)
+
+
+def flush_recorded_queries() -> int:
+    return _call("flush_recorded_queries")
+
+
+def get_popular_queries(window: Optional[str] = None) -> List[Dict[str, Union[str, int]]]:
+    """
+    Returns the most popular queries. The time windows are counted in the
+    daemon's memory, so without the daemon only the lifetime counts exist.
+
+    :raises UserInputError: If a window is asked for and the daemon is not running.
+    """
+    if window is not None and not connect():
+        raise UserInputError("Popularity by time window is kept by the daemon, which is not running "
+                             "(start it with python daemon.py).", window)
+    return _call("get_popular_queries", window)
+
+
+def get_query_statistics(fmt: str = "summary") -> str:
+    """
+    Returns the query statistics of the daemon. The metrics live in process
+    memory, so a one-shot process without the daemon has nothing to show.
+    """
+    if not connect():
+        return "Query statistics are kept by the daemon, which is not running (start it with python daemon.py)."
+    return _call("get_query_statistics", fmt)
@@ -0,0 +1,117 @@
+# daemon.py
+
+import argparse
+import os
+import signal
+import socket
+import socketserver
+import sys
+import traceback
+from typing import List, Optional
+import func
+from paging import MoviePage
+from protocol import ERRORS, ProtocolError, encode_error, recv_message, send_message, socket_path
+from rows import as_dicts
+
+# The func.py operations the client may call
+OPERATIONS = {name: getattr(func, name) for name in (
+    "search_movies",
+    "search_movies_by_rating",
+    "search_movies_by_keyword",
+    "search_movies_by_genre_and_year",
+    "search_movies_by_actor_and_year",
+    "search_similar_movies",
+    "record_user_query",
+    "flush_recorded_queries",
+    "get_popular_queries",
+    "get_query_statistics",
+    "invalidate_search_cache",
+    "refresh_catalog",
+)}
+
+
+class RequestHandler(socketserver.BaseRequestHandler):
+    """
+    Serves the requests of one client connection until it closes.
+    """
+    def handle(self) -> None:
+        while True:
+            try:
+                request = recv_message(self.request)
+            except (OSError, ProtocolError):
+                return
+            if request is None:
+                return
+            try:
+                send_message(self.request, self.dispatch(request))
+            except OSError:
+                return
+
+    def dispatch(self, request) -> dict:
+        name = request.get("op") if isinstance(request, dict) else None
+        operation = OPERATIONS.get(name)
+        if operation is None:
+            return encode_error(ValueError(f"Unknown operation: {name}"))
+        try:
+            result = operation(*request.get("args", ()), **request.get("kwargs", {}))
+        except Exception as e:
+            if type(e).__name__ not in ERRORS:
+                traceback.print_exc()
+            return encode_error(e)
+        if isinstance(result, MoviePage):
+            return {"result": as_dicts(result), "next_token": result.next_token}
+        return {"result": result}
+
+
+class SakilaServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def serve(path: str, warm_up: bool = True) -> None:
+    """
+    Serves the func.py operations on a Unix socket until SIGTERM or Ctrl+C.
+    """
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except OSError:
+            # Left behind by a daemon that did not shut down cleanly.
+            os.unlink(path)
+        else:
+            raise RuntimeError(f"A daemon is already listening on {path}")
+        finally:
+            probe.close()
+    if warm_up:
+        func.warm_up()
+    old_umask = os.umask(0o177)
+    try:
+        server = SakilaServer(path, RequestHandler)
+    finally:
+        os.umask(old_umask)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"Serving on {path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
+        func.flush_recorded_queries()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """
+    Command-line entry point for the resident server.
+    """
+    parser = argparse.ArgumentParser(description="Serve the MySakila searches to main.py over a Unix socket.")
+    parser.add_argument("--socket", help=f"socket path (default: {socket_path()})")
+    parser.add_argument("--no-warm-up", action="store_true",
+                        help="do not load the catalog, indexes and popularity counters up front")
+    args = parser.parse_args(argv)
+    serve(args.socket or socket_path(), warm_up=not args.no_warm_up)
+
+
+if __name__ == "__main__":
+    main()
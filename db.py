@@ -3,49 +3,428 @@
 import mysql.connector
 from mysql.connector import MySQLConnection as Connector
 from dotenv import load_dotenv
-from typing import Optional, List, Dict
+from typing import Any, Callable, Optional, Iterator, List, Dict, Hashable, Sequence
+from contextlib import contextmanager
+from contextvars import ContextVar
+import atexit
+import json
 from my_exceptions import DatabaseConnectionError, QueryExecutionError
+from metrics import QueryMetrics
+from pool import ConnectionPool
+from router import Endpoint, Router
+from rows import ROW_FORMATS, make_rows
+from statements import StatementRegistry
 import os
+import threading
+import time
+import setting as se
 import sql_queries as sql
 
 load_dotenv()
 
+_router: Optional[Router] = None
+_router_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+_factory: Optional[Callable[[], Any]] = None
+_replica_factories: Optional[List[Callable[[], Any]]] = None
+
+# Named statements run as server-side prepared statements unless DB_PREPARED=0.
+statements = StatementRegistry(prepared=os.getenv('DB_PREPARED', str(int(se.PREPARED_STATEMENTS))) != '0')
+
+# Per-statement timings; DB_SLOW_QUERY_MS and DB_SLOW_QUERY_EXPLAIN override the settings.
+metrics = QueryMetrics(
+    slow_threshold=float(os.getenv('DB_SLOW_QUERY_MS', se.SLOW_QUERY_MS)) / 1000,
+    explain=os.getenv('DB_SLOW_QUERY_EXPLAIN', se.SLOW_QUERY_EXPLAIN or '') or None
+)
+
+# Statements executed without a name are grouped under this one.
+UNNAMED = "unnamed"
+
+# Query results fetched by aio.py's async driver, keyed like the search cache.
+# Set while a search runs on an event loop, where MySakilaConnection must not block.
+async_results: ContextVar[Optional[Dict[Hashable, List[Dict]]]] = ContextVar('async_results', default=None)
+
+
+class WouldBlock(Exception):
+    """
+    Raised instead of borrowing a connection while async_results is set; the
+    caller runs the operation again in a worker thread.
+    """
+
+
+class PendingQuery(WouldBlock):
+    """
+    Raised by a search whose result is neither cached nor in async_results;
+    aio.py fetches it with the async driver and runs the search again.
+    """
+    def __init__(self, key: Hashable, name: str, query: str, params: tuple) -> None:
+        super().__init__(name)
+        self.key = key
+        self.name = name
+        self.query = query
+        self.params = params
+
+
+@contextmanager
+def locked(lock: Any) -> Iterator[None]:
+    """
+    Holds a lock like ``with lock:``. While async_results is set, a lock held
+    by another thread raises WouldBlock instead of stalling the event loop.
+    """
+    if not lock.acquire(blocking=async_results.get() is None):
+        raise WouldBlock("lock held by another thread")
+    try:
+        yield
+    finally:
+        lock.release()
+
+
+def _connect(host: Optional[str] = None) -> Connector:
+    """
+    Opens a new connection using the settings from the environment.
+
+    :param host: A replica as "host" or "host:port" (DB_HOST by default).
+    """
+    port = None
+    if host is not None:
+        host, _, port = host.partition(':')
+    return mysql.connector.connect(
+        host=host or os.getenv('DB_HOST'),
+        port=int(port or os.getenv('DB_PORT', 3306)),
+        user=os.getenv('DB_USER'),
+        password=os.getenv('DB_PASSWORD'),
+        database=os.getenv('DB_NAME'),
+        # Pooled connections outlive a single request, so reads must not pin a snapshot.
+        autocommit=True
+    )
+
+
+def _new_pool(factory: Callable[[], Any]) -> ConnectionPool:
+    return ConnectionPool(
+        factory,
+        size=int(os.getenv('DB_POOL_SIZE', se.POOL_SIZE)),
+        max_idle=float(os.getenv('DB_POOL_MAX_IDLE', se.POOL_MAX_IDLE)),
+        timeout=float(os.getenv('DB_POOL_TIMEOUT', se.POOL_TIMEOUT)),
+        ping_interval=float(os.getenv('DB_POOL_PING_INTERVAL', se.POOL_PING_INTERVAL)),
+        on_close=statements.close
+    )
+
+
+def get_router() -> Router:
+    """
+    Returns the process-wide router with a connection pool per server,
+    creating it on first use. The replicas are the DB_REPLICAS servers
+    ("host[:port]" separated by commas), or the factories given to
+    use_connection_factory().
+    """
+    global _router, _router_pid
+    with _pool_lock:
+        # A forked child must not share sockets with its parent.
+        if _router is None or _router_pid != os.getpid():
+            if _replica_factories is not None:
+                replicas = _replica_factories
+            elif _factory is None:
+                hosts = [host.strip() for host in os.getenv('DB_REPLICAS', '').split(',') if host.strip()]
+                replicas = [lambda host=host: _connect(host) for host in hosts]
+            else:
+                replicas = []
+            _router = Router(
+                _new_pool(_factory or _connect),
+                [_new_pool(factory) for factory in replicas],
+                max_lag=float(os.getenv('DB_REPLICA_MAX_LAG', se.REPLICA_MAX_LAG)),
+                check_interval=float(os.getenv('DB_REPLICA_CHECK_INTERVAL', se.REPLICA_CHECK_INTERVAL))
+            )
+            _router_pid = os.getpid()
+        return _router
+
+
+def get_pool() -> ConnectionPool:
+    """
+    Returns the connection pool of the primary server.
+    """
+    return get_router().primary.pool
+
+
+def use_connection_factory(factory: Optional[Callable[[], Any]],
+                           replicas: Optional[Sequence[Callable[[], Any]]] = None) -> None:
+    """
+    Makes the pool open its connections with ``factory`` (None restores the
+    MySQL settings from the environment), e.g. to run against a stand-in.
+    Idle connections of the previous pools are closed.
+
+    :param replicas: Factories of read replicas, e.g. more stand-ins (None
+                     for DB_REPLICAS, or no replicas with a factory).
+    """
+    global _router, _factory, _replica_factories
+    with _pool_lock:
+        _factory = factory
+        _replica_factories = None if replicas is None else list(replicas)
+        if _router is not None and _router_pid == os.getpid():
+            _router.close()
+        _router = None
+
+
+def get_connection_factory() -> Optional[Callable[[], Any]]:
+    """
+    Returns the factory set with use_connection_factory(), or None for MySQL.
+    """
+    return _factory
+
+
+def get_pool_stats() -> Dict:
+    """
+    Returns the usage counters of the primary's connection pool.
+    """
+    return get_pool().stats.as_dict()
+
+
+def get_routing_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Returns the routing counters, health, lag and latency of every server.
+    """
+    return get_router().stats()
+
+
+def get_statement_stats() -> Dict[str, Dict[str, int]]:
+    """
+    Returns the per-statement prepared/text execution counters.
+    """
+    return statements.stats()
+
+
+def get_query_metrics() -> Dict[str, Dict[str, Any]]:
+    """
+    Returns the per-statement timings, row counts, errors and slow executions.
+    """
+    return metrics.to_dict()
+
+
+@atexit.register
+def close_pool() -> None:
+    """
+    Closes the idle connections of the process-wide pools.
+    """
+    if _router is not None and _router_pid == os.getpid():
+        _router.close()
+
+
 class MySakilaConnection:
     connection: Optional[Connector]
     cursor: Optional[mysql.connector.cursor.MySQLCursorDict]
 
-    def __init__(self) -> None:
+    def __init__(self, read_only: bool = False, max_lag: Optional[float] = None) -> None:
+        """
+        :param read_only: Only reads will run, so a replica may serve them.
+        :param max_lag: The most replication lag in seconds those reads
+                        tolerate (DB_REPLICA_MAX_LAG by default).
+        """
+        self.read_only = read_only
+        self.max_lag = max_lag
+        self.router: Optional[Router] = None
+        self.endpoint: Optional[Endpoint] = None
         self.connection = None
         self.cursor = None
+        # Text-protocol cursor returning tuples, created for the first non-dict row format.
+        self._tuple_cursor: Optional[mysql.connector.cursor.MySQLCursor] = None
+        self.pool: Optional[ConnectionPool] = None
+        # Time spent borrowing the connection, charged to the first statement.
+        self._borrow: Optional[float] = None
 
     def __enter__(self) -> "MySakilaConnection":
+        if async_results.get() is not None:
+            raise WouldBlock("MySakilaConnection used on an event loop")
+        self.router = router = get_router()
+        start = time.perf_counter()
+        busy: List[Endpoint] = []
+        while True:
+            self.endpoint = router.route(self.read_only, self.max_lag, busy)
+            self.pool = self.endpoint.pool
+            try:
+                self.connection = self.pool.acquire()
+                break
+            except mysql.connector.Error as e:
+                router.done(self.endpoint)
+                if not self.endpoint.replica:
+                    raise DatabaseConnectionError(f"Database connection error: {e}")
+                # The server failed to connect: out of rotation until a health check succeeds.
+                router.mark_down(self.endpoint, e)
+            except DatabaseConnectionError:
+                router.done(self.endpoint)
+                if not self.endpoint.replica:
+                    raise
+                # Only the pool is exhausted; try another server and leave this one's health alone.
+                router.busy(self.endpoint)
+                busy.append(self.endpoint)
+        self._borrow = time.perf_counter() - start
         try:
-            self.connection = mysql.connector.connect(
-                host=os.getenv('DB_HOST'),
-                user=os.getenv('DB_USER'),
-                password=os.getenv('DB_PASSWORD'),
-                database=os.getenv('DB_NAME')
-            )
             self.cursor = self.connection.cursor(dictionary=True)
             return self
         except mysql.connector.Error as e:
+            self.pool.release(self.connection, discard=True)
+            self.connection = None
+            router.done(self.endpoint)
             raise DatabaseConnectionError(f"Database connection error: {e}")
 
     def __exit__(self, exc_type, exc_value, traceback) -> None:
-        if self.cursor:
-            self.cursor.close()
+        discard = False
+        for cursor in (self.cursor, self._tuple_cursor):
+            if cursor:
+                try:
+                    cursor.close()
+                except mysql.connector.Error:
+                    discard = True
+        self.cursor = self._tuple_cursor = None
         if self.connection:
-            self.connection.close()
+            # Never hand an open transaction (or its read snapshot) to the next borrower.
+            try:
+                if self.connection.in_transaction:
+                    self.connection.rollback()
+            except mysql.connector.Error:
+                discard = True
+            self.pool.release(self.connection, discard=discard)
+            self.connection = None
+            self.router.done(self.endpoint)
 
-    def execute_query(self, query: str, params: Optional[tuple] = None) -> List[Dict]:
+    def execute_query(self, query: str, params: Optional[tuple] = None,
+                      name: Optional[str] = None, row_format: str = "dict") -> Any:
         """
         Executes an SQL query and returns the results.
+
+        :param name: Names a fixed statement so it can run as a prepared statement.
+        :param row_format: "dict" for a list of dicts, "tuple" for a list of
+                           tuples with a ``columns`` attribute, "record" for a
+                           list of ``__slots__`` records of a class per
+                           statement, or "columns" for one list or array per
+                           column (see rows.py).
         """
+        if row_format not in ROW_FORMATS:
+            raise ValueError(f"Invalid row format: {row_format}")
+        dictionary = row_format == "dict"
         try:
-            self.cursor.execute(query, params or ())
+            start = time.perf_counter()
+            cursor = self._execute(query, params, name, dictionary)
+            executed = time.perf_counter()
+            rows = cursor.fetchall()
+            if not dictionary:
+                rows = make_rows(rows, cursor.column_names, row_format, name)
+        except mysql.connector.Error as e:
+            raise self._failed(name, f"Query execution error: {e}, {params}", e)
+        self._observe(name, query, params, executed - start, time.perf_counter() - executed, len(rows))
+        return rows
+
+    def iter_query(self, query: str, params: Optional[tuple] = None, name: Optional[str] = None,
+                   chunk_size: int = 500) -> Iterator[Dict]:
+        """
+        Executes an SQL query and yields its rows, fetching ``chunk_size`` rows
+        at a time so the whole result is never held in memory.
+
+        The rows must be consumed before the connection runs another statement.
+        """
+        try:
+            start = time.perf_counter()
+            cursor = self._execute(query, params, name)
+            execute = time.perf_counter() - start
+            fetch, count = 0.0, 0
+            while True:
+                start = time.perf_counter()
+                rows = cursor.fetchmany(chunk_size)
+                fetch += time.perf_counter() - start
+                if not rows:
+                    break
+                count += len(rows)
+                yield from rows
+        except mysql.connector.Error as e:
+            raise self._failed(name, f"Query execution error: {e}, {params}", e)
+        self._observe(name, query, params, execute, fetch, count)
+
+    def _execute(self, query: str, params: Optional[tuple], name: Optional[str], dictionary: bool = True):
+        """
+        Runs a statement on the prepared cursor registered for its name, or on
+        the text-protocol cursor, and returns the cursor holding the result.
+
+        :param dictionary: Fetch the rows as dicts rather than tuples.
+        """
+        if name is not None and statements.prepared:
+            cursor = statements.cursor_for(self.connection, name, dictionary)
+            try:
+                cursor.execute(query, params or ())
+            except mysql.connector.Error:
+                statements.forget(self.connection, name)
+                raise
+            return cursor
+        if name is not None:
+            statements.count_text(name)
+        if dictionary:
+            cursor = self.cursor
+        else:
+            if self._tuple_cursor is None:
+                self._tuple_cursor = self.connection.cursor()
+            cursor = self._tuple_cursor
+        cursor.execute(query, params or ())
+        return cursor
+
+    def _observe(self, name: Optional[str], query: str, params: Optional[tuple],
+                 execute: float, fetch: float, rows: int) -> None:
+        """
+        Records one execution in the metrics and logs it when it was slow.
+        """
+        borrow, self._borrow = self._borrow, None
+        name = name or UNNAMED
+        if metrics.observe(name, borrow, execute, fetch, rows):
+            metrics.log_slow(name, query, params, (borrow or 0.0) + execute + fetch, self._explain(query, params))
+
+    def _failed(self, name: Optional[str], message: str, error: mysql.connector.Error) -> QueryExecutionError:
+        """
+        Counts a failed execution and builds the error to raise for it.
+        """
+        self._borrow = None
+        metrics.observe_error(name or UNNAMED)
+        return QueryExecutionError(message, query=name, error_code=getattr(error, 'errno', None))
+
+    def _explain(self, query: str, params: Optional[tuple]) -> Optional[List[Dict]]:
+        """
+        Captures the plan of a slow SELECT when DB_SLOW_QUERY_EXPLAIN is
+        "explain" or "analyze"; EXPLAIN ANALYZE runs the query once more.
+        """
+        if metrics.explain not in ('explain', 'analyze') or not query.lstrip().upper().startswith('SELECT'):
+            return None
+        prefix = 'EXPLAIN ANALYZE ' if metrics.explain == 'analyze' else 'EXPLAIN '
+        try:
+            self.cursor.execute(prefix + query, params or ())
             return self.cursor.fetchall()
+        except mysql.connector.Error:
+            return None
+
+    def explain_json(self, query: str, params: Optional[tuple] = None) -> Dict:
+        """
+        Returns the EXPLAIN FORMAT=JSON plan of a statement without running it.
+        """
+        try:
+            self.cursor.execute(sql.sql_explain_json.format(query=query.strip()), params or ())
+            rows = self.cursor.fetchall()
+        except mysql.connector.Error as e:
+            raise QueryExecutionError(f"Query execution error: {e}, {params}", query="explain",
+                                      error_code=getattr(e, 'errno', None))
+        return json.loads(list(rows[0].values())[0])
+
+    def execute_update(self, query: str, params: Optional[tuple] = None) -> int:
+        """
+        Executes a statement that returns no rows and commits it.
+
+        :return: The number of affected rows.
+        """
+        try:
+            start = time.perf_counter()
+            self.cursor.execute(query, params or ())
+            executed = time.perf_counter()
+            if self.cursor.with_rows:
+                self.cursor.fetchall()
+            self.connection.commit()
+            rowcount = self.cursor.rowcount
         except mysql.connector.Error as e:
-            raise QueryExecutionError(f"Query execution error: {e}, {params}")
+            raise self._failed(None, f"Query execution error: {e}, {params}", e)
+        self._observe(None, query, params, executed - start, time.perf_counter() - executed, max(rowcount, 0))
+        return rowcount
 
     def record_user_query(self, query_name: str) -> None:
         """
@@ -55,14 +434,52 @@ class MySakilaConnection:
         """
         query = sql.sql_table_record
         try:
-            self.cursor.execute(query, (query_name,))
+            start = time.perf_counter()
+            cursor = self._execute(query, (query_name,), "table_record")
+            executed = time.perf_counter()
+            self.connection.commit()
+        except mysql.connector.Error as e:
+            raise self._failed("table_record", f"Error executing query: {e}", e)
+        self._observe("table_record", query, (query_name,), executed - start, time.perf_counter() - executed,
+                      max(cursor.rowcount, 0))
+
+    def record_user_queries(self, counts: Dict[str, int], batch_size: int = 500) -> None:
+        """
+        Adds several query counts to the 'queries' table in one transaction.
+
+        :param counts: The number of executions to add per query name.
+        :param batch_size: The maximum number of rows per INSERT statement.
+        """
+        # A fixed key order keeps concurrent writers from deadlocking on the same rows.
+        names = sorted(counts)
+        query, params, affected = "", None, 0
+        try:
+            started = time.perf_counter()
+            if len(names) > batch_size:
+                self.connection.start_transaction()
+            for start in range(0, len(names), batch_size):
+                chunk = names[start:start + batch_size]
+                query = sql.build_table_record_batch(len(chunk))
+                params = tuple(value for name in chunk for value in (name, counts[name]))
+                # Batch sizes vary, so the upsert stays on the text protocol
+                # instead of leaving hundreds of prepared variants per connection.
+                affected += max(self._execute(query, params, None).rowcount, 0)
+            executed = time.perf_counter()
             self.connection.commit()
         except mysql.connector.Error as e:
-            raise QueryExecutionError(f"Error executing query: {e}")
+            try:
+                self.connection.rollback()
+            except mysql.connector.Error:
+                pass
+            raise self._failed("table_record_batch", f"Error executing query: {e}", e)
+        self._observe("table_record_batch", query, params, executed - started, time.perf_counter() - executed,
+                      affected)
 
-    def get_most_popular_queries(self) -> List[Dict]:
+    def get_most_popular_queries(self, row_format: str = "dict") -> Any:
         """
         Returns the top 10 most popular queries.
+
+        :param row_format: The row format, as for execute_query().
         """
         query = sql.sql_popular_queries
-        return self.execute_query(query)
+        return self.execute_query(query, name="popular_queries", row_format=row_format)
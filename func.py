@@ -1,161 +1,655 @@
 # func.py
 
-from db import MySakilaConnection
-from typing import List, Dict, Union
+from db import MySakilaConnection, PendingQuery, WouldBlock, async_results, get_pool_stats, get_router, locked, \
+    metrics
+from typing import Any, Callable, Iterator, List, Dict, Optional, Tuple, Union
+from cache import QueryCache
+from keyword_index import KeywordIndex
+from actor_index import ActorIndex
+from catalog import CatalogCache
+from recorder import QueryRecorder
+from popularity import TopKTracker, WindowedCounter
+from paging import MoviePage, decode_token, make_page
+from planner import ORDERS, CardinalityStats, QueryPlan, SearchCriteria, key_fields, plan_search
+from rows import project
+# The result tables are rendered by render.py, which the thin client shares.
+from render import display_table, display_movies_table, display_movies_actors_table
+import heapq
+import os
+import time
+import threading
+import setting as se
 import sql_queries as sql
-from user_exceptions import MovieNotFoundError
+from my_exceptions import DatabaseConnectionError, QueryExecutionError
+from user_exceptions import MovieNotFoundError, UserInputError
 
+_cache = QueryCache(max_size=se.CACHE_SIZE, ttl=se.CACHE_TTL, negative_ttl=se.CACHE_NEGATIVE_TTL)
+_keyword_index = KeywordIndex(refresh_interval=se.KEYWORD_INDEX_REFRESH, full_reload_interval=se.INDEX_FULL_RELOAD)
+_catalog = CatalogCache()
+_actor_index = ActorIndex(refresh_interval=se.ACTOR_INDEX_REFRESH, threshold=se.ACTOR_MATCH_THRESHOLD,
+                          full_reload_interval=se.INDEX_FULL_RELOAD)
+_recorder = QueryRecorder(flush_size=se.RECORD_FLUSH_SIZE, flush_interval=se.RECORD_FLUSH_INTERVAL,
+                          max_pending=se.RECORD_MAX_PENDING)
+_popular = TopKTracker(k=se.POPULAR_TOP_K, capacity=se.POPULAR_CAPACITY)
+_popular_windows = WindowedCounter(capacity=se.POPULAR_CAPACITY)
+_stats = CardinalityStats(refresh_interval=se.PLANNER_STATS_REFRESH)
+_popular_seeded_at = 0.0
+_popular_seeding: Optional[threading.Event] = None
+_popular_lock = threading.Lock()
+_snapshot = None
+_snapshot_stamp = None
+_snapshot_checked = 0.0
+_snapshot_lock = threading.Lock()
+_similar = None
+_similar_lock = threading.Lock()
 
-def search_movies_by_rating(rating: int) -> List[Dict[str, Union[str, int]]]:
+
+def _cached_query(name: str, sql_query: str, params: tuple, tables: tuple) -> List[Dict]:
     """
-    Searches for movies by rating.
+    Runs a catalog query through the result cache.
+
+    :param name: The query name used in the cache key.
+    :param tables: The tables the query reads, used for invalidation.
     """
-    sql_query = sql.sql_query_rating
-    with MySakilaConnection() as base:
-        results = base.execute_query(sql_query, (rating,))
-    if not results:
+    def load() -> List[Dict]:
+        with MySakilaConnection(read_only=True) as base:
+            return base.execute_query(sql_query, params, name, row_format=_search_row_format())
+
+    key = _cache.make_key(name, params)
+    fetched = async_results.get()
+    if fetched is None:
+        return list(_cache.get_or_load(key, load, tables))
+    # On an event loop: answer from the cache or have aio.py fetch the rows.
+    if key not in fetched:
+        found, rows = _cache.get(key)
+        if not found:
+            raise PendingQuery(key, name, sql_query, params)
+        return list(rows)
+    _cache.put(key, fetched[key], tables)
+    return list(fetched[key])
+
+
+def _search_row_format() -> str:
+    """
+    Returns the row format of the cached search results. The searches read
+    rows by column name, so only the mapping formats qualify.
+    """
+    row_format = os.getenv('SAKILA_ROW_FORMAT', se.SEARCH_ROW_FORMAT)
+    if row_format not in ('dict', 'record'):
+        raise ValueError(f"Invalid search row format: {row_format}")
+    return row_format
+
+
+def _paged_query(name: str, queries: Tuple[str, str], params: tuple, seek: Callable[[list], tuple],
+                 key_fields: Tuple[str, ...], page_size: int, after: Optional[str],
+                 tables: tuple) -> MoviePage:
+    """
+    Runs one page of a keyset-paginated catalog query through the result cache.
+
+    :param queries: The first-page statement and the one continuing after a key.
+    :param seek: Turns the decoded page token into the keyset parameters.
+    :param key_fields: The row fields forming the keyset, in sort order.
+    """
+    _check_page_size(page_size)
+    key = _decode_after(after, len(key_fields))
+    if key is None:
+        rows = _cached_query(name, queries[0], (*params, page_size + 1), tables)
+    else:
+        rows = _cached_query(f"{name}_after", queries[1], (*params, *seek(key), page_size + 1), tables)
+    return make_page(rows, page_size, key_fields)
+
+
+def _use_snapshot() -> bool:
+    return os.getenv('SAKILA_BACKEND', se.SEARCH_BACKEND) == 'snapshot'
+
+
+def _snapshot_engine():
+    """
+    Returns the catalog snapshot, reopening it when the file was replaced.
+    NumPy is only imported when the snapshot backend is used.
+
+    On an event loop the file is not checked: the snapshot is used as last
+    checked for up to SNAPSHOT_CHECK_INTERVAL seconds, after which the
+    search moves to a worker thread that checks it.
+    """
+    global _snapshot, _snapshot_stamp, _snapshot_checked
+    if async_results.get() is not None:
+        if _snapshot is None or time.monotonic() - _snapshot_checked > se.SNAPSHOT_CHECK_INTERVAL:
+            raise WouldBlock("catalog snapshot not checked recently")
+        return _snapshot
+    import snapshot
+    path = os.getenv('SAKILA_SNAPSHOT', se.SNAPSHOT_PATH)
+    try:
+        stat = os.stat(path)
+    except OSError as e:
+        raise DatabaseConnectionError(f"Catalog snapshot unavailable: {e}")
+    with _snapshot_lock:
+        if _snapshot is None or _snapshot_stamp != (stat.st_ino, stat.st_mtime_ns):
+            _snapshot = snapshot.Snapshot(path)
+            _snapshot_stamp = (stat.st_ino, stat.st_mtime_ns)
+        _snapshot_checked = time.monotonic()
+        return _snapshot
+
+
+def _snapshot_page(search: Callable[..., List[Dict]], key_fields: Tuple[str, ...], page_size: int,
+                   after: Optional[str]) -> MoviePage:
+    """
+    Runs one page of a search on the catalog snapshot.
+
+    :param search: Called with the snapshot, the decoded keyset and the row limit.
+    """
+    _check_page_size(page_size)
+    key = _decode_after(after, len(key_fields))
+    return make_page(search(_snapshot_engine(), key, page_size + 1), page_size, key_fields)
+
+
+def _check_page_size(page_size: int) -> None:
+    if page_size < 1:
+        raise UserInputError("The page size must be a positive number.", page_size)
+
+
+def _decode_after(after: Optional[str], size: int) -> Optional[list]:
+    """
+    Decodes a page token, checking that it has the expected number of key fields.
+    """
+    try:
+        key = decode_token(after)
+    except ValueError as e:
+        raise UserInputError(str(e), after)
+    if key is not None and len(key) != size:
+        raise UserInputError("The page token does not belong to this search.", after)
+    return key
+
+
+def invalidate_search_cache(*tables: str) -> int:
+    """
+    Drops cached search results. Call it after the catalog tables change.
+
+    :param tables: Only drop results read from these tables (all results when empty).
+    :return: The number of dropped entries.
+    """
+    if not tables:
+        return _cache.invalidate()
+    return _cache.invalidate_tables(*tables)
+
+
+def _indexed_keyword_search(keyword: str, page_size: int, after: Optional[str]) -> Optional[MoviePage]:
+    """
+    Searches the in-process keyword index, loading or refreshing it first.
+
+    :return: The page of ranked results, or None when the index is unavailable.
+    """
+    if not se.KEYWORD_INDEX:
+        return None
+    try:
+        _keyword_index.ensure_fresh()
+    except (DatabaseConnectionError, QueryExecutionError):
+        # A stale index still beats no index; an index that never loaded does not.
+        if not _keyword_index.ready:
+            return None
+    _check_page_size(page_size)
+    key_fields = ("score", "title", "film_id")
+    rows = _keyword_index.search(keyword, page_size + 1, _decode_after(after, len(key_fields)))
+    return make_page(rows, page_size, key_fields)
+
+
+def _resolve_actor(actor: str) -> Optional[List[int]]:
+    """
+    Resolves an actor's name to actor ids with the in-process actor index.
+
+    :return: The matching ids, or None when the index is unavailable.
+    """
+    if not se.ACTOR_INDEX:
+        return None
+    try:
+        _actor_index.ensure_fresh()
+    except (DatabaseConnectionError, QueryExecutionError):
+        if not _actor_index.ready:
+            return None
+    return _actor_index.resolve(actor)
+
+
+def refresh_catalog() -> None:
+    """
+    Reloads the catalog dimensions and drops the results that depend on them.
+    """
+    _catalog.load()
+    invalidate_search_cache("category")
+
+
+def _genre_id(genre: str) -> Optional[int]:
+    """
+    Maps a genre to its category id with the catalog cache.
+
+    :return: The category id, or None when the cache is unavailable.
+    :raises UserInputError: If there is no such genre.
+    """
+    try:
+        _catalog.ensure_loaded()
+    except (DatabaseConnectionError, QueryExecutionError):
+        return None
+    category_id = _catalog.category_id(genre)
+    if category_id is None:
+        raise UserInputError(f"Unknown genre. Available genres: {', '.join(_catalog.genres())}.", genre)
+    return category_id
+
+
+def get_search_cache_stats() -> Dict[str, int]:
+    """
+    Returns the hit/miss/eviction counters of the search result cache.
+    """
+    return {**_cache.stats.as_dict(), "size": len(_cache)}
+
+
+def get_query_statistics(fmt: str = "summary") -> str:
+    """
+    Formats the per-statement metrics of this process.
+
+    :param fmt: "summary" for the terminal, "json" or "prometheus" for export.
+    """
+    if fmt == "json":
+        return metrics.to_json()
+    router = get_router()
+    if fmt == "prometheus":
+        return metrics.to_prometheus() + (router.to_prometheus() if router.replicas else "")
+    pool = get_pool_stats()
+    summary = (f"{metrics.format_summary()}\n\nConnections: {pool['in_use']} in use, {pool['idle']} idle, "
+               f"{pool['created']} opened; average wait {pool['wait_avg'] * 1000:.2f} ms")
+    if router.replicas:
+        summary += f"\n\n{router.format_summary()}"
+    return summary
+
+
+def get_routing_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Returns how many reads and writes went to the primary and to each
+    replica, with the health, lag and latency the router last measured.
+    """
+    return get_router().stats()
+
+
+def _keyword_matches(keyword: str) -> Optional[List[Dict]]:
+    """
+    Finds the films containing a keyword with the in-process keyword index.
+
+    :return: Every matching film with its score, or None when the index is unavailable.
+    """
+    if not se.KEYWORD_INDEX:
+        return None
+    try:
+        _keyword_index.ensure_fresh()
+    except (DatabaseConnectionError, QueryExecutionError):
+        if not _keyword_index.ready:
+            return None
+    return _keyword_index.search(keyword, None)
+
+
+def _ranked_page(plan: QueryPlan, matches: List[Dict], page_size: int, after: Optional[str]) -> MoviePage:
+    """
+    Ranks the rows of a relevance-ordered plan by their keyword index scores.
+    """
+    key = _decode_after(after, len(plan.key_fields))
+    scores = {match['film_id']: match['score'] for match in matches}
+    rows = [{**row, "score": scores[row['film_id']]}
+            for row in _cached_query(plan.name, plan.queries[0], plan.params, plan.tables)]
+
+    def rank(row: Dict) -> tuple:
+        return (-row['score'], row['title'], row['film_id']) + ((row['actor_id'],) if 'actor_id' in row else ())
+
+    if key is not None:
+        seek = (-key[0], *key[1:])
+        rows = [row for row in rows if rank(row) > seek]
+    return make_page(heapq.nsmallest(page_size + 1, rows, key=rank), page_size, plan.key_fields)
+
+
+def _snapshot_search(criteria: SearchCriteria, rating: Optional[str], keyword_only: bool, page_size: int,
+                     after: Optional[str]) -> MoviePage:
+    """
+    Runs one page of a search on the catalog snapshot.
+
+    Actors are resolved and keyword matches ranked as on the database, so
+    both backends return the same rows: ranked when the keyword index would
+    rank them, film_id order otherwise (see plan_search).
+    """
+    snapshot = _snapshot_engine()
+    category_id = None
+    if criteria.genre is not None:
+        category_id = snapshot.category_id(criteria.genre)
+        if category_id is None:
+            raise UserInputError(f"Unknown genre. Available genres: {', '.join(snapshot.genres())}.",
+                                 criteria.genre)
+    actor_ids = None
+    if criteria.actor is not None and se.ACTOR_INDEX:
+        actor_ids = snapshot.resolve_actor(criteria.actor, se.ACTOR_MATCH_THRESHOLD)
+        if len(actor_ids) > se.PLANNER_MAX_IN_LIST:
+            actor_ids = None
+    ranked = criteria.order == "relevance" and criteria.keyword is not None and se.KEYWORD_INDEX \
+        and (keyword_only or snapshot.count_keyword(criteria.keyword) <= se.PLANNER_MAX_IN_LIST)
+    order = "film_id" if criteria.order == "relevance" and not ranked else criteria.order
+    return _snapshot_page(
+        lambda snapshot, key, limit: snapshot.search(rating, category_id, criteria.year_from, criteria.year_to,
+                                                     criteria.actor, criteria.keyword, ORDERS[order], key, limit,
+                                                     actor_ids),
+        key_fields(order, criteria.actor is not None), page_size, after)
+
+
+def _rating_value(criteria: SearchCriteria) -> Optional[str]:
+    if criteria.rating is None:
+        return None
+    rating = _catalog.rating_value(criteria.rating)
+    if rating is None:
+        raise UserInputError("Unknown rating.", criteria.rating)
+    return rating
+
+
+def _plan(criteria: SearchCriteria, rating: Optional[str]) -> Tuple[QueryPlan, Optional[List[Dict]]]:
+    """
+    Resolves the genre, actor and keyword in memory and plans the statement.
+
+    :return: The plan and the keyword index matches (None without a keyword).
+    """
+    category_id = None if criteria.genre is None else _genre_id(criteria.genre)
+    actor_ids = None if criteria.actor is None else _resolve_actor(criteria.actor)
+    matches = None if criteria.keyword is None else _keyword_matches(criteria.keyword)
+    try:
+        _stats.ensure_fresh()
+    except (DatabaseConnectionError, QueryExecutionError):
+        # Planned with the default estimates; the search itself may still work.
+        pass
+    plan = plan_search(criteria, _stats, rating, category_id, actor_ids,
+                       None if matches is None else [match['film_id'] for match in matches])
+    return plan, matches
+
+
+def search_plan(criteria: SearchCriteria) -> QueryPlan:
+    """
+    Returns the statement the database backend runs for a search, e.g. to
+    check its execution plan.
+    """
+    return _plan(criteria, _rating_value(criteria))[0]
+
+
+def _search(criteria: SearchCriteria, page_size: int, after: Optional[str]) -> MoviePage:
+    """
+    Runs one page of a search with a single statement planned by planner.py.
+
+    The rating, genre, actor and keyword are first resolved in memory (rating
+    value, category id, actor ids, matching films), so the statement looks
+    them up by id where it can. With the snapshot backend, the snapshot
+    answers every search instead.
+    """
+    _check_page_size(page_size)
+    rating = _rating_value(criteria)
+    keyword_only = criteria.keyword is not None and rating is None and criteria.genre is None \
+        and criteria.actor is None and criteria.year_from is None and criteria.year_to is None
+    if _use_snapshot():
+        return _snapshot_search(criteria, rating, keyword_only, page_size, after)
+
+    if keyword_only and criteria.order == "relevance":
+        results = _indexed_keyword_search(criteria.keyword, page_size, after)
+        if results is not None:
+            return results
+    plan, matches = _plan(criteria, rating)
+    if plan.empty:
+        return MoviePage()
+    if plan.ranked:
+        return _ranked_page(plan, matches, page_size, after)
+    return _paged_query(plan.name, plan.queries, plan.params, plan.seek, plan.key_fields, page_size, after,
+                        plan.tables)
+
+
+def search_movies(rating: Optional[Union[int, str]] = None, genre: Optional[str] = None,
+                  year: Optional[int] = None, year_from: Optional[int] = None, year_to: Optional[int] = None,
+                  actor: Optional[str] = None, keyword: Optional[str] = None, order: str = "film_id",
+                  page_size: int = se.PAGE_SIZE, after: Optional[str] = None) -> MoviePage:
+    """
+    Searches for movies matching every given filter, in one round trip.
+
+    :param year: A single release year; year_from and year_to give a range.
+    :param order: "film_id", "newest", "oldest" or "relevance" (by keyword;
+                  film_id order when the keyword matches more than
+                  PLANNER_MAX_IN_LIST films).
+    :param page_size: The number of movies per page.
+    :param after: The next_token of the previous page.
+    """
+    criteria = SearchCriteria(rating, genre, year, year_from, year_to, actor, keyword, order)
+    results = _search(criteria, page_size, after)
+    if not results and after is None:
+        raise MovieNotFoundError(f"No movies match {criteria}.")
+    return results
+
+
+def search_movies_by_rating(rating: int, page_size: int = se.PAGE_SIZE,
+                            after: Optional[str] = None) -> MoviePage:
+    """
+    Searches for movies by rating, the newest first.
+
+    :param rating: The menu number (1-5), the rating label or the enum value.
+    :param page_size: The number of movies per page.
+    :param after: The next_token of the previous page.
+    """
+    results = _search(SearchCriteria(rating=rating, order="newest"), page_size, after)
+    if not results and after is None:
         raise MovieNotFoundError(f"Movies rating '{rating}' not found.")
     return results
 
 
-def search_movies_by_keyword(keyword: str) -> List[Dict[str, Union[str, int]]]:
+def search_movies_by_keyword(keyword: str, page_size: int = se.PAGE_SIZE,
+                             after: Optional[str] = None) -> MoviePage:
     """
-    Searches for movies by keyword.
+    Searches for movies by keyword, the most relevant first.
+
+    :param page_size: The number of movies per page.
+    :param after: The next_token of the previous page.
     """
-    sql_query = sql.sql_query_keyword
-    with MySakilaConnection() as base:
-        results = base.execute_query(sql_query, (f"%{keyword.lower()}%", f"%{keyword.lower()}%"))
-    if not results:
+    results = _search(SearchCriteria(keyword=keyword, order="relevance"), page_size, after)
+    if not results and after is None:
         raise MovieNotFoundError(f"Movies with the keyword '{keyword}' not found.")
     return results
 
 
-def search_movies_by_genre_and_year(genre: str, year: int) -> List[Dict]:
+def search_movies_by_genre_and_year(genre: str, year: int, page_size: int = se.PAGE_SIZE,
+                                    after: Optional[str] = None) -> MoviePage:
     """
     Searches for movies by genre and year.
+
+    :param page_size: The number of movies per page.
+    :param after: The next_token of the previous page.
     """
-    sql_query = sql.sql_query_genre_year
-    with MySakilaConnection() as base:
-        results = base.execute_query(sql_query, (genre.lower(), year))
-    if not results:
+    results = _search(SearchCriteria(genre=genre, year=year), page_size, after)
+    if not results and after is None:
         raise MovieNotFoundError(f"Movies with the genre '{genre}' and release year {year} not found.")
     return results
 
 
-def search_movies_by_actor_and_year(actor: str, year: int) -> List[Dict]:
+def search_movies_by_actor_and_year(actor: str, year: int, page_size: int = se.PAGE_SIZE,
+                                    after: Optional[str] = None) -> MoviePage:
     """
     Searches for movies by actor and year.
+
+    :param page_size: The number of movies per page.
+    :param after: The next_token of the previous page.
     """
-    sql_query = sql.sql_query_actor_year
-    actor_name = f"%{actor.lower()}%" if actor else ""
-    with MySakilaConnection() as base:
-        results = base.execute_query(sql_query, (actor_name, actor_name, year))
-    if not results:
+    results = _search(SearchCriteria(actor=actor, year=year), page_size, after)
+    if not results and after is None:
         raise MovieNotFoundError(f"Movies with actor '{actor.title()}' and release year {year} not found.")
     return results
 
 
+def _similar_engine():
+    """
+    Returns the similar-films index, loading or refreshing it first. NumPy is
+    only imported when similar films are searched.
+    """
+    global _similar
+    if _similar is None and async_results.get() is not None:
+        # Importing NumPy is left to a worker thread.
+        raise WouldBlock("similar-films index not created yet")
+    with locked(_similar_lock):
+        if _similar is None:
+            from similar import SimilarFilms
+            _similar = SimilarFilms(refresh_interval=se.SIMILAR_REFRESH, metric=se.SIMILAR_METRIC,
+                                    full_reload_interval=se.INDEX_FULL_RELOAD, retry_interval=se.SIMILAR_RETRY)
+    try:
+        _similar.ensure_fresh()
+    except (DatabaseConnectionError, QueryExecutionError):
+        # The last index still answers while the database is down.
+        if not _similar.ready:
+            raise
+    return _similar
+
+
+def search_similar_movies(title: str, page_size: int = se.PAGE_SIZE, after: Optional[str] = None) -> MoviePage:
+    """
+    Searches for the movies most similar to a movie, by shared actors,
+    categories and rating.
+
+    :param title: The movie's title, or a part of it that only one title contains.
+    :param page_size: The number of movies per page.
+    :param after: The next_token of the previous page.
+    """
+    _check_page_size(page_size)
+    key_fields = ("score", "film_id")
+    key = _decode_after(after, len(key_fields))
+    engine = _similar_engine()
+    film_id = engine.resolve(title)
+    results = make_page(engine.similar(film_id, page_size + 1, key), page_size, key_fields)
+    if not results and after is None:
+        raise MovieNotFoundError(f"No movies similar to '{title}' found.")
+    return results
+
+
+def iter_search(search: Callable[..., MoviePage], *args, page_size: int = 500,
+                **kwargs) -> Iterator[Dict]:
+    """
+    Yields every movie a search finds, following the page tokens, so that only
+    one page is held in memory at a time.
+
+    :param search: One of the search_movies_* functions.
+    """
+    after = None
+    while True:
+        try:
+            page = search(*args, page_size=page_size, after=after, **kwargs)
+        except MovieNotFoundError:
+            return
+        yield from page
+        if page.next_token is None:
+            return
+        after = page.next_token
+
+
 def record_user_query(query_name: str) -> None:
     """
     Records or updates the user's query in the database.
+
+    With write-behind enabled the count is buffered and written in the background.
     """
+    if _popular.seeded:
+        _popular.add(query_name)
+    _popular_windows.add(query_name)
+    if se.RECORD_WRITE_BEHIND:
+        _recorder.record(query_name)
+        return
     with MySakilaConnection() as base:
         base.record_user_query(query_name)
 
 
-def get_popular_queries() -> List[Dict[str, Union[str, int]]]:
+def record_user_queries(counts: Dict[str, int]) -> None:
     """
-    Returns the top 10 most popular queries with their execution counts.
+    Records many query executions at once, e.g. the searches of a batch run.
+
+    :param counts: The number of executions per query name.
     """
-    with MySakilaConnection() as base:
-        result = base.get_most_popular_queries()
+    for query_name, count in counts.items():
+        if _popular.seeded:
+            _popular.add(query_name, count)
+        _popular_windows.add(query_name, count)
+        if se.RECORD_WRITE_BEHIND:
+            _recorder.record(query_name, count)
+    if not se.RECORD_WRITE_BEHIND and counts:
+        with MySakilaConnection() as base:
+            base.record_user_queries(counts)
+
+
+def flush_recorded_queries() -> int:
+    """
+    Writes the buffered query counts to the database now.
+
+    :return: The number of query names written.
+    """
+    return _recorder.flush()
+
+
+def get_popular_queries(window: Optional[str] = None) -> List[Dict[str, Union[str, int]]]:
+    """
+    Returns the top 10 most popular queries with their execution counts.
 
+    Lifetime counts come from the in-memory top-K tracker, which is seeded from
+    the head of the 'queries' table and re-seeded every POPULAR_RESEED seconds
+    to pick up other processes' writes. Windowed counts come from the rollups
+    kept by record_user_query in this process, so they are only meaningful in
+    a long-lived one such as the daemon (client.py asks nothing else for them).
+
+    :param window: None for lifetime counts, or 'hour', 'day' or 'week'.
+    """
+    if window is None:
+        _seed_popular_queries()
+        top = _popular.top()
+    else:
+        top = _popular_windows.top(window, se.POPULAR_TOP_K)
     queries_with_description = []
-    for row in result:
+    for name, count in top:
         queries_with_description.append({
-            "query": row['query_name'],
-            "count": row['execution_count']
+            "query": name,
+            "count": count
         })
 
     return queries_with_description
 
-    #----------------------------------------------------------------------
 
-def display_table(data: List[Dict[str, Union[str, int]]]) -> None:
+def _seed_popular_queries(force: bool = False) -> None:
     """
-    Displays data in a table format using symbols.
+    Seeds the top-K tracker from the database when it is missing or stale.
 
-    :param data: A list of dictionaries with keys 'query' and 'count'.
+    One thread seeds at a time, without holding _popular_lock. While it does,
+    the others keep the stale counts, or wait for it when there are none.
     """
-    if not data:
-        print("No data to display.")
+    global _popular_seeded_at, _popular_seeding
+    with _popular_lock:
+        if not force and _popular.seeded and time.monotonic() - _popular_seeded_at < se.POPULAR_RESEED:
+            return
+        seeding = _popular_seeding
+        if seeding is None:
+            _popular_seeding = threading.Event()
+    if seeding is not None:
+        if not _popular.seeded:
+            seeding.wait()
         return
+    try:
+        # Our own buffered counts must be in the table before it is read back.
+        flush_recorded_queries()
+        # Read from the primary: a replica may not have the counts just flushed yet.
+        with MySakilaConnection() as base:
+            rows = base.execute_query(sql.sql_popular_queries_head, (_popular.capacity + 1,), row_format="columns")
+        _popular.seed(project(rows, ("query_name", "execution_count")), complete=len(rows) <= _popular.capacity)
+        with _popular_lock:
+            _popular_seeded_at = time.monotonic()
+    finally:
+        with _popular_lock:
+            seeding, _popular_seeding = _popular_seeding, None
+        seeding.set()
 
-    query_header = "Queries"
-    count_header = "Counts"
-    
-    query_width = max(len(row['query']) for row in data) + 1 if data else len(query_header) + 1
-    count_width = len(count_header) + 0
-    
-    print('-' * (query_width + count_width + 7))
-    print(f"| {query_header.ljust(query_width)} | {count_header.rjust(count_width)} |")
-    print('-' * (query_width + count_width + 7))
-    
-    for row in data:
-        query = row['query'].ljust(query_width)
-        count = str(row['count']).rjust(count_width)
-        print(f"| {query} | {count} |")
-    
-    print('-' * (query_width + count_width + 7))
-
-
-def display_movies_table(movies: List[Dict[str, Union[str, int]]]) -> None:
-    """
-    Displays a list of movies in a table format using symbols.
-
-    :param movies: A list of dictionaries with keys 'title' and 'release_year'.
-    """
-    title_header = "Movies"
-    year_header = "Release Year"
-    
-    title_width = max(len(movie['title']) for movie in movies) + 2 if movies else len(title_header) + 2
-    year_width = len(year_header) + 2
-    
-    print('-' * (title_width + year_width + 7))
-    print(f"| {title_header.ljust(title_width)} | {year_header.rjust(year_width)} |")
-    print('-' * (title_width + year_width + 7))
-    
-    for movie in movies:
-        title = movie['title'].ljust(title_width)
-        year = str(movie['release_year']).rjust(year_width)
-        print(f"| {title} | {year} |")
-    
-    print('-' * (title_width + year_width + 7))
-
-
-def display_movies_actors_table(movies: List[Dict[str, Union[str, int]]]) -> None:
-    """
-    Displays a list of movies and actors in a table format using symbols.
-
-    :param movies: A list of dictionaries with keys 'title', 'release_year' and 'actor'.
-    """
-    title_header = "Movies"
-    year_header = "Release Year"
-    actor_header = "Actors"
-    
-    title_width = max(len(movie['title']) for movie in movies) + 2 if movies else len(title_header) + 2
-    year_width = len(year_header) + 0
-    actor_width = max(len(movie['actor_name']) for movie in movies) + 2 if movies else len(actor_header) + 2
-    
-    print('-' * (title_width + year_width + actor_width + 10))
-    print(f"| {title_header.ljust(title_width)} | {year_header.rjust(year_width)} | {actor_header.ljust(actor_width)} |")
-    print('-' * (title_width + year_width + actor_width + 10))
-    
-    for movie in movies:
-        title = movie['title'].ljust(title_width)
-        year = str(movie['release_year']).rjust(year_width)
-        actor = movie['actor_name'].ljust(actor_width)
-        print(f"| {title} | {year} | {actor} |")
-    
-    print('-' * (title_width + year_width + actor_width + 10))
 
+def warm_up() -> None:
+    """
+    Loads the catalog, the in-process indexes and the popularity tracker up
+    front, so a long-lived process answers its first queries from memory.
+    """
+    _catalog.ensure_loaded()
+    if se.KEYWORD_INDEX:
+        _keyword_index.ensure_fresh()
+    if se.ACTOR_INDEX:
+        _actor_index.ensure_fresh()
+    _stats.ensure_fresh()
+    _seed_popular_queries()
@@ -0,0 +1,135 @@
+# keyword_index.py
+
+import heapq
+import re
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Union
+from db import locked
+from table_index import TableIndex
+import sql_queries as sql
+
+NGRAM = 3
+_WORD = re.compile(r"\w+")
+
+
+def _ngrams(text: str) -> Set[str]:
+    return {text[i:i + NGRAM] for i in range(len(text) - NGRAM + 1)}
+
+
+def relevance(title_lc: str, description_lc: str, needle: str) -> float:
+    """
+    Scores how well a lower-cased keyword matches a film's lower-cased title
+    and description, 0 when it matches neither. Also used by snapshot.py.
+    """
+    in_title = title_lc.count(needle)
+    in_description = description_lc.count(needle)
+    if not in_title and not in_description:
+        return 0.0
+    score = 3.0 * in_title + in_description
+    words = _WORD.findall(title_lc) + _WORD.findall(description_lc)
+    if needle in words:
+        score += 2.0
+    if title_lc.startswith(needle):
+        score += 1.0
+    return score
+
+
+class _Film:
+    __slots__ = ("film_id", "title", "release_year", "title_lc", "description_lc")
+
+    def __init__(self, row: Dict) -> None:
+        self.film_id = row['film_id']
+        self.title = row['title']
+        self.release_year = row['release_year']
+        self.title_lc = (row['title'] or "").lower()
+        self.description_lc = (row['description'] or "").lower()
+
+
+class KeywordIndex(TableIndex):
+    """
+    An in-process trigram index over film titles and descriptions.
+
+    It answers the same substring question as ``LIKE '%kw%'`` without scanning
+    the ``film`` table: the trigrams of the keyword select candidate films,
+    which are then verified and ranked by relevance. The index is loaded once
+    and refreshed incrementally from ``film.last_update``.
+    """
+    sql_all = sql.sql_film_text_all
+    sql_since = sql.sql_film_text_since
+    sql_count = sql.sql_film_count
+    data_attributes = ("films", "postings")
+
+    def __init__(self, refresh_interval: float = 60.0, full_reload_interval: float = 3600.0) -> None:
+        super().__init__(refresh_interval, full_reload_interval)
+        self.films: Dict[int, _Film] = {}
+        self.postings: Dict[str, Set[int]] = {}
+
+    def search(self, keyword: str, limit: Optional[int] = 10,
+               after: Optional[Sequence] = None) -> List[Dict[str, Union[str, int, float]]]:
+        """
+        Returns the films whose title or description contains the keyword,
+        the most relevant first.
+
+        :param keyword: The keyword to look for (case-insensitive).
+        :param limit: The maximum number of films, or None for all of them.
+        :param after: The (score, title, film_id) of the last film of the
+                      previous page; only films ranked below it are returned.
+        """
+        needle = keyword.lower()
+        with locked(self._lock):
+            grams = _ngrams(needle)
+            if grams:
+                candidates = None
+                for gram in sorted(grams, key=lambda g: len(self.postings.get(g, ()))):
+                    posting = self.postings.get(gram)
+                    if not posting:
+                        return []
+                    candidates = set(posting) if candidates is None else candidates & posting
+                    if not candidates:
+                        return []
+                films = [self.films[film_id] for film_id in candidates]
+            else:
+                films = list(self.films.values())
+            ranked = [((-score, film.title, film.film_id), film) for film in films
+                      if (score := self._score(film, needle)) > 0]
+
+        if after is not None:
+            seek = (-after[0], after[1], after[2])
+            ranked = [item for item in ranked if item[0] > seek]
+        if limit is not None:
+            ranked = heapq.nsmallest(limit, ranked, key=lambda item: item[0])
+        else:
+            ranked.sort(key=lambda item: item[0])
+        return [{"film_id": film.film_id, "title": film.title, "release_year": film.release_year,
+                 "score": -key[0]} for key, film in ranked]
+
+    @staticmethod
+    def _score(film: _Film, needle: str) -> float:
+        return relevance(film.title_lc, film.description_lc, needle)
+
+    def _clear(self) -> None:
+        self.films = {}
+        self.postings = {}
+
+    def _add_rows(self, rows: List[Dict]) -> None:
+        for row in rows:
+            film = _Film(row)
+            previous = self.films.get(film.film_id)
+            if previous is not None:
+                self._unindex(previous)
+            self.films[film.film_id] = film
+            for gram in _ngrams(film.title_lc) | _ngrams(film.description_lc):
+                self.postings.setdefault(gram, set()).add(film.film_id)
+
+    def __len__(self) -> int:
+        return len(self.films)
+
+    def _ids(self) -> Iterable[int]:
+        return self.films.keys()
+
+    def _unindex(self, film: _Film) -> None:
+        for gram in _ngrams(film.title_lc) | _ngrams(film.description_lc):
+            posting = self.postings.get(gram)
+            if posting is not None:
+                posting.discard(film.film_id)
+                if not posting:
+                    del self.postings[gram]
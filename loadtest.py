@@ -0,0 +1,359 @@
+# loadtest.py
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+import db
+import func
+import setting as se
+from benchmark import ACTORS_PER_SCALE, CATEGORIES, FIRST_NAMES, LAST_NAMES, NOUNS, STORY_WORDS, \
+    percentiles, populate_standin
+from standin import StandInDatabase
+from user_exceptions import MovieNotFoundError
+
+# Menu options driven by the load test and their default share of the requests
+SCENARIOS = {
+    '1': "search_by_rating",
+    '2': "search_by_keyword",
+    '3': "search_by_genre_and_year",
+    '4': "search_by_actor_and_year",
+    '5': "popular_queries",
+}
+DEFAULT_MIX = {'1': 25, '2': 30, '3': 20, '4': 15, '5': 10}
+
+YEARS = range(1990, 2024)
+
+
+class Zipf:
+    """
+    Draws values with Zipf's law: the k-th value is picked with a probability
+    proportional to 1 / k**s, so a few values are very popular and most are rare.
+
+    The values are shuffled with ``seed`` first, so popularity does not follow
+    their (often alphabetical) order.
+    """
+    def __init__(self, values: Sequence, s: float = 1.1, seed: int = 42) -> None:
+        self.values = list(values)
+        random.Random(seed).shuffle(self.values)
+        self.cum_weights = list(itertools.accumulate(1 / rank ** s for rank in range(1, len(self.values) + 1)))
+
+    def sample(self, rnd: random.Random):
+        return rnd.choices(self.values, cum_weights=self.cum_weights)[0]
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """
+    Parses a scenario mix like "1=25,2=30,5=10" (menu option = weight).
+    """
+    mix = {}
+    for part in text.split(","):
+        option, _, weight = part.partition("=")
+        option = option.strip()
+        if option not in SCENARIOS or not weight:
+            raise argparse.ArgumentTypeError(f"Invalid scenario weight: {part!r}")
+        mix[option] = float(weight)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("At least one scenario needs a positive weight.")
+    return mix
+
+
+def _scenarios(scale: float, s: float, seed: int) -> Dict[str, Callable[[random.Random], None]]:
+    """
+    Returns one call per menu option. Like main.py, every search is followed by
+    recording it as a user query.
+    """
+    actor_count = min(len(FIRST_NAMES) * len(LAST_NAMES), max(1, int(ACTORS_PER_SCALE * scale)))
+    actors = Zipf([f"{first} {last}".lower() for first in FIRST_NAMES for last in LAST_NAMES][:actor_count],
+                  s, seed)
+    keywords = Zipf([word.lower() for word in NOUNS + STORY_WORDS], s, seed + 1)
+    genres = Zipf(CATEGORIES, s, seed + 2)
+    ratings = Zipf(range(1, se.RATING_LEN + 1), s, seed + 3)
+    years = Zipf(YEARS, s, seed + 4)
+
+    def search(call: Callable, *args, record: str) -> None:
+        try:
+            call(*args)
+        except MovieNotFoundError:
+            pass
+        func.record_user_query(record)
+
+    def by_rating(rnd: random.Random) -> None:
+        rating = ratings.sample(rnd)
+        search(func.search_movies_by_rating, rating, record=f"Rating: {rating}")
+
+    def by_keyword(rnd: random.Random) -> None:
+        keyword = keywords.sample(rnd)
+        search(func.search_movies_by_keyword, keyword, record=f"Keyword: {keyword}")
+
+    def by_genre_and_year(rnd: random.Random) -> None:
+        genre, year = genres.sample(rnd), years.sample(rnd)
+        search(func.search_movies_by_genre_and_year, genre, year, record=f"Genre: {genre}; Year: {year}")
+
+    def by_actor_and_year(rnd: random.Random) -> None:
+        actor, year = actors.sample(rnd), years.sample(rnd)
+        search(func.search_movies_by_actor_and_year, actor, year,
+               record=f"Actor: {actor.title()}; Year: {year}")
+
+    def popular(rnd: random.Random) -> None:
+        func.get_popular_queries(rnd.choice(list(se.WINDOW_CHOICES.values())))
+
+    return {'1': by_rating, '2': by_keyword, '3': by_genre_and_year, '4': by_actor_and_year, '5': popular}
+
+
+def _setup(config: Dict) -> None:
+    """
+    Points db.py at the load test target; runs once in every process.
+    """
+    if config["pool_size"]:
+        os.environ['DB_POOL_SIZE'] = str(config["pool_size"])
+    if config["sync_record"]:
+        se.RECORD_WRITE_BEHIND = False
+    if config["database"]:
+        db.use_connection_factory(StandInDatabase(config["database"]).connect,
+                                  [StandInDatabase(path).connect for path in config["replicas"]])
+    else:
+        db.use_connection_factory(None)
+
+
+def _worker(worker_id: int, config: Dict, begin: float, result: Dict, lock: threading.Lock) -> None:
+    """
+    Sends requests until the warm-up and the measured duration are over.
+
+    With a target rate each worker follows a fixed schedule and latency counts
+    from the scheduled start, so a slow server cannot hide its queueing delay
+    by delaying the next request (coordinated omission).
+    """
+    rnd = random.Random(config["seed"] * 1000 + worker_id)
+    calls = _scenarios(config["scale"], config["zipf"], config["seed"])
+    options = list(config["mix"])
+    weights = list(itertools.accumulate(config["mix"][option] for option in options))
+    interval = config["workers"] / config["rate"] if config["rate"] else 0.0
+    measure_from = begin + config["warmup"]
+    end = measure_from + config["duration"]
+    samples: Dict[str, List[float]] = {option: [] for option in options}
+    errors: Dict[str, Dict[str, int]] = {option: {} for option in options}
+    # Spread the first requests of the workers over one interval.
+    scheduled = begin + interval * rnd.random()
+    while True:
+        if interval:
+            delay = scheduled - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            started = scheduled
+            scheduled += interval
+        else:
+            started = time.monotonic()
+        if started >= end:
+            break
+        option = rnd.choices(options, cum_weights=weights)[0]
+        if config["cold"]:
+            func.invalidate_search_cache()
+        try:
+            calls[option](rnd)
+        except Exception as e:
+            if started >= measure_from:
+                kind = type(e).__name__
+                errors[option][kind] = errors[option].get(kind, 0) + 1
+            continue
+        if started >= measure_from:
+            samples[option].append(time.monotonic() - started)
+    with lock:
+        for option in options:
+            result["samples"][option].extend(samples[option])
+            for kind, count in errors[option].items():
+                result["errors"][option][kind] = result["errors"][option].get(kind, 0) + count
+
+
+def _run_process(config: Dict, threads: int, first_worker: int, barrier=None) -> Dict:
+    """
+    Runs ``threads`` workers in this process and samples its connection pool.
+    """
+    _setup(config)
+    result = {"samples": {option: [] for option in config["mix"]},
+              "errors": {option: {} for option in config["mix"]}}
+    lock = threading.Lock()
+    if barrier is not None:
+        barrier.wait()
+    begin = time.monotonic()
+    workers = [threading.Thread(target=_worker, args=(first_worker + i, config, begin, result, lock), daemon=True)
+               for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    peak = 0
+    while any(worker.is_alive() for worker in workers):
+        peak = max(peak, db.get_pool_stats()["in_use"])
+        time.sleep(0.05)
+    func.flush_recorded_queries()
+    pool = db.get_pool_stats()
+    result["connections"] = {"opened": pool["created"], "peak_in_use": peak, "timeouts": pool["timeouts"],
+                             "wait_avg_ms": pool["wait_avg"] * 1000, "wait_max_ms": pool["wait_max"] * 1000}
+    result["routing"] = db.get_routing_stats()
+    return result
+
+
+def _process_main(config: Dict, threads: int, first_worker: int, barrier, queue) -> None:
+    try:
+        queue.put(_run_process(config, threads, first_worker, barrier))
+    except BaseException as e:
+        barrier.abort()
+        queue.put({"failed": f"{type(e).__name__}: {e}"})
+
+
+def run_load(config: Dict) -> Dict:
+    """
+    Runs the load test described by ``config`` and returns the report.
+
+    ``config["workers"]`` threads are spread evenly over ``config["processes"]``
+    processes; with one process they run in this one.
+    """
+    processes = max(1, min(config["processes"], config["workers"]))
+    per_process = [config["workers"] // processes + (i < config["workers"] % processes) for i in range(processes)]
+    first_workers = list(itertools.accumulate([0] + per_process[:-1]))
+    if processes == 1:
+        results = [_run_process(config, config["workers"], 0)]
+    else:
+        context = multiprocessing.get_context("spawn")
+        barrier = context.Barrier(processes)
+        queue = context.Queue()
+        children = [context.Process(target=_process_main, args=(config, threads, first, barrier, queue))
+                    for threads, first in zip(per_process, first_workers)]
+        for child in children:
+            child.start()
+        results = [queue.get() for _ in children]
+        for child in children:
+            child.join()
+        failures = [result["failed"] for result in results if "failed" in result]
+        if failures:
+            raise RuntimeError(f"A load test process failed: {failures[0]}")
+    return _report(config, results)
+
+
+def _report(config: Dict, results: List[Dict]) -> Dict:
+    duration = config["duration"]
+    scenarios = {}
+    total_requests = total_errors = 0
+    for option in config["mix"]:
+        samples = [sample for result in results for sample in result["samples"][option]]
+        errors: Dict[str, int] = {}
+        for result in results:
+            for kind, count in result["errors"][option].items():
+                errors[kind] = errors.get(kind, 0) + count
+        failed = sum(errors.values())
+        total_requests += len(samples) + failed
+        total_errors += failed
+        row = {key: value for key, value in percentiles(samples).items() if key != "ops_per_sec"} \
+            if samples else {"count": 0}
+        row["requests_per_sec"] = (len(samples) + failed) / duration
+        row["error_rate"] = failed / (len(samples) + failed) if samples or failed else 0.0
+        row["errors"] = errors
+        scenarios[SCENARIOS[option]] = row
+    connections = {key: sum(result["connections"][key] for result in results)
+                   for key in ("opened", "peak_in_use", "timeouts")}
+    connections["wait_max_ms"] = max(result["connections"]["wait_max_ms"] for result in results)
+    all_samples = [sample for result in results for samples in result["samples"].values() for sample in samples]
+    overall = {key: value for key, value in percentiles(all_samples).items() if key != "ops_per_sec"} \
+        if all_samples else {"count": 0}
+    overall["requests_per_sec"] = total_requests / duration
+    overall["error_rate"] = total_errors / total_requests if total_requests else 0.0
+    routing = {name: {key: sum(result["routing"][name][key] for result in results)
+                      for key in ("reads", "writes", "fallback_reads", "lag_skips", "busy_skips", "failures")}
+               for name in results[0]["routing"]}
+    return {"config": {key: value for key, value in config.items() if key not in ("database", "replicas")},
+            "overall": overall, "scenarios": scenarios, "connections": connections, "routing": routing}
+
+
+def print_report(report: Dict) -> None:
+    print(f"{'scenario':28} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} {'errors':>7}")
+    rows = list(report["scenarios"].items()) + [("total", report["overall"])]
+    for name, row in rows:
+        if not row["count"]:
+            print(f"{name:28} {row['requests_per_sec']:8.1f} {'-':>9} {'-':>9} {'-':>9} {'-':>9} "
+                  f"{row['error_rate']:7.1%}")
+            continue
+        print(f"{name:28} {row['requests_per_sec']:8.1f} {row['p50_ms']:9.2f} {row['p95_ms']:9.2f} "
+              f"{row['p99_ms']:9.2f} {row['max_ms']:9.2f} {row['error_rate']:7.1%}")
+    for name, row in report["scenarios"].items():
+        for kind, count in sorted(row["errors"].items()):
+            print(f"  {name}: {count} x {kind}")
+    connections = report["connections"]
+    print(f"\nConnections: {connections['opened']} opened, peak {connections['peak_in_use']} in use, "
+          f"{connections['timeouts']} pool timeouts, longest wait {connections['wait_max_ms']:.1f} ms")
+    if len(report["routing"]) > 1:
+        print("Routing: " + ", ".join(f"{name} {row['reads']} reads/{row['writes']} writes"
+                                      for name, row in report["routing"].items()))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Command-line entry point: prepare the target, run the load and print the report.
+    """
+    parser = argparse.ArgumentParser(description="Drive the func.py API with many concurrent users.")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent simulated users (default: 8)")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="spread the workers over this many processes (default: 1, threads only)")
+    parser.add_argument("--rate", type=float, default=0,
+                        help="target requests per second over all workers (default: 0, as fast as possible)")
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds (default: 30)")
+    parser.add_argument("--warmup", type=float, default=5, help="unmeasured seconds before that (default: 5)")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help="menu option weights, e.g. 1=25,2=30,3=20,4=15,5=10")
+    parser.add_argument("--zipf", type=float, default=1.1, help="Zipf exponent of the search parameters")
+    parser.add_argument("--pool-size", type=int, help="connections per process (default: DB_POOL_SIZE)")
+    parser.add_argument("--sync-record", action="store_true",
+                        help="upsert every recorded query immediately instead of write-behind")
+    parser.add_argument("--cold", action="store_true", help="bypass the search result cache")
+    parser.add_argument("--scale", type=float, default=1, help="stand-in data scale factor (default: 1)")
+    parser.add_argument("--target", choices=("standin", "mysql"), default="standin",
+                        help="an SQLite stand-in or the MySQL database from the environment")
+    parser.add_argument("--database", help="stand-in database file to create or reuse (default: temporary)")
+    parser.add_argument("--skip-generate", action="store_true", help="reuse the data already in the stand-in")
+    parser.add_argument("--replicas", type=int, default=0,
+                        help="stand-in read replicas, copies of the database (default: 0; mysql: DB_REPLICAS)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    args = parser.parse_args(argv)
+    if args.workers < 1 or args.duration <= 0 or args.warmup < 0 or args.rate < 0:
+        parser.error("--workers and --duration must be positive, --warmup and --rate not negative")
+
+    database, replicas = None, []
+    if args.target == "standin":
+        database = args.database or os.path.join(tempfile.mkdtemp(prefix="sakila-load-"), "sakila.db")
+        if not args.skip_generate:
+            populate_standin(database, args.scale, args.seed)
+        for i in range(1, args.replicas + 1):
+            replicas.append(StandInDatabase(database).copy(f"{database}.replica{i}").path)
+    config = {
+        "workers": args.workers,
+        "processes": args.processes,
+        "rate": args.rate,
+        "duration": args.duration,
+        "warmup": args.warmup,
+        "mix": {option: weight for option, weight in args.mix.items() if weight > 0},
+        "zipf": args.zipf,
+        "pool_size": args.pool_size,
+        "sync_record": args.sync_record,
+        "cold": args.cold,
+        "scale": args.scale,
+        "target": args.target,
+        "database": database,
+        "replicas": replicas,
+        "seed": args.seed,
+    }
+    report = run_load(config)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
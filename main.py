@@ -1,9 +1,9 @@
 # main.py
 
-import func
+# The client runs the operations on the daemon (daemon.py) when it is running
+# and falls back to importing func.py otherwise.
+import client
 import ui
-from my_exceptions import DatabaseConnectionError, QueryExecutionError
-from db import MySakilaConnection
 from typing import List, Dict, Union, Tuple
 
 
@@ -37,36 +37,47 @@ def main() -> None:
     try:
         if choice == '1':
             rating = ui.get_rating()
-            movies = func.search_movies_by_rating(rating)
-            func.display_movies_table(movies)
+            movies = client.search_movies_by_rating(rating)
+            client.display_movies_table(movies)
             record_queries_from_movies(f"Rating: {rating}")
 
         elif choice == '2':
             keyword = ui.get_keyword()
-            movies = func.search_movies_by_keyword(keyword)
-            func.display_movies_table(movies)
+            movies = client.search_movies_by_keyword(keyword)
+            client.display_movies_table(movies)
             record_queries_from_movies(f"Keyword: {keyword}")
 
         elif choice == '3':
             genre, year = ui.get_genre_and_year()
-            movies = func.search_movies_by_genre_and_year(genre, year)
-            func.display_movies_table(movies)
+            movies = client.search_movies_by_genre_and_year(genre, year)
+            client.display_movies_table(movies)
             record_queries_from_movies(f"Genre: {genre}; Year: {year}")
 
         elif choice == '4':
             actor, year = ui.get_actor_and_year()
-            movies = func.search_movies_by_actor_and_year(actor, year)
-            func.display_movies_actors_table(movies)
+            movies = client.search_movies_by_actor_and_year(actor, year)
+            client.display_movies_actors_table(movies)
             user_input = f"Actor: {actor.title()}; Year: {year}"
             record_queries_from_movies(f"Actor: {actor.title()}; Year: {year}")
 
         elif choice == '5':
-            popular_queries = func.get_popular_queries()
+            # The time windows are counted by the daemon; without it only lifetime counts exist.
+            window = ui.get_popular_window() if client.connect() else None
+            popular_queries = client.get_popular_queries(window)
             if popular_queries:
                 print("Popular queries:")
-                func.display_table(popular_queries)
+                client.display_table(popular_queries)
             else:
                 print("No popular queries found.")
+
+        elif choice == '6':
+            print(client.get_query_statistics())
+
+        elif choice == '7':
+            title = ui.get_title()
+            movies = client.search_similar_movies(title)
+            client.display_movies_table(movies)
+            record_queries_from_movies(f"Similar: {title}")
         else:
             raise ValueError("Invalid scenario selection.")
     except Exception as e:
@@ -79,7 +90,7 @@ def record_queries_from_movies(query_name: str) -> None:
 
     :param query_name: The name of the query to record.
     """
-    func.record_user_query(query_name)
+    client.record_user_query(query_name)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,141 @@
+# maintenance.py
+
+import argparse
+import sys
+from typing import Dict, List, Optional
+from db import MySakilaConnection
+import plans
+import setting as se
+import sql_queries as sql
+
+
+def applied_migrations() -> Dict[int, Dict]:
+    """
+    Returns the applied migrations by version, creating the schema_migrations
+    table on first use.
+    """
+    with MySakilaConnection() as base:
+        base.execute_update(sql.sql_create_migrations_table)
+        return {row['version']: row for row in base.execute_query(sql.sql_applied_migrations)}
+
+
+def migrate(target: Optional[int] = None) -> List[int]:
+    """
+    Applies the pending migrations of sql.MIGRATIONS in version order.
+
+    Each migration creates the indexes that do not exist yet and is then
+    recorded in schema_migrations, so running it again, or after the indexes
+    were created by hand, changes nothing.
+
+    :param target: Stop after this version (all migrations by default).
+    :return: The versions applied now.
+    """
+    applied = applied_migrations()
+    done = []
+    with MySakilaConnection() as base:
+        for version, description, indexes in sql.MIGRATIONS:
+            if target is not None and version > target:
+                break
+            if version in applied:
+                continue
+            for table, name, columns in indexes:
+                if base.execute_query(sql.sql_index_exists, (table, name))[0]['found']:
+                    continue
+                base.execute_update(sql.sql_create_index.format(name=name, table=table, columns=columns))
+            base.execute_update(sql.sql_record_migration, (version, description))
+            done.append(version)
+    return done
+
+
+def create_indexes() -> List[str]:
+    """
+    Creates the supporting indexes that do not exist yet by applying the
+    pending migrations.
+
+    :return: The names of the indexes of the applied migrations.
+    """
+    applied = set(migrate())
+    return [name for version, _, indexes in sql.MIGRATIONS if version in applied for _, name, _ in indexes]
+
+
+def prune_queries(max_count: int = 1, batch_size: int = 1000, optimize: bool = False) -> int:
+    """
+    Deletes the long tail of queries executed at most ``max_count`` times.
+
+    Rows are deleted in batches so that no single statement holds locks on a
+    large part of the table.
+
+    :param max_count: Queries with this many executions or fewer are deleted.
+    :param batch_size: The number of rows deleted per statement.
+    :param optimize: Rebuild the table afterwards to give the space back.
+    :return: The number of deleted rows.
+    """
+    deleted = 0
+    with MySakilaConnection() as base:
+        while True:
+            affected = base.execute_update(sql.sql_prune_queries, (max_count, batch_size))
+            deleted += affected
+            if affected < batch_size:
+                break
+        if optimize:
+            base.execute_update(sql.sql_optimize_table.format(table='queries'))
+    return deleted
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Command-line entry point for database maintenance.
+    """
+    parser = argparse.ArgumentParser(description="MySakila database maintenance.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate_command = commands.add_parser("migrate", aliases=["create-indexes"],
+                                          help="apply the pending schema migrations (supporting indexes)")
+    migrate_command.add_argument("--to", type=int, help="stop after this migration version")
+    migrate_command.add_argument("--status", action="store_true", help="list the migrations and exit")
+    check = commands.add_parser("check-plans", help="compare the execution plans of the statements with a baseline")
+    check.add_argument("--baseline", help=f"baseline file (default: {se.PLAN_BASELINE})")
+    check.add_argument("--update", action="store_true", help="store the current plans as the baseline")
+    check.add_argument("--tolerance", type=float, default=se.PLAN_ROWS_TOLERANCE,
+                       help=f"allowed growth of the examined rows (default: {se.PLAN_ROWS_TOLERANCE})")
+    prune = commands.add_parser("prune", help="delete rarely used queries from the 'queries' table")
+    prune.add_argument("--max-count", type=int, default=1,
+                       help="delete queries executed at most this many times (default: 1)")
+    prune.add_argument("--batch-size", type=int, default=1000)
+    prune.add_argument("--optimize", action="store_true", help="run OPTIMIZE TABLE afterwards")
+    args = parser.parse_args(argv)
+
+    if args.command in ("migrate", "create-indexes"):
+        if args.status:
+            applied = applied_migrations()
+            for version, description, _ in sql.MIGRATIONS:
+                state = f"applied {applied[version]['applied_at']}" if version in applied else "pending"
+                print(f"{version:4}  {description:52} {state}")
+            return 0
+        done = migrate(args.to)
+        print(f"Applied migrations: {', '.join(map(str, done))}" if done else "No pending migrations.")
+    elif args.command == "check-plans":
+        path = args.baseline or se.PLAN_BASELINE
+        current = plans.collect_plans()
+        if args.update:
+            plans.save_baseline(path, current)
+            print(f"Stored {len(current)} plans in {path}.")
+            return 0
+        try:
+            baseline = plans.load_baseline(path)
+        except FileNotFoundError:
+            print(f"No plan baseline at {path}; store one with --update.", file=sys.stderr)
+            return 2
+        regressions = plans.compare_plans(current, baseline, args.tolerance)
+        if regressions:
+            print("Plan regressions against the baseline:")
+            print("\n".join(regressions))
+            return 1
+        print(f"No plan regressions in {len(current)} statements.")
+    elif args.command == "prune":
+        deleted = prune_queries(args.max_count, args.batch_size, args.optimize)
+        print(f"Deleted {deleted} queries.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
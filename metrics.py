@@ -0,0 +1,194 @@
+# metrics.py
+
+import json
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+slow_log = logging.getLogger("sakila.slow")
+
+PHASES = ("borrow", "execute", "fetch")
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class Histogram:
+    """
+    A log-linear histogram in the spirit of HdrHistogram.
+
+    Values are multiplied by ``scale`` (seconds become microseconds by default)
+    and counted in buckets that split every power of two into ``SUB_BUCKETS``
+    linear steps, so any recorded value is reproduced within ~6% while memory
+    stays a few hundred integers at most.
+    """
+    SUB_BUCKETS = 16
+
+    def __init__(self, scale: float = 1_000_000) -> None:
+        self.scale = scale
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max = 0.0
+
+    def record(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = max(self.max, value)
+        index = self._index(int(value * self.scale))
+        self.counts[index] = self.counts.get(index, 0) + 1
+
+    def quantile(self, q: float) -> float:
+        """
+        Returns the value below which a fraction ``q`` of the recordings fall.
+        """
+        if not self.count:
+            return 0.0
+        rank = max(1, int(round(q * self.count)))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self._upper(index) / self.scale, self.max)
+        return self.max
+
+    def as_dict(self) -> Dict[str, float]:
+        result = {"count": self.count, "sum": self.total, "min": self.min or 0.0, "max": self.max}
+        for q in QUANTILES:
+            result[f"p{int(q * 100)}"] = self.quantile(q)
+        return result
+
+    @classmethod
+    def _index(cls, micros: int) -> int:
+        if micros < cls.SUB_BUCKETS:
+            return micros
+        shift = micros.bit_length() - cls.SUB_BUCKETS.bit_length()
+        return (shift + 1) * cls.SUB_BUCKETS + (micros >> shift) - cls.SUB_BUCKETS
+
+    @classmethod
+    def _upper(cls, index: int) -> int:
+        if index < cls.SUB_BUCKETS:
+            return index
+        shift = index // cls.SUB_BUCKETS - 1
+        return ((index % cls.SUB_BUCKETS + cls.SUB_BUCKETS + 1) << shift) - 1
+
+
+class StatementMetrics:
+    """
+    Timings, row counts and outcomes of one named statement.
+    """
+    def __init__(self) -> None:
+        self.phases = {phase: Histogram() for phase in PHASES}
+        self.rows = Histogram(scale=1)
+        self.errors = 0
+        self.slow = 0
+        self.last_plan: Optional[List[Dict]] = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        result: Dict[str, Any] = {phase: histogram.as_dict() for phase, histogram in self.phases.items()}
+        result["rows"] = self.rows.as_dict()
+        result["errors"] = self.errors
+        result["slow"] = self.slow
+        if self.last_plan is not None:
+            result["last_plan"] = self.last_plan
+        return result
+
+
+class QueryMetrics:
+    """
+    Per-statement instrumentation collected by MySakilaConnection.
+
+    Statements slower than ``slow_threshold`` seconds are written to the
+    "sakila.slow" logger and, when ``explain`` is "explain" or "analyze", get
+    their plan captured with EXPLAIN / EXPLAIN ANALYZE.
+    """
+    def __init__(self, slow_threshold: float = 0.2, explain: Optional[str] = None) -> None:
+        self.slow_threshold = slow_threshold
+        self.explain = explain
+        self.statements: Dict[str, StatementMetrics] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, borrow: Optional[float], execute: float, fetch: float, rows: int) -> bool:
+        """
+        Records one execution.
+
+        :param borrow: The time spent getting a connection, or None when the
+                       statement reused the connection of an earlier one.
+        :return: True if the execution was slow.
+        """
+        with self._lock:
+            statement = self.statements.setdefault(name, StatementMetrics())
+            if borrow is not None:
+                statement.phases["borrow"].record(borrow)
+            statement.phases["execute"].record(execute)
+            statement.phases["fetch"].record(fetch)
+            statement.rows.record(rows)
+            slow = (borrow or 0.0) + execute + fetch >= self.slow_threshold
+            if slow:
+                statement.slow += 1
+        return slow
+
+    def observe_error(self, name: str) -> None:
+        with self._lock:
+            self.statements.setdefault(name, StatementMetrics()).errors += 1
+
+    def log_slow(self, name: str, query: str, params: Optional[tuple], elapsed: float,
+                 plan: Optional[List[Dict]] = None) -> None:
+        """
+        Writes a slow execution to the slow-query log.
+        """
+        if plan is not None:
+            with self._lock:
+                self.statements.setdefault(name, StatementMetrics()).last_plan = plan
+        slow_log.warning("slow query %s took %.1f ms, params=%r, sql=%s%s", name, elapsed * 1000, params,
+                         " ".join(query.split()), f", plan={plan}" if plan is not None else "")
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {name: statement.as_dict() for name, statement in sorted(self.statements.items())}
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2, default=str)
+
+    def to_prometheus(self) -> str:
+        """
+        Exports the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        data = self.to_dict()
+        for phase in PHASES:
+            metric = f"sakila_query_{phase}_seconds"
+            lines.append(f"# TYPE {metric} summary")
+            for name, statement in data.items():
+                values = statement[phase]
+                for q in QUANTILES:
+                    lines.append(f'{metric}{{statement="{name}",quantile="{q}"}} {values[f"p{int(q * 100)}"]:.6f}')
+                lines.append(f'{metric}_sum{{statement="{name}"}} {values["sum"]:.6f}')
+                lines.append(f'{metric}_count{{statement="{name}"}} {values["count"]}')
+        for metric, key, kind in (("sakila_query_rows_total", "rows", "counter"),
+                                  ("sakila_query_errors_total", "errors", "counter"),
+                                  ("sakila_query_slow_total", "slow", "counter")):
+            lines.append(f"# TYPE {metric} {kind}")
+            for name, statement in data.items():
+                value = statement[key]["sum"] if key == "rows" else statement[key]
+                lines.append(f'{metric}{{statement="{name}"}} {value:.0f}')
+        return "\n".join(lines) + "\n"
+
+    def format_summary(self) -> str:
+        """
+        Formats a one-line-per-statement summary for the terminal.
+        """
+        data = self.to_dict()
+        if not data:
+            return "No queries have been executed yet."
+        width = max(28, *map(len, data))
+        header = f"{'Statement':{width}} {'Calls':>6} {'Borrow p50':>11} {'Exec p50':>9} {'Exec p99':>9} " \
+                 f"{'Fetch p50':>10} {'Rows avg':>9} {'Slow':>5} {'Errors':>6}"
+        lines = [header, "-" * len(header)]
+        for name, s in data.items():
+            calls = s["execute"]["count"]
+            rows = s["rows"]["sum"] / s["rows"]["count"] if s["rows"]["count"] else 0
+            lines.append(f"{name:{width}} {calls:6} {s['borrow']['p50'] * 1000:9.2f}ms "
+                         f"{s['execute']['p50'] * 1000:7.2f}ms {s['execute']['p99'] * 1000:7.2f}ms "
+                         f"{s['fetch']['p50'] * 1000:8.2f}ms {rows:9.1f} {s['slow']:5} {s['errors']:6}")
+        return "\n".join(lines)
@@ -31,3 +31,8 @@ class QueryExecutionError(Exception):
             parts.append(f"(Error Code: {self.error_code})")
         return ' '.join(parts)
 
+
+class QueryTimeoutError(QueryExecutionError):
+    """
+    Exception raised when a query does not finish within its timeout.
+    """
@@ -0,0 +1,57 @@
+# paging.py
+
+import base64
+import json
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+
+class MoviePage(list):
+    """
+    One page of search results.
+
+    It is an ordinary list of rows, so existing callers keep working, with a
+    ``next_token`` to pass as ``after`` for the following page (None on the
+    last page).
+    """
+    def __init__(self, rows: Iterable[Dict] = (), next_token: Optional[str] = None) -> None:
+        super().__init__(rows)
+        self.next_token = next_token
+
+
+def encode_token(key: Sequence[Any]) -> str:
+    """
+    Encodes the sort key of the last row of a page as an opaque page token.
+    """
+    raw = json.dumps(list(key), separators=(",", ":"), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_token(token: Optional[str]) -> Optional[List[Any]]:
+    """
+    Decodes a page token back into the sort key, or None for the first page.
+
+    :raises ValueError: If the token is malformed.
+    """
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        key = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid page token: {token}") from e
+    if not isinstance(key, list):
+        raise ValueError(f"Invalid page token: {token}")
+    return key
+
+
+def make_page(rows: List[Dict], page_size: int, key_fields: Sequence[str]) -> MoviePage:
+    """
+    Builds a page from up to ``page_size + 1`` rows; the extra row only tells
+    that another page exists.
+
+    :param key_fields: The row fields forming the keyset, in sort order.
+    """
+    if len(rows) <= page_size:
+        return MoviePage(rows)
+    rows = rows[:page_size]
+    return MoviePage(rows, encode_token([rows[-1][field] for field in key_fields]))
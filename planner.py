@@ -0,0 +1,406 @@
+# planner.py
+
+import logging
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from db import MySakilaConnection, locked
+from my_exceptions import DatabaseConnectionError, QueryExecutionError
+import setting as se
+import sql_queries as sql
+from user_exceptions import UserInputError
+
+log = logging.getLogger("sakila.planner")
+
+# Sort orders: (row field, descending) pairs. The keyset is the sort key plus
+# actor_id when the actor filter returns one row per (film, actor) pair.
+ORDERS = {
+    "film_id": (("film_id", False),),
+    "newest": (("release_year", True), ("film_id", False)),
+    "oldest": (("release_year", False), ("film_id", False)),
+    # Ranked by the keyword index; without it the searches fall back to film_id.
+    "relevance": (("score", True), ("title", False), ("film_id", False)),
+}
+
+# Share of the films a filter is assumed to keep when it has no statistics
+DEFAULT_SELECTIVITY = {
+    "rating": 0.2,
+    "year": 0.1,
+    "genre": 0.06,
+    "actor": 0.03,
+    "keyword": 0.05,
+}
+
+# Plans with longer actor or keyword id lists are rebuilt for every search
+# instead of cached, so a cache entry holds at most this many ids per list
+PLAN_CACHE_MAX_IDS = 32
+
+# Film count assumed before the statistics are loaded
+DEFAULT_FILMS = 1000
+
+
+class SearchCriteria:
+    """
+    A combination of search filters; every given filter must match.
+
+    :param year: A single release year, the same as year_from=year_to=year.
+    :param order: One of ORDERS.
+    """
+    __slots__ = ("rating", "genre", "year_from", "year_to", "actor", "keyword", "order", "_key")
+
+    def __init__(self, rating: Any = None, genre: Optional[str] = None, year: Optional[int] = None,
+                 year_from: Optional[int] = None, year_to: Optional[int] = None, actor: Optional[str] = None,
+                 keyword: Optional[str] = None, order: str = "film_id") -> None:
+        if year is not None:
+            year_from = year_to = year
+        if order not in ORDERS:
+            raise UserInputError(f"Unknown sort order. Use one of: {', '.join(ORDERS)}.", order)
+        try:
+            year_from = None if year_from is None else int(year_from)
+            year_to = None if year_to is None else int(year_to)
+        except (TypeError, ValueError):
+            raise UserInputError("The year must be a number.", year_from if year_to is None else year_to)
+        if year_from is not None and year_to is not None and year_from > year_to:
+            raise UserInputError("The year range is empty.", f"{year_from}-{year_to}")
+        if rating is None and genre is None and actor is None and keyword is None \
+                and year_from is None and year_to is None:
+            raise UserInputError("Give at least one filter.", None)
+        self.rating = rating
+        self.genre = genre
+        self.year_from = year_from
+        self.year_to = year_to
+        self.actor = actor
+        self.keyword = keyword
+        self.order = order
+        # Criteria are not modified after construction; plans are cached by this key.
+        self._key = (rating, genre, year_from, year_to, actor, keyword, order)
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, SearchCriteria) and self._key == other._key
+
+    def __hash__(self) -> int:
+        return hash(self._key)
+
+    def __str__(self) -> str:
+        """
+        Names the search the way main.py names the queries it records.
+        """
+        parts = []
+        if self.rating is not None:
+            parts.append(f"Rating: {self.rating}")
+        if self.keyword is not None:
+            parts.append(f"Keyword: {self.keyword}")
+        if self.genre is not None:
+            parts.append(f"Genre: {self.genre}")
+        if self.actor is not None:
+            parts.append(f"Actor: {self.actor.title()}")
+        if self.year_from is not None and self.year_from == self.year_to:
+            parts.append(f"Year: {self.year_from}")
+        elif self.year_from is not None or self.year_to is not None:
+            parts.append(f"Years: {self.year_from or ''}-{self.year_to or ''}")
+        if self.order != "film_id":
+            parts.append(f"Order: {self.order}")
+        return "; ".join(parts)
+
+
+def key_fields(order: str, actor: bool) -> Tuple[str, ...]:
+    """
+    Returns the row fields forming the keyset of a sort order.
+    """
+    return tuple(field for field, _ in ORDERS[order]) + (("actor_id",) if actor else ())
+
+
+class CardinalityStats:
+    """
+    Film counts per rating, release year, category and actor, read with three
+    GROUP BY statements and re-read every ``refresh_interval`` seconds.
+
+    The planner only compares estimates, so stale counts cost at most a
+    worse join order, never a wrong result. That is why, once loaded, they
+    are re-read by a background thread while searches keep planning with
+    the old ones.
+    """
+    def __init__(self, refresh_interval: float = 300.0) -> None:
+        self.refresh_interval = refresh_interval
+        self.films = 0
+        self.by_rating: Dict[str, int] = {}
+        self.by_year: Dict[int, int] = {}
+        self.by_category: Dict[int, int] = {}
+        self.by_actor: Dict[int, int] = {}
+        self.loaded_at: Optional[float] = None
+        self.attempted_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.loaded_at is not None
+
+    def load(self) -> None:
+        with MySakilaConnection(read_only=True) as base:
+            films = base.execute_query(sql.sql_stats_film, name="stats_film")
+            categories = base.execute_query(sql.sql_stats_category, name="stats_category")
+            actors = base.execute_query(sql.sql_stats_actor, name="stats_actor")
+        by_rating: Dict[str, int] = {}
+        by_year: Dict[int, int] = {}
+        for row in films:
+            by_rating[row['rating']] = by_rating.get(row['rating'], 0) + row['films']
+            if row['release_year'] is not None:
+                by_year[row['release_year']] = by_year.get(row['release_year'], 0) + row['films']
+        with self._lock:
+            self.films = sum(row['films'] for row in films)
+            self.by_rating = by_rating
+            self.by_year = by_year
+            self.by_category = {row['category_id']: row['films'] for row in categories}
+            self.by_actor = {row['actor_id']: row['films'] for row in actors}
+            self.loaded_at = time.monotonic()
+
+    def ensure_fresh(self) -> None:
+        """
+        Loads the statistics on first use and starts a background re-read
+        when they are older than ``refresh_interval``.
+        """
+        if self.ready:
+            if self._stale() and self._refresh_lock.acquire(blocking=False):
+                if self._stale():
+                    self.attempted_at = time.monotonic()
+                    threading.Thread(target=self._refresh, name="planner-stats", daemon=True).start()
+                else:
+                    self._refresh_lock.release()
+            return
+        with locked(self._refresh_lock):
+            # Checked again: another thread may have loaded them meanwhile.
+            if not self.ready:
+                self.attempted_at = time.monotonic()
+                self.load()
+
+    def _stale(self) -> bool:
+        # A failed re-read is retried one interval later, not on the next search.
+        return time.monotonic() - max(self.loaded_at, self.attempted_at or 0) > self.refresh_interval
+
+    def _refresh(self) -> None:
+        try:
+            self.load()
+        except (DatabaseConnectionError, QueryExecutionError) as e:
+            log.warning("Re-reading the planner statistics failed: %s", e)
+        finally:
+            self._refresh_lock.release()
+
+    def default(self, kind: str) -> float:
+        return DEFAULT_SELECTIVITY[kind] * (self.films if self.ready else DEFAULT_FILMS)
+
+    def rating(self, value: str) -> float:
+        return self.by_rating.get(value, 0) if self.ready else self.default("rating")
+
+    def years(self, year_from: Optional[int], year_to: Optional[int]) -> float:
+        if not self.ready:
+            span = 1 if year_from == year_to else 5
+            return min(1.0, DEFAULT_SELECTIVITY["year"] * span) * DEFAULT_FILMS
+        return sum(count for year, count in self.by_year.items()
+                   if (year_from is None or year >= year_from) and (year_to is None or year <= year_to))
+
+    def category(self, category_id: Optional[int]) -> float:
+        if category_id is None or not self.ready:
+            return self.default("genre")
+        return self.by_category.get(category_id, 0)
+
+    def actors(self, actor_ids: Optional[Sequence[int]]) -> float:
+        if actor_ids is None or not self.ready:
+            return self.default("actor")
+        return sum(self.by_actor.get(actor_id, 0) for actor_id in actor_ids)
+
+
+class QueryPlan:
+    """
+    One parameterized statement answering a search.
+
+    :ivar queries: The first-page statement and the one continuing after a key.
+    :ivar ranked: The statement returns every match unsorted, to be ranked by
+                  the keyword index scores (queries[1] is then unused). Only
+                  planned when the matches are looked up by id, so at most
+                  PLANNER_MAX_IN_LIST films are fetched.
+    :ivar empty: An in-memory lookup already proved there are no results.
+    """
+    __slots__ = ("name", "queries", "params", "key_fields", "tables", "ranked", "empty")
+
+    def __init__(self, name: str, queries: Tuple[str, str], params: tuple, key_fields: Tuple[str, ...],
+                 tables: Tuple[str, ...], ranked: bool = False, empty: bool = False) -> None:
+        self.name = name
+        self.queries = queries
+        self.params = params
+        self.key_fields = key_fields
+        self.tables = tables
+        self.ranked = ranked
+        self.empty = empty
+
+    def seek(self, key: Sequence[Any]) -> tuple:
+        """
+        Turns a decoded page token into the keyset parameters.
+        """
+        # (k0 OR (= k0 AND (k1 OR (= k1 AND k2)))) takes every key but the last twice.
+        return tuple(value for value in key[:-1] for _ in range(2)) + (key[-1],)
+
+
+def _seek_condition(columns: Sequence[Tuple[str, bool]]) -> str:
+    """
+    Builds the keyset condition "after this sort key" for mixed directions.
+    """
+    column, descending = columns[0]
+    condition = f"{column} {'<' if descending else '>'} %s"
+    if len(columns) == 1:
+        return condition
+    return f"({condition} OR ({column} = %s AND {_seek_condition(columns[1:])}))"
+
+
+def _in_list(column: str, ids: Tuple[int, ...]) -> Tuple[int, str, tuple]:
+    """
+    Builds "column IN (...)" for the smallest bucket size holding the ids.
+    The list is padded by repeating the last id, so the statement text, and
+    with it the prepared statement, depends on the bucket and not the count.
+
+    :return: The bucket size, the condition and its parameters.
+    """
+    size = next((bucket for bucket in se.PLANNER_IN_LIST_BUCKETS if bucket >= len(ids)), len(ids))
+    # An empty list is never run (the plan is empty), but must still be valid SQL.
+    padded = ids + (ids[-1] if ids else 0,) * (size - len(ids))
+    return size, f"{column} IN ({', '.join(['%s'] * size)})", padded
+
+
+@lru_cache(maxsize=None)
+def build_search(columns: str, source: str, conditions: Tuple[str, ...],
+                 order: Optional[Tuple[Tuple[str, bool], ...]], after: bool) -> str:
+    """
+    Assembles a search statement. The same string object is returned for the
+    same shape so it can stay prepared.
+
+    :param order: The sort columns, or None for an unsorted, unlimited statement.
+    """
+    where = "\n        AND ".join(conditions)
+    if order is None:
+        return sql.sql_search_all.format(columns=columns, source=source, where=where)
+    if after:
+        where += "\n        AND " + _seek_condition(order)
+    return sql.sql_search.format(columns=columns, source=source, where=where,
+                                 order=", ".join(f"{column} DESC" if descending else column
+                                                 for column, descending in order))
+
+
+def plan_search(criteria: SearchCriteria, stats: CardinalityStats, rating: Optional[str] = None,
+                category_id: Optional[int] = None, actor_ids: Optional[List[int]] = None,
+                keyword_ids: Optional[List[int]] = None) -> QueryPlan:
+    """
+    Plans one statement for a combination of filters.
+
+    Each filter becomes a condition with an estimated number of matching
+    films. The filter with the fewest drives the statement: its table comes
+    first in FROM and its condition first in WHERE, followed by the others
+    in order of selectivity.
+
+    :param rating: The rating enum value of criteria.rating.
+    :param category_id: The id of criteria.genre, or None to match the name.
+    :param actor_ids: The ids of criteria.actor from the actor index, or None
+                      to match the name with LIKE (as when there are more
+                      than PLANNER_MAX_IN_LIST).
+    :param keyword_ids: The films matching criteria.keyword from the keyword
+                        index, or None to match it with LIKE (likewise).
+    """
+    actor_ids = None if actor_ids is None else tuple(actor_ids)
+    keyword_ids = None if keyword_ids is None else tuple(keyword_ids)
+    # Plans are reused until the statistics are re-read.
+    plan = _plan
+    if max(len(actor_ids or ()), len(keyword_ids or ())) > PLAN_CACHE_MAX_IDS:
+        plan = _plan.__wrapped__
+    return plan(criteria, stats, stats.loaded_at, rating, category_id, actor_ids, keyword_ids)
+
+
+@lru_cache(maxsize=1024)
+def _plan(criteria: SearchCriteria, stats: CardinalityStats, loaded_at: Optional[float], rating: Optional[str],
+          category_id: Optional[int], actor_ids: Optional[Tuple[int, ...]],
+          keyword_ids: Optional[Tuple[int, ...]]) -> QueryPlan:
+    predicates: List[Tuple[float, str, str, str, tuple]] = []  # estimate, name, table, condition, params
+    tables = ["film"]
+    empty = False
+    if criteria.rating is not None:
+        predicates.append((stats.rating(rating), "rating", "f", "f.rating = %s", (rating,)))
+    if criteria.year_from is not None or criteria.year_to is not None:
+        estimate = stats.years(criteria.year_from, criteria.year_to)
+        if criteria.year_from == criteria.year_to:
+            predicates.append((estimate, "year", "f", "f.release_year = %s", (criteria.year_from,)))
+        elif criteria.year_to is None:
+            predicates.append((estimate, "year_from", "f", "f.release_year >= %s", (criteria.year_from,)))
+        elif criteria.year_from is None:
+            predicates.append((estimate, "year_to", "f", "f.release_year <= %s", (criteria.year_to,)))
+        else:
+            predicates.append((estimate, "years", "f", "f.release_year BETWEEN %s AND %s",
+                               (criteria.year_from, criteria.year_to)))
+    if criteria.genre is not None:
+        tables.append("film_category")
+        if category_id is not None:
+            predicates.append((stats.category(category_id), "category_id", "fc", "fc.category_id = %s",
+                               (category_id,)))
+        else:
+            tables.append("category")
+            predicates.append((stats.category(None), "genre", "fc", "LOWER(ca.name) = %s",
+                               (criteria.genre.lower(),)))
+    if criteria.actor is not None:
+        tables += ["film_actor", "actor"]
+        if actor_ids is not None and len(actor_ids) <= se.PLANNER_MAX_IN_LIST:
+            empty = empty or not actor_ids
+            size, condition, params = _in_list("fa.actor_id", actor_ids)
+            predicates.append((stats.actors(actor_ids), f"actor_ids/{size}", "fa", condition, params))
+        else:
+            pattern = f"%{criteria.actor.lower()}%" if criteria.actor else ""
+            predicates.append((stats.default("actor"), "actor", "fa",
+                               "(LOWER(CONCAT(a.last_name, a.first_name)) LIKE %s"
+                               "\n        OR LOWER(CONCAT(a.first_name, a.last_name)) LIKE %s)", (pattern, pattern)))
+    keyword_listed = keyword_ids is not None and len(keyword_ids) <= se.PLANNER_MAX_IN_LIST
+    if criteria.keyword is not None:
+        if keyword_listed:
+            empty = empty or not keyword_ids
+            size, condition, params = _in_list("f.film_id", keyword_ids)
+            predicates.append((len(keyword_ids), f"keyword_ids/{size}", "f", condition, params))
+        else:
+            pattern = f"%{criteria.keyword.lower()}%"
+            estimate = len(keyword_ids) if keyword_ids is not None else stats.default("keyword")
+            predicates.append((estimate, "keyword", "f", "(LOWER(f.title) LIKE %s OR LOWER(f.description) LIKE %s)",
+                               (pattern, pattern)))
+    predicates.sort(key=lambda predicate: predicate[0])
+
+    driver = predicates[0][2]
+    if driver == "fc":
+        source = ["film_category AS fc", "JOIN film AS f ON f.film_id = fc.film_id"]
+    elif driver == "fa":
+        source = ["film_actor AS fa", "JOIN film AS f ON f.film_id = fa.film_id"]
+    else:
+        source = ["film AS f"]
+    if criteria.genre is not None and driver != "fc":
+        source.append("JOIN film_category AS fc ON fc.film_id = f.film_id")
+    if criteria.genre is not None and category_id is None:
+        source.append("JOIN category AS ca ON ca.category_id = fc.category_id")
+    if criteria.actor is not None:
+        if driver != "fa":
+            source.append("JOIN film_actor AS fa ON fa.film_id = f.film_id")
+        source.append("JOIN actor AS a ON a.actor_id = fa.actor_id")
+    columns = "f.film_id, f.title, f.release_year"
+    if criteria.actor is not None:
+        columns += ", fa.actor_id, CONCAT(a.first_name, ' ', a.last_name) AS actor_name"
+
+    # Ranking reads every match, so it needs the bounded id list; a LIKE is keyset-paged by film_id instead.
+    ranked = criteria.order == "relevance" and criteria.keyword is not None and keyword_listed
+    order = criteria.order if criteria.order != "relevance" or ranked else "film_id"
+    conditions = tuple(predicate[3] for predicate in predicates)
+    source_sql = "\n        ".join(source)
+    if ranked:
+        queries = (build_search(columns, source_sql, conditions, None, False),) * 2
+    else:
+        # Sorting by the driving table's film_id lets the join deliver rows in order.
+        sort_columns = {"film_id": f"{driver}.film_id", "release_year": "f.release_year"}
+        sort = tuple((sort_columns[field], descending) for field, descending in ORDERS[order])
+        if criteria.actor is not None:
+            sort += (("fa.actor_id", False),)
+        queries = (build_search(columns, source_sql, conditions, sort, False),
+                   build_search(columns, source_sql, conditions, sort, True))
+    name = "search/" + "+".join(predicate[1] for predicate in predicates) + f"/{'ranked' if ranked else order}"
+    return QueryPlan(name, queries, tuple(param for predicate in predicates for param in predicate[4]),
+                     key_fields(order, criteria.actor is not None), tuple(tables), ranked, empty)
@@ -0,0 +1,168 @@
+# plans.py
+
+import json
+import platform
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Tuple
+from db import MySakilaConnection
+import func
+import setting as se
+import sql_queries as sql
+from planner import SearchCriteria
+
+# Representative searches, named for the baseline: the four menu searches and
+# combinations that make the planner pick other driving tables
+SEARCHES = {
+    "rating": SearchCriteria(rating="PG", order="newest"),
+    "keyword": SearchCriteria(keyword="drama", order="relevance"),
+    "genre_year": SearchCriteria(genre="Action", year=2006),
+    "actor_year": SearchCriteria(actor="guiness", year=2006),
+    "rating_genre_years": SearchCriteria(rating="PG", genre="Action", year_from=2000, order="newest"),
+    "actor_keyword": SearchCriteria(actor="penelope", keyword="drama", order="oldest"),
+}
+
+
+def _statements() -> Dict[str, Tuple[str, tuple]]:
+    """
+    Returns the fixed statements to check with representative parameters.
+    """
+    since = (datetime.now() - timedelta(seconds=se.KEYWORD_INDEX_REFRESH)).strftime("%Y-%m-%d %H:%M:%S")
+    return {
+        "popular_queries": (sql.sql_popular_queries, ()),
+        "popular_queries_head": (sql.sql_popular_queries_head, (se.POPULAR_CAPACITY + 1,)),
+        "prune_queries": (sql.sql_prune_queries, (1, 1000)),
+        "stats_film": (sql.sql_stats_film, ()),
+        "stats_category": (sql.sql_stats_category, ()),
+        "stats_actor": (sql.sql_stats_actor, ()),
+        "film_text_since": (sql.sql_film_text_since, (since,)),
+        "actor_names_since": (sql.sql_actor_names_since, (since,)),
+    }
+
+
+def _search_statements(base: MySakilaConnection) -> Dict[str, Tuple[str, tuple]]:
+    """
+    Plans the representative searches. The statement for a later page seeks
+    past the last row of the first page, which is read for that purpose.
+    """
+    statements = {}
+    for label, criteria in SEARCHES.items():
+        plan = func.search_plan(criteria)
+        if plan.empty:
+            continue
+        if plan.ranked:
+            statements[f"search/{label}"] = (plan.queries[0], plan.params)
+            continue
+        params = (*plan.params, se.PAGE_SIZE + 1)
+        statements[f"search/{label}"] = (plan.queries[0], params)
+        rows = base.execute_query(plan.queries[0], params)
+        if rows:
+            key = [rows[-1][field] for field in plan.key_fields]
+            statements[f"search/{label}/after"] = (plan.queries[1],
+                                                   (*plan.params, *plan.seek(key), se.PAGE_SIZE + 1))
+    return statements
+
+
+def summarize(explain: Dict) -> Dict[str, Any]:
+    """
+    Reduces an EXPLAIN FORMAT=JSON document to what the checks compare.
+
+    Rows examined add up the rows read per scan of every table, times the
+    rows the tables before it in the same nested loop produced.
+    """
+    tables: List[Dict[str, Any]] = []
+    state = {"filesort": False, "temporary": False, "rows": 0.0}
+
+    def walk(node: Any, prefix: float) -> None:
+        if isinstance(node, list):
+            for item in node:
+                walk(item, prefix)
+            return
+        if not isinstance(node, dict):
+            return
+        for key, value in node.items():
+            if key == "using_filesort" and value is True:
+                state["filesort"] = True
+            elif key == "using_temporary_table" and value is True:
+                state["temporary"] = True
+            elif key == "table" and isinstance(value, dict):
+                per_scan = float(value.get("rows_examined_per_scan", 0))
+                state["rows"] += per_scan * prefix
+                tables.append({"table": value.get("table_name"), "access_type": value.get("access_type"),
+                               "key": value.get("key"), "rows_per_scan": int(per_scan)})
+                walk(value, 1.0)
+            elif key == "nested_loop" and isinstance(value, list):
+                produced = prefix
+                for item in value:
+                    walk(item, produced)
+                    table = item.get("table", {}) if isinstance(item, dict) else {}
+                    produced = float(table.get("rows_produced_per_join", produced))
+            else:
+                walk(value, prefix)
+
+    walk(explain, 1.0)
+    cost = explain.get("query_block", {}).get("cost_info", {}).get("query_cost")
+    return {
+        "tables": tables,
+        "full_scans": sorted({table["table"] for table in tables if table["access_type"] == "ALL"}),
+        "filesort": state["filesort"],
+        "temporary": state["temporary"],
+        "rows_examined": int(round(state["rows"])),
+        "cost": None if cost is None else float(cost),
+    }
+
+
+def collect_plans() -> Dict[str, Dict[str, Any]]:
+    """
+    Explains every named statement with representative parameters.
+    """
+    plans = {}
+    with MySakilaConnection() as base:
+        statements = {**_statements(), **_search_statements(base)}
+        for name, (query, params) in statements.items():
+            plans[name] = summarize(base.explain_json(query, params))
+    return plans
+
+
+def compare_plans(current: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]],
+                  tolerance: float = 0.5) -> List[str]:
+    """
+    Lists the statements whose plan is worse than in the baseline: a new full
+    table scan, filesort or temporary table, or more than ``tolerance`` (0.5
+    = 50%) more examined rows. A statement missing from the baseline is
+    reported too, so new statements get reviewed.
+    """
+    regressions = []
+    for name, plan in current.items():
+        previous = baseline.get(name)
+        if previous is None:
+            regressions.append(f"{name}: not in the baseline")
+            continue
+        for table in sorted(set(plan["full_scans"]) - set(previous["full_scans"])):
+            regressions.append(f"{name}: new full scan of {table}")
+        for flag, label in (("filesort", "filesort"), ("temporary", "temporary table")):
+            if plan[flag] and not previous[flag]:
+                regressions.append(f"{name}: new {label}")
+        if previous["rows_examined"] > 0 and plan["rows_examined"] > previous["rows_examined"] * (1 + tolerance):
+            regressions.append(f"{name}: rows examined {previous['rows_examined']} -> {plan['rows_examined']}")
+    return regressions
+
+
+def save_baseline(path: str, plans: Dict[str, Dict[str, Any]]) -> None:
+    """
+    Stores plans as the baseline.
+    """
+    with open(path, "w") as file:
+        json.dump({
+            "meta": {"created": datetime.now().isoformat(timespec="seconds"), "python": platform.python_version()},
+            "plans": plans,
+        }, file, indent=2, sort_keys=True)
+
+
+def load_baseline(path: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Reads the plans stored by save_baseline().
+
+    :raises FileNotFoundError: If there is no baseline yet.
+    """
+    with open(path) as file:
+        return json.load(file)["plans"]
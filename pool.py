@@ -0,0 +1,203 @@
+# pool.py
+
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from my_exceptions import DatabaseConnectionError
+
+
+class PoolStats:
+    """
+    Counters describing how a connection pool is being used.
+    """
+    def __init__(self) -> None:
+        self.created = 0
+        self.evicted = 0
+        self.borrowed = 0
+        self.timeouts = 0
+        self.in_use = 0
+        self.idle = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def as_dict(self) -> Dict[str, Union[int, float]]:
+        """
+        Returns the counters as a plain dictionary.
+        """
+        return {
+            "created": self.created,
+            "evicted": self.evicted,
+            "borrowed": self.borrowed,
+            "timeouts": self.timeouts,
+            "in_use": self.in_use,
+            "idle": self.idle,
+            "wait_total": self.wait_total,
+            "wait_avg": self.wait_total / self.borrowed if self.borrowed else 0.0,
+            "wait_max": self.wait_max,
+        }
+
+
+class ConnectionPool:
+    """
+    A thread-safe pool of reusable database connections.
+
+    Connections are created lazily by ``factory`` up to ``size``. A borrowed
+    connection is health-checked if it sat idle longer than ``ping_interval``
+    seconds. The most recently released connection is reused first; idle
+    connections older than ``max_idle`` seconds are evicted on every borrow,
+    so they do not keep holding slots. Connections are closed outside the
+    pool lock, so a slow close cannot stall other borrowers; ``on_close`` is
+    called with each one first, e.g. to close its prepared statements.
+    """
+    def __init__(self, factory: Callable[[], Any], size: int = 5, max_idle: float = 300.0,
+                 timeout: float = 10.0, ping_interval: float = 1.0,
+                 on_close: Optional[Callable[[Any], None]] = None) -> None:
+        if size < 1:
+            raise ValueError("The pool size must be at least 1.")
+        self.factory = factory
+        self.size = size
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        self.on_close = on_close
+        self.stats = PoolStats()
+        self._idle: List[Tuple[Any, float]] = []
+        self._open = 0
+        self._closed = False
+        self._lock = threading.Condition()
+
+    def acquire(self) -> Any:
+        """
+        Borrows a healthy connection, waiting up to ``timeout`` seconds for one.
+
+        :return: An open connection that must be given back with release().
+        """
+        started = time.perf_counter()
+        deadline = started + self.timeout
+        while True:
+            expired: List[Any] = []
+            try:
+                connection, check = self._reserve(deadline, expired)
+            finally:
+                self._close_all(expired)
+            if connection is None:
+                try:
+                    connection = self.factory()
+                except BaseException:
+                    with self._lock:
+                        self._open -= 1
+                        self._lock.notify()
+                    raise
+                with self._lock:
+                    self.stats.created += 1
+            elif check and not self._is_healthy(connection):
+                with self._lock:
+                    self._evict(1)
+                self._close_all([connection])
+                continue
+            break
+
+        waited = time.perf_counter() - started
+        with self._lock:
+            self.stats.borrowed += 1
+            self.stats.in_use += 1
+            self.stats.wait_total += waited
+            self.stats.wait_max = max(self.stats.wait_max, waited)
+        return connection
+
+    def _reserve(self, deadline: float, expired: List[Any]) -> Tuple[Optional[Any], bool]:
+        """
+        Takes an idle connection or a free slot for a new one.
+
+        :param expired: Receives the idle connections evicted meanwhile, for
+                        the caller to close once the lock is released.
+        :return: The idle connection (None when a new one must be created) and
+                 whether it has been idle long enough to need a health check.
+        """
+        with self._lock:
+            while True:
+                if self._closed:
+                    raise DatabaseConnectionError("Database connection error: the pool is closed")
+                self._expire(expired)
+                if self._idle:
+                    connection, released_at = self._idle.pop()
+                    self.stats.idle = len(self._idle)
+                    return connection, time.monotonic() - released_at > self.ping_interval
+                if self._open < self.size:
+                    self._open += 1
+                    return None, False
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    self.stats.timeouts += 1
+                    raise DatabaseConnectionError(
+                        f"Database connection error: no free connection within {self.timeout}s "
+                        f"(pool size {self.size})"
+                    )
+                self._lock.wait(remaining)
+
+    def release(self, connection: Any, discard: bool = False) -> None:
+        """
+        Returns a borrowed connection to the pool.
+
+        :param connection: The connection obtained from acquire().
+        :param discard: Close the connection instead of keeping it for reuse.
+        """
+        with self._lock:
+            self.stats.in_use -= 1
+            close = discard or self._closed
+            if close:
+                self._evict(1)
+            else:
+                self._idle.append((connection, time.monotonic()))
+                self.stats.idle = len(self._idle)
+            self._lock.notify()
+        if close:
+            self._close_all([connection])
+
+    def close(self) -> None:
+        """
+        Closes every idle connection and refuses further borrowing.
+        """
+        with self._lock:
+            self._closed = True
+            idle = [connection for connection, _ in self._idle]
+            self._idle.clear()
+            self._evict(len(idle))
+            self.stats.idle = 0
+            self._lock.notify_all()
+        self._close_all(idle)
+
+    def _expire(self, expired: List[Any]) -> None:
+        # The idle list is in release order, so the expired connections are at its bottom.
+        cutoff = time.monotonic() - self.max_idle
+        count = 0
+        while count < len(self._idle) and self._idle[count][1] < cutoff:
+            count += 1
+        if count:
+            expired.extend(connection for connection, _ in self._idle[:count])
+            del self._idle[:count]
+            self._evict(count)
+            self.stats.idle = len(self._idle)
+            self._lock.notify(count)
+
+    def _evict(self, count: int) -> None:
+        # Frees the slots of connections the caller closes after releasing the lock.
+        self._open -= count
+        self.stats.evicted += count
+
+    def _close_all(self, connections: List[Any]) -> None:
+        for connection in connections:
+            if self.on_close is not None:
+                self.on_close(connection)
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    @staticmethod
+    def _is_healthy(connection: Any) -> bool:
+        try:
+            connection.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
@@ -0,0 +1,169 @@
+# popularity.py
+
+import heapq
+import threading
+import time
+from collections import Counter, deque
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+
+class TopKTracker:
+    """
+    An incrementally maintained top-K counter (the Space-Saving algorithm).
+
+    Up to ``capacity`` query names are tracked. When a new name arrives and
+    the tracker is full, the name with the smallest count is replaced and the
+    newcomer inherits that count as its possible overestimate. Any name whose
+    true count exceeds the smallest tracked count is guaranteed to be present.
+    """
+    def __init__(self, k: int = 10, capacity: Optional[int] = None) -> None:
+        self.k = k
+        self.capacity = capacity or max(10 * k, 100)
+        self.counts: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self.floor = 0
+        self.seeded = False
+        self._heap: List[Tuple[int, str]] = []
+        self._lock = threading.Lock()
+
+    def seed(self, rows: Iterable[Tuple[str, int]], complete: bool = True) -> None:
+        """
+        Replaces the tracked counts with exact ones, e.g. the head of the table.
+
+        :param rows: (query name, count) pairs in descending count order.
+        :param complete: False when the source holds more names than ``rows``;
+                         untracked names are then assumed to be at the floor.
+        """
+        with self._lock:
+            self.counts = {}
+            self.errors = {}
+            for name, count in rows:
+                if len(self.counts) >= self.capacity:
+                    complete = False
+                    break
+                self.counts[name] = count
+                self.errors[name] = 0
+            self.floor = 0 if complete or not self.counts else min(self.counts.values())
+            self._heap = [(count, name) for name, count in self.counts.items()]
+            heapq.heapify(self._heap)
+            self.seeded = True
+
+    def add(self, name: str, count: int = 1) -> None:
+        """
+        Adds executions of a query.
+        """
+        with self._lock:
+            if name in self.counts:
+                self.counts[name] += count
+            elif len(self.counts) < self.capacity and not self.floor:
+                self.counts[name] = count
+                self.errors[name] = 0
+            else:
+                smallest = self._pop_smallest()
+                self.counts[name] = smallest + count
+                self.errors[name] = smallest
+            heapq.heappush(self._heap, (self.counts[name], name))
+            if len(self._heap) > 4 * self.capacity:
+                self._heap = [(c, n) for n, c in self.counts.items()]
+                heapq.heapify(self._heap)
+
+    def top(self, k: Optional[int] = None) -> List[Tuple[str, int]]:
+        """
+        Returns the ``k`` most frequent names with their (estimated) counts.
+        """
+        with self._lock:
+            return heapq.nlargest(k or self.k, self.counts.items(), key=lambda item: item[1])
+
+    def _pop_smallest(self) -> int:
+        """
+        Evicts the name with the smallest count and returns that count. When the
+        tracker still has room, the floor of the untracked names is returned.
+        """
+        if len(self.counts) < self.capacity:
+            return self.floor
+        while self._heap:
+            count, name = heapq.heappop(self._heap)
+            if self.counts.get(name) == count:
+                del self.counts[name]
+                del self.errors[name]
+                self.floor = max(self.floor, count)
+                return count
+        return self.floor
+
+
+class WindowedCounter:
+    """
+    Pre-aggregated query counts over sliding time windows.
+
+    Every recording is added to the current bucket of each window (per-minute
+    buckets for the last hour, hourly for the last day, daily for the last
+    week) and to that window's running total. Buckets that fall out of their
+    window are subtracted from the total and dropped, so a window is answered
+    from its total without looking at individual recordings.
+
+    A bucket holds at most ``capacity`` names: a new name in a full bucket
+    replaces the one with the smallest count there. The counts live in this
+    process only (the daemon's, for main.py) and start empty on a restart.
+    """
+    # window name: (bucket width in seconds, number of buckets)
+    WINDOWS = {
+        "hour": (60, 60),
+        "day": (3600, 24),
+        "week": (86400, 7),
+    }
+
+    def __init__(self, clock: Callable[[], float] = time.time, capacity: int = 1000) -> None:
+        self.clock = clock
+        self.capacity = capacity
+        self.evicted = 0
+        self._buckets: Dict[str, Deque[Tuple[int, Counter]]] = {name: deque() for name in self.WINDOWS}
+        self._totals: Dict[str, Counter] = {name: Counter() for name in self.WINDOWS}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, count: int = 1) -> None:
+        """
+        Adds executions of a query at the current time.
+        """
+        now = self.clock()
+        with self._lock:
+            for window, (width, _) in self.WINDOWS.items():
+                self._expire(window, now)
+                buckets = self._buckets[window]
+                index = int(now // width)
+                if not buckets or buckets[-1][0] != index:
+                    buckets.append((index, Counter()))
+                bucket, total = buckets[-1][1], self._totals[window]
+                if name not in bucket and len(bucket) >= self.capacity:
+                    smallest = min(bucket, key=bucket.__getitem__)
+                    self._remove(total, smallest, bucket.pop(smallest))
+                    self.evicted += 1
+                bucket[name] += count
+                total[name] += count
+
+    def top(self, window: str, k: int = 10) -> List[Tuple[str, int]]:
+        """
+        Returns the ``k`` most frequent names within a window.
+
+        :param window: One of WINDOWS ('hour', 'day', 'week').
+        """
+        if window not in self.WINDOWS:
+            raise ValueError(f"Unknown window '{window}'.")
+        with self._lock:
+            self._expire(window, self.clock())
+            return heapq.nlargest(k, self._totals[window].items(), key=lambda item: item[1])
+
+    def _expire(self, window: str, now: float) -> None:
+        width, size = self.WINDOWS[window]
+        oldest = int(now // width) - size + 1
+        buckets = self._buckets[window]
+        total = self._totals[window]
+        while buckets and buckets[0][0] < oldest:
+            _, bucket = buckets.popleft()
+            for name, count in bucket.items():
+                self._remove(total, name, count)
+
+    @staticmethod
+    def _remove(total: Counter, name: str, count: int) -> None:
+        total[name] -= count
+        if total[name] <= 0:
+            del total[name]
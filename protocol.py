@@ -0,0 +1,96 @@
+# protocol.py
+
+import json
+import os
+import socket
+import struct
+import tempfile
+from typing import Any, Dict, Optional
+import setting as se
+from my_exceptions import DatabaseConnectionError, QueryExecutionError
+from user_exceptions import MovieNotFoundError, UserInputError
+
+# A message is a 4-byte big-endian length followed by that many bytes of JSON.
+HEADER = struct.Struct(">I")
+MAX_MESSAGE = 64 * 1024 * 1024
+
+# Exceptions sent back to the client with the attributes needed to rebuild them
+ERRORS = {
+    "UserInputError": (UserInputError, ("input_value",)),
+    "MovieNotFoundError": (MovieNotFoundError, ("movie_title",)),
+    "QueryExecutionError": (QueryExecutionError, ("query", "error_code")),
+    "DatabaseConnectionError": (DatabaseConnectionError, ("error_code",)),
+    "ValueError": (ValueError, ()),
+}
+
+
+class ProtocolError(Exception):
+    """
+    Exception raised for malformed messages or an unexpectedly closed socket.
+    """
+
+
+class RemoteError(Exception):
+    """
+    Exception raised for a server-side error without a local counterpart.
+    """
+
+
+def socket_path() -> str:
+    """
+    Returns the path of the daemon socket.
+    """
+    path = os.getenv('SAKILA_SOCKET') or se.DAEMON_SOCKET
+    if path:
+        return path
+    return os.path.join(tempfile.gettempdir(), f"sakila-{os.getuid()}.sock")
+
+
+def send_message(sock: socket.socket, message: Dict[str, Any]) -> None:
+    data = json.dumps(message, separators=(",", ":"), default=str).encode()
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+
+def recv_message(sock: socket.socket) -> Optional[Dict[str, Any]]:
+    """
+    Reads one message.
+
+    :return: The message, or None if the peer closed the socket between messages.
+    """
+    header = _recv_exactly(sock, HEADER.size, allow_eof=True)
+    if header is None:
+        return None
+    (size,) = HEADER.unpack(header)
+    if size > MAX_MESSAGE:
+        raise ProtocolError(f"Message too large: {size} bytes")
+    try:
+        return json.loads(_recv_exactly(sock, size))
+    except ValueError as e:
+        raise ProtocolError(f"Malformed message: {e}") from e
+
+
+def _recv_exactly(sock: socket.socket, size: int, allow_eof: bool = False) -> Optional[bytes]:
+    chunks, remaining = [], size
+    while remaining:
+        chunk = sock.recv(min(remaining, 1 << 20))
+        if not chunk:
+            if allow_eof and remaining == size:
+                return None
+            raise ProtocolError("Connection closed in the middle of a message")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+
+def encode_error(e: Exception) -> Dict[str, Any]:
+    name = type(e).__name__
+    fields = ERRORS[name][1] if name in ERRORS else ()
+    return {"error": name, "message": str(e.args[0]) if e.args else str(e),
+            "fields": {field: getattr(e, field, None) for field in fields}}
+
+
+def decode_error(response: Dict[str, Any]) -> Exception:
+    cls, _ = ERRORS.get(response["error"], (None, ()))
+    if cls is None:
+        return RemoteError(f"{response['error']}: {response['message']}")
+    return cls(response["message"], **response.get("fields", {}))
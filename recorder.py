@@ -0,0 +1,172 @@
+# recorder.py
+
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, Optional
+from db import MySakilaConnection
+
+log = logging.getLogger("sakila.recorder")
+
+
+def _write_counts(counts: Dict[str, int]) -> None:
+    with MySakilaConnection() as base:
+        base.record_user_queries(counts)
+
+
+class QueryRecorder:
+    """
+    Buffers query-popularity updates and writes them in the background.
+
+    Counts for the same query name are merged in memory and flushed as one
+    multi-row upsert when ``flush_size`` recordings are pending, when
+    ``flush_interval`` seconds have passed, or at interpreter exit. When more
+    than ``max_pending`` distinct names are waiting, the background thread is
+    woken and the oldest names are dropped, so the buffer stays bounded even
+    while the database is down. record() never touches the database.
+    """
+    def __init__(self, flush_size: int = 100, flush_interval: float = 5.0, max_pending: int = 10000,
+                 writer: Callable[[Dict[str, int]], None] = _write_counts) -> None:
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.writer = writer
+        self.recorded = 0
+        self.flushes = 0
+        self.rows_written = 0
+        self.failures = 0
+        self.dropped = 0
+        self.last_error: Optional[Exception] = None
+        self._pending: Counter = Counter()
+        self._pending_total = 0
+        self._lock = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._stopping = False
+
+    def record(self, query_name: str, count: int = 1) -> None:
+        """
+        Adds executions of a query to the buffer.
+
+        :param query_name: The name of the query.
+        :param count: The number of executions to add.
+        """
+        with self._lock:
+            self._pending[query_name] += count
+            self._pending_total += count
+            self.recorded += count
+            self._trim()
+            if self._pending_total >= self.flush_size or len(self._pending) >= self.max_pending:
+                self._lock.notify()
+        self._start()
+
+    def flush(self) -> int:
+        """
+        Writes every pending count now. Counts that fail to be written are
+        put back into the buffer and the error is raised.
+
+        :return: The number of query names written.
+        """
+        with self._flush_lock:
+            with self._lock:
+                counts = dict(self._pending)
+                self._pending.clear()
+                self._pending_total = 0
+            if not counts:
+                return 0
+            try:
+                self.writer(counts)
+            except Exception as e:
+                with self._lock:
+                    # The failed counts are older than those recorded meanwhile, so they are dropped first.
+                    counts = Counter(counts)
+                    counts.update(self._pending)
+                    self._pending = counts
+                    self._pending_total = sum(counts.values())
+                    self._trim()
+                    self.failures += 1
+                    self.last_error = e
+                raise
+            with self._lock:
+                self.flushes += 1
+                self.rows_written += len(counts)
+            return len(counts)
+
+    def close(self) -> None:
+        """
+        Stops the background thread and writes whatever is still pending.
+        """
+        with self._lock:
+            self._stopping = True
+            self._lock.notify()
+        if (self._thread is not None and self._pid == os.getpid()
+                and self._thread is not threading.current_thread()):
+            self._thread.join()
+        self.flush()
+
+    def pending(self) -> Dict[str, int]:
+        """
+        Returns a copy of the counts that have not been written yet.
+        """
+        with self._lock:
+            return dict(self._pending)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the recorder counters.
+        """
+        with self._lock:
+            return {
+                "recorded": self.recorded,
+                "pending": self._pending_total,
+                "pending_names": len(self._pending),
+                "flushes": self.flushes,
+                "rows_written": self.rows_written,
+                "failures": self.failures,
+                "dropped": self.dropped,
+            }
+
+    def _trim(self) -> None:
+        # Called with the lock held; a Counter keeps its names in insertion order.
+        while len(self._pending) > self.max_pending:
+            name = next(iter(self._pending))
+            count = self._pending.pop(name)
+            self._pending_total -= count
+            self.dropped += count
+
+    def _start(self) -> None:
+        # A forked child inherits the buffer but not the thread.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if (self._thread is None or self._pid != os.getpid()) and not self._stopping:
+                if self._thread is None:
+                    atexit.register(self.close)
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="query-recorder", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                deadline = time.monotonic() + self.flush_interval
+                while (not self._stopping and self._pending_total < self.flush_size
+                       and len(self._pending) < self.max_pending):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._lock.wait(remaining)
+                if self._stopping:
+                    return
+            try:
+                self.flush()
+            except Exception as e:
+                # The counts are back in the buffer; retry after a full interval.
+                log.warning("Writing %d query counts failed: %s", len(self.pending()), e)
+                with self._lock:
+                    if not self._stopping:
+                        self._lock.wait(self.flush_interval)
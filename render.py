@@ -0,0 +1,142 @@
+# render.py
+
+import sys
+import textwrap
+from itertools import chain, islice
+from typing import Any, Dict, Iterable, List, Optional, Sequence, TextIO, Union
+import setting as se
+from rows import project
+
+
+class Column:
+    """
+    One column of a rendered table.
+
+    Its width is the longest value plus ``pad``, at least ``min_width`` (the
+    header length by default) and at most ``max_width``.
+    """
+    __slots__ = ("header", "key", "align", "pad", "min_width", "max_width")
+
+    def __init__(self, header: str, key: str, align: str = "left", pad: int = 0,
+                 min_width: Optional[int] = None, max_width: Optional[int] = None) -> None:
+        if align not in ("left", "right"):
+            raise ValueError(f"Invalid column alignment: {align}")
+        self.header = header
+        self.key = key
+        self.align = align
+        self.pad = pad
+        self.min_width = len(header) if min_width is None else min_width
+        self.max_width = max_width
+
+
+def _fit(text: str, width: int, overflow: str) -> List[str]:
+    if len(text) <= width:
+        return [text]
+    if overflow == "wrap":
+        return textwrap.wrap(text, width) or [""]
+    return [text[:width - 3] + "..." if width > 3 else text[:width]]
+
+
+def render_table(rows: Iterable[Any], columns: Sequence[Column], out: Optional[TextIO] = None,
+                 empty: Optional[str] = None, overflow: str = "truncate", sample: int = 1000,
+                 chunk_lines: int = 500) -> int:
+    """
+    Writes rows as a table framed with '-' and '|'. The rows may be in any
+    of the formats of MySakilaConnection.execute_query().
+
+    Column widths come from the first ``sample`` rows; the rest are streamed
+    with those widths, so any number of rows renders in constant memory. A
+    later value wider than its column is truncated or wrapped if the column
+    has a ``max_width`` and shifts its line otherwise. Output is buffered and
+    written with one call per ``chunk_lines`` lines.
+
+    :param out: The stream to write to (sys.stdout by default).
+    :param empty: A message to write instead of an empty table.
+    :param overflow: "truncate" or "wrap" values wider than their column.
+    :return: The number of rows rendered.
+    """
+    if overflow not in ("truncate", "wrap"):
+        raise ValueError(f"Invalid overflow mode: {overflow}")
+    out = out or sys.stdout
+    keys = [column.key for column in columns]
+    # Every row becomes a tuple of its column values.
+    rows = project(rows, keys)
+    head = list(islice(rows, sample))
+    if not head and empty is not None:
+        out.write(empty + "\n")
+        return 0
+
+    longest = [max(map(len, map(str, values))) for values in zip(*head)] or [0] * len(keys)
+    widths = []
+    for column, size in zip(columns, longest):
+        width = max(column.min_width, size + column.pad if head else column.min_width)
+        if column.max_width is not None:
+            width = max(min(width, column.max_width), 1)
+        widths.append(width)
+
+    border = "-" * (sum(widths) + 3 * len(widths) + 1)
+    template = "| " + " | ".join(f"{{!s:{'>' if column.align == 'right' else '<'}{width}}}"
+                                 for column, width in zip(columns, widths)) + " |"
+    buffer = [border, template.format(*(_fit(column.header, width, "truncate")[0]
+                                        for column, width in zip(columns, widths))), border]
+    line_length = len(border)
+    count = 0
+    for row in chain(head, rows):
+        formatted = template.format(*row)
+        # Padding never shortens a value, so a longer line means a value overflowed.
+        if len(formatted) == line_length:
+            buffer.append(formatted)
+        else:
+            cells = [str(value) for value in row]
+            lines = [_fit(cell, width, overflow) if column.max_width is not None else [cell]
+                     for column, cell, width in zip(columns, cells, widths)]
+            for i in range(max(len(cell_lines) for cell_lines in lines)):
+                buffer.append(template.format(*(cell_lines[i] if i < len(cell_lines) else ""
+                                                 for cell_lines in lines)))
+        count += 1
+        if len(buffer) >= chunk_lines:
+            out.write("\n".join(buffer) + "\n")
+            buffer = []
+    buffer.append(border)
+    out.write("\n".join(buffer) + "\n")
+    return count
+
+
+def display_table(data: Iterable[Dict[str, Union[str, int]]]) -> None:
+    """
+    Displays data in a table format using symbols.
+
+    :param data: Rows with keys 'query' and 'count'; any iterable,
+                 rendered in constant memory.
+    """
+    render_table(data, (
+        Column("Queries", "query", pad=1, min_width=len("Queries") + 1, max_width=se.TABLE_MAX_WIDTH),
+        Column("Counts", "count", align="right"),
+    ), empty="No data to display.", overflow=se.TABLE_OVERFLOW)
+
+
+def display_movies_table(movies: Iterable[Dict[str, Union[str, int]]]) -> None:
+    """
+    Displays a list of movies in a table format using symbols.
+
+    :param movies: Rows with keys 'title' and 'release_year'; any
+                   iterable, rendered in constant memory.
+    """
+    render_table(movies, (
+        Column("Movies", "title", pad=2, min_width=len("Movies") + 2, max_width=se.TABLE_MAX_WIDTH),
+        Column("Release Year", "release_year", align="right", min_width=len("Release Year") + 2),
+    ), overflow=se.TABLE_OVERFLOW)
+
+
+def display_movies_actors_table(movies: Iterable[Dict[str, Union[str, int]]]) -> None:
+    """
+    Displays a list of movies and actors in a table format using symbols.
+
+    :param movies: Rows with keys 'title', 'release_year' and
+                   'actor_name'; any iterable, rendered in constant memory.
+    """
+    render_table(movies, (
+        Column("Movies", "title", pad=2, min_width=len("Movies") + 2, max_width=se.TABLE_MAX_WIDTH),
+        Column("Release Year", "release_year", align="right"),
+        Column("Actors", "actor_name", pad=2, min_width=len("Actors") + 2, max_width=se.TABLE_MAX_WIDTH),
+    ), overflow=se.TABLE_OVERFLOW)
@@ -0,0 +1,321 @@
+# router.py
+
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+import sql_queries as sql
+from pool import ConnectionPool
+
+# Weight of the newest sample in an endpoint's latency average
+LATENCY_ALPHA = 0.2
+
+
+class Endpoint:
+    """
+    One database server with its own connection pool, and what the router
+    knows about it: health, replication lag and round-trip latency.
+    """
+    def __init__(self, name: str, pool: ConnectionPool, replica: bool) -> None:
+        self.name = name
+        self.pool = pool
+        self.replica = replica
+        # Replicas are only used once a health check has measured their lag.
+        self.healthy = not replica
+        self.lag: Optional[float] = None if replica else 0.0
+        self.latency: Optional[float] = None
+        self.in_flight = 0
+        # Health checks use their own connection, so a busy pool cannot fail them.
+        self.health_connection: Any = None
+        self.checked_at: Optional[float] = None
+        self.reads = 0
+        self.writes = 0
+        self.fallback_reads = 0
+        self.lag_skips = 0
+        self.busy_skips = 0
+        self.checks = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+
+    def observe(self, latency: float) -> None:
+        """
+        Adds a round-trip time to the latency average.
+        """
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += LATENCY_ALPHA * (latency - self.latency)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "role": "replica" if self.replica else "primary",
+            "healthy": self.healthy,
+            "lag": self.lag,
+            "latency_ms": None if self.latency is None else self.latency * 1000,
+            "in_flight": self.in_flight,
+            "reads": self.reads,
+            "writes": self.writes,
+            "fallback_reads": self.fallback_reads,
+            "lag_skips": self.lag_skips,
+            "busy_skips": self.busy_skips,
+            "checks": self.checks,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+
+def _replication_lag(connection: Any) -> float:
+    """
+    Reads the replication lag of a server in seconds: 0 for a server that is
+    not a replica, infinite for a replica whose replication is stopped.
+    """
+    cursor = connection.cursor(dictionary=True)
+    try:
+        try:
+            cursor.execute(sql.sql_replica_status)
+        except Exception:
+            # MySQL before 8.0.22 only knows the old name.
+            cursor.execute(sql.sql_slave_status)
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    if not rows:
+        return 0.0
+    lag = rows[0].get('Seconds_Behind_Source', rows[0].get('Seconds_Behind_Master'))
+    return float('inf') if lag is None else float(lag)
+
+
+def _close_health_connection(endpoint: Endpoint) -> None:
+    connection, endpoint.health_connection = endpoint.health_connection, None
+    if connection is not None:
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+
+def _load(endpoint: Endpoint) -> float:
+    # Latency alone sends every read to the same replica until the next check.
+    return (endpoint.in_flight + 1) * (endpoint.latency or 0.0)
+
+
+class Router:
+    """
+    Routes statements to a primary server and any number of read replicas.
+
+    Writes, and reads that must see them, go to the primary. Other reads go
+    to a healthy replica whose replication lag is within the bound: of two
+    replicas picked at random, the one with the lower average latency times
+    connections in use ("power of two choices"), so load spreads evenly but
+    slow servers get less of it. With no eligible replica a read falls back
+    to the primary. Every routed connection is handed back with done().
+
+    A background thread checks every replica each ``check_interval``
+    seconds over a connection of its own: it times the replication status
+    query and reads the lag from it. A replica that fails a check or a
+    connection attempt is skipped until a later check succeeds. A replica
+    whose pool has no free connection is healthy, only busy: the caller
+    passes it over for that one connection (see busy()).
+    """
+    def __init__(self, primary: ConnectionPool, replicas: Sequence[ConnectionPool] = (), max_lag: float = 5.0,
+                 check_interval: float = 5.0) -> None:
+        self.primary = Endpoint("primary", primary, replica=False)
+        self.replicas = [Endpoint(f"replica{i}", pool, replica=True) for i, pool in enumerate(replicas, start=1)]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._check_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._closed = False
+
+    @property
+    def endpoints(self) -> List[Endpoint]:
+        return [self.primary, *self.replicas]
+
+    def route(self, read_only: bool = False, max_lag: Optional[float] = None,
+              skip: Sequence[Endpoint] = ()) -> Endpoint:
+        """
+        Chooses the server for a connection and counts the decision. The
+        caller hands the connection back with done().
+
+        :param read_only: The connection only reads, so a replica may serve it.
+        :param max_lag: The most replication lag in seconds the reads tolerate
+                        (the router's ``max_lag`` by default).
+        :param skip: Replicas already found busy for this connection.
+        """
+        if not read_only or not self.replicas:
+            with self._lock:
+                if read_only:
+                    self.primary.reads += 1
+                else:
+                    self.primary.writes += 1
+                self.primary.in_flight += 1
+            return self.primary
+        self._start()
+        bound = self.max_lag if max_lag is None else max_lag
+        with self._lock:
+            eligible = []
+            for replica in self.replicas:
+                if not replica.healthy or replica in skip:
+                    continue
+                if replica.lag > bound:
+                    replica.lag_skips += 1
+                    continue
+                eligible.append(replica)
+            if not eligible:
+                self.primary.reads += 1
+                self.primary.fallback_reads += 1
+                self.primary.in_flight += 1
+                return self.primary
+            if len(eligible) == 1:
+                chosen = eligible[0]
+            else:
+                first, second = random.sample(eligible, 2)
+                chosen = first if _load(first) <= _load(second) else second
+            chosen.reads += 1
+            chosen.in_flight += 1
+            return chosen
+
+    def done(self, endpoint: Endpoint) -> None:
+        """
+        Hands back a connection chosen by route().
+        """
+        with self._lock:
+            endpoint.in_flight -= 1
+
+    def busy(self, endpoint: Endpoint) -> None:
+        """
+        Counts a replica whose pool had no free connection in time. Its health
+        is unchanged: taking a saturated replica out of rotation would only
+        move its load to the primary.
+        """
+        with self._lock:
+            endpoint.busy_skips += 1
+
+    def mark_down(self, endpoint: Endpoint, error: Exception) -> None:
+        """
+        Takes a replica out of rotation after its server failed to connect.
+        """
+        with self._lock:
+            endpoint.failures += 1
+            endpoint.last_error = str(error)
+            if endpoint.replica:
+                endpoint.healthy = False
+        self._wake.set()
+
+    def check(self, endpoint: Endpoint) -> bool:
+        """
+        Health-checks one server and updates its lag and latency.
+
+        :return: Whether the server is healthy.
+        """
+        with self._check_lock:
+            try:
+                if endpoint.health_connection is None:
+                    endpoint.health_connection = endpoint.pool.factory()
+                started = time.perf_counter()
+                lag = _replication_lag(endpoint.health_connection)
+                latency = time.perf_counter() - started
+            except Exception as e:
+                _close_health_connection(endpoint)
+                self._checked(endpoint, False, None, None, e)
+                return False
+        self._checked(endpoint, True, lag, latency, None)
+        return True
+
+    def _checked(self, endpoint: Endpoint, healthy: bool, lag: Optional[float], latency: Optional[float],
+                 error: Optional[Exception]) -> None:
+        with self._lock:
+            endpoint.checks += 1
+            endpoint.checked_at = time.monotonic()
+            if healthy:
+                endpoint.healthy = True
+                endpoint.lag = lag
+                endpoint.observe(latency)
+            else:
+                endpoint.failures += 1
+                endpoint.last_error = str(error)
+                if endpoint.replica:
+                    endpoint.healthy = False
+
+    def check_all(self) -> None:
+        """
+        Health-checks every replica now.
+        """
+        for replica in self.replicas:
+            self.check(replica)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns the routing counters and the state of every server.
+        """
+        with self._lock:
+            return {endpoint.name: endpoint.as_dict() for endpoint in self.endpoints}
+
+    def to_prometheus(self) -> str:
+        """
+        Exports the routing counters in the Prometheus text exposition format.
+        """
+        lines = ["# TYPE sakila_route_total counter"]
+        data = self.stats()
+        for name, endpoint in data.items():
+            for kind in ("reads", "writes", "fallback_reads", "lag_skips", "busy_skips"):
+                lines.append(f'sakila_route_total{{endpoint="{name}",kind="{kind}"}} {endpoint[kind]}')
+        for metric, key in (("sakila_endpoint_healthy", "healthy"), ("sakila_replica_lag_seconds", "lag"),
+                            ("sakila_endpoint_latency_seconds", "latency_ms")):
+            lines.append(f"# TYPE {metric} gauge")
+            for name, endpoint in data.items():
+                value = endpoint[key]
+                if value is None:
+                    continue
+                value = value / 1000 if key == "latency_ms" else float(value)
+                # A stopped replica lags without bound.
+                text = "+Inf" if value == float('inf') else f"{value:.6f}"
+                lines.append(f'{metric}{{endpoint="{name}"}} {text}')
+        return "\n".join(lines) + "\n"
+
+    def format_summary(self) -> str:
+        """
+        Formats the routing counters as a table for the terminal.
+        """
+        header = (f"{'Endpoint':12} {'Role':8} {'Healthy':>7} {'Lag s':>7} {'Latency':>9} {'Reads':>8} "
+                  f"{'Writes':>8} {'Fallback':>8} {'Lag skip':>8} {'Busy':>8}")
+        lines = [header, "-" * len(header)]
+        for name, endpoint in self.stats().items():
+            lag = "-" if endpoint["lag"] is None else f"{endpoint['lag']:.0f}"
+            latency = "-" if endpoint["latency_ms"] is None else f"{endpoint['latency_ms']:.2f}ms"
+            lines.append(f"{name:12} {endpoint['role']:8} {'yes' if endpoint['healthy'] else 'no':>7} {lag:>7} "
+                         f"{latency:>9} {endpoint['reads']:8} {endpoint['writes']:8} "
+                         f"{endpoint['fallback_reads']:8} {endpoint['lag_skips']:8} {endpoint['busy_skips']:8}")
+        return "\n".join(lines)
+
+    def close(self) -> None:
+        """
+        Stops the health checks and closes the idle connections of every pool.
+        """
+        self._closed = True
+        self._wake.set()
+        with self._check_lock:
+            for endpoint in self.endpoints:
+                _close_health_connection(endpoint)
+        for endpoint in self.endpoints:
+            endpoint.pool.close()
+
+    def _start(self) -> None:
+        # A forked child inherits the state but not the thread.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if (self._thread is None or self._pid != os.getpid()) and not self._closed:
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="replica-checks", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while not self._closed:
+            self.check_all()
+            self._wake.wait(self.check_interval)
+            self._wake.clear()
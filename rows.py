@@ -0,0 +1,148 @@
+# rows.py
+
+import keyword
+import re
+from array import array
+from collections.abc import Mapping
+from functools import lru_cache
+from itertools import chain
+from operator import attrgetter, itemgetter
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# Row formats of MySakilaConnection.execute_query()
+ROW_FORMATS = ("dict", "tuple", "record", "columns")
+
+
+class TupleRows(list):
+    """
+    Rows as plain tuples, with the column names kept once for the whole result.
+    """
+    def __init__(self, rows: Iterable[tuple] = (), columns: Sequence[str] = ()) -> None:
+        super().__init__(rows)
+        self.columns = tuple(columns)
+
+
+class Record(Mapping):
+    """
+    Base class of the record classes made by record_class().
+
+    A record stores its values in ``__slots__`` instead of a per-row dict but
+    reads like one: ``row['title']``, ``row.title``, ``dict(row)`` and
+    ``{**row}`` all work.
+    """
+    __slots__ = ()
+    _fields: Tuple[str, ...] = ()
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self._fields:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._fields)
+
+    def __len__(self) -> int:
+        return len(self._fields)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({', '.join(f'{field}={self[field]!r}' for field in self._fields)})"
+
+
+@lru_cache(maxsize=256)
+def record_class(name: str, columns: Tuple[str, ...]) -> type:
+    """
+    Returns the record class of a statement's columns, created on first use.
+
+    :param name: The statement name, used for the class name.
+    :raises ValueError: If a column name is not a valid field name (give the
+                        expression an alias).
+    """
+    for column in columns:
+        if not column.isidentifier() or keyword.iskeyword(column) or column.startswith("_"):
+            raise ValueError(f"Column {column!r} of {name} cannot be a record field; give it an alias.")
+    # A generated __init__ assigns the slots directly, like dataclasses do.
+    body = "".join(f"    self.{column} = {column}\n" for column in columns) or "    pass\n"
+    source = f"def __init__(self{''.join(', ' + column for column in columns)}):\n{body}"
+    namespace: Dict[str, Any] = {}
+    exec(source, namespace)
+    class_name = "Row_" + re.sub(r"\W", "_", name)
+    return type(class_name, (Record,), {"__slots__": columns, "_fields": columns, "__init__": namespace["__init__"]})
+
+
+class ColumnRows:
+    """
+    A result stored column by column: integer columns as ``array('q')`` and
+    the others as lists, so a row costs no object of its own.
+
+    Iterating yields the rows as tuples.
+    """
+    __slots__ = ("columns", "data", "_length")
+
+    def __init__(self, columns: Sequence[str], rows: Sequence[tuple]) -> None:
+        self.columns = tuple(columns)
+        self._length = len(rows)
+        self.data: Dict[str, Sequence] = {}
+        for column, values in zip(self.columns, zip(*rows) if rows else [()] * len(self.columns)):
+            self.data[column] = _compact(values)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __iter__(self) -> Iterator[tuple]:
+        return zip(*self.data.values()) if self.data else iter([()] * self._length)
+
+    def column(self, name: str) -> Sequence:
+        return self.data[name]
+
+
+def _compact(values: tuple) -> Sequence:
+    if values and all(type(value) is int for value in values):
+        try:
+            return array('q', values)
+        except OverflowError:
+            pass
+    return list(values)
+
+
+def make_rows(rows: List[tuple], columns: Sequence[str], row_format: str, name: Optional[str] = None) -> Any:
+    """
+    Converts the tuples fetched by a cursor into a row format other than "dict".
+    """
+    if row_format == "tuple":
+        return TupleRows(rows, columns)
+    if row_format == "record":
+        cls = record_class(name or "row", tuple(columns))
+        return [cls(*row) for row in rows]
+    if row_format == "columns":
+        return ColumnRows(columns, rows)
+    raise ValueError(f"Invalid row format: {row_format}")
+
+
+def project(rows: Iterable[Any], keys: Sequence[str]) -> Iterator[tuple]:
+    """
+    Yields the values of ``keys`` of every row as a tuple, for rows in any
+    format: dicts, records, TupleRows, ColumnRows or any iterable of mappings.
+    """
+    if isinstance(rows, ColumnRows):
+        return zip(*(rows.data[key] for key in keys))
+    if isinstance(rows, TupleRows):
+        get = itemgetter(*(rows.columns.index(key) for key in keys))
+    else:
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            return iter(())
+        rows = chain((first,), rows)
+        get = attrgetter(*keys) if isinstance(first, Record) else itemgetter(*keys)
+    if len(keys) == 1:
+        return ((get(row),) for row in rows)
+    return map(get, rows)
+
+
+def as_dicts(rows: Iterable[Any]) -> List[Dict[str, Any]]:
+    """
+    Returns rows in any format as dicts, e.g. to serialize them as JSON.
+    """
+    if isinstance(rows, (TupleRows, ColumnRows)):
+        return [dict(zip(rows.columns, row)) for row in rows]
+    return [row if isinstance(row, dict) else dict(row) for row in rows]
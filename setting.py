@@ -5,10 +5,12 @@ MENU_ITEMS = (
     '2. Search by keyword',
     '3. Search by genre and year',
     '4. Search by actor and year',
-    '5. Display popular queries'
+    '5. Display popular queries',
+    '6. Display query statistics',
+    '7. Find similar movies'
 )
 
-SCENARIO_SET = {'1', '2', '3', '4', '5'}
+SCENARIO_SET = {'1', '2', '3', '4', '5', '6', '7'}
 
 
 RATING_TEXT = ''' 1. "General Audiences"
@@ -17,4 +19,111 @@ RATING_TEXT = ''' 1. "General Audiences"
                      4. "Restricted"
                      5. "No One 17 and Under Admitted"'''
 
-RATING_LEN = 5
\ No newline at end of file
+RATING_LEN = 5
+
+# film.rating enum values in the order of RATING_TEXT
+RATINGS = ('G', 'PG', 'PG-13', 'R', 'NC-17')
+
+# Connection pool defaults (overridable with DB_POOL_* environment variables)
+POOL_SIZE = 5
+POOL_MAX_IDLE = 300
+POOL_TIMEOUT = 10
+POOL_PING_INTERVAL = 1
+
+# Read replicas (DB_REPLICAS): the most replication lag in seconds a read may
+# see and the health check interval (DB_REPLICA_MAX_LAG, DB_REPLICA_CHECK_INTERVAL)
+REPLICA_MAX_LAG = 5
+REPLICA_CHECK_INTERVAL = 5
+
+# Search result cache: entries, TTL in seconds and TTL for "not found" results (0 disables)
+CACHE_SIZE = 256
+CACHE_TTL = 300
+CACHE_NEGATIVE_TTL = 60
+
+# Row format of the cached search results: 'dict', or 'record' for __slots__
+# records that take far less memory per row (SAKILA_ROW_FORMAT overrides it)
+SEARCH_ROW_FORMAT = 'dict'
+
+# In-process keyword index: enable it and refresh it from film.last_update every N seconds
+KEYWORD_INDEX = True
+KEYWORD_INDEX_REFRESH = 60
+# The keyword and actor indexes (and `snapshot.py refresh`) also reload in full
+# every N seconds, to drop rows deleted in ways the incremental refresh cannot see
+INDEX_FULL_RELOAD = 3600
+
+# Write-behind recording of query popularity: flush after N recordings or N seconds
+RECORD_WRITE_BEHIND = True
+RECORD_FLUSH_SIZE = 100
+RECORD_FLUSH_INTERVAL = 5
+RECORD_MAX_PENDING = 10000
+
+# In-memory top-K popularity tracker: K, tracked names and re-seed interval in seconds
+POPULAR_TOP_K = 10
+POPULAR_CAPACITY = 1000
+POPULAR_RESEED = 300
+
+# Time windows offered for the popular queries (None is the lifetime count)
+WINDOW_ITEMS = (
+    '1. All time',
+    '2. Last hour',
+    '3. Last day',
+    '4. Last week'
+)
+
+WINDOW_CHOICES = {'1': None, '2': 'hour', '3': 'day', '4': 'week'}
+
+# In-process actor name index: refresh interval and minimum trigram similarity for typos
+ACTOR_INDEX = True
+ACTOR_INDEX_REFRESH = 60
+ACTOR_MATCH_THRESHOLD = 0.4
+
+# Run the named statements as server-side prepared statements (DB_PREPARED=0 switches to text protocol)
+PREPARED_STATEMENTS = True
+
+# Search planner: re-read the cardinality estimates every N seconds, and the
+# most actors or keyword-index films to look up by id instead of LIKE. Id lists
+# are padded to the next bucket size so each filter has a few statements only.
+PLANNER_STATS_REFRESH = 300
+PLANNER_MAX_IN_LIST = 500
+PLANNER_IN_LIST_BUCKETS = (8, 32, 128, 500)
+
+# Similar movies (menu item 7): 'cosine' or 'jaccard' similarity of the shared
+# actors, categories and rating, and the refresh interval of the index in seconds.
+# After a failed load or refresh the last index is served for SIMILAR_RETRY
+# seconds before the database is tried again.
+SIMILAR_METRIC = 'cosine'
+SIMILAR_REFRESH = 60
+SIMILAR_RETRY = 10
+
+# Plan checker (maintenance.py check-plans): baseline file and allowed growth
+# of the examined rows before a plan counts as a regression (0.5 = 50%)
+PLAN_BASELINE = 'plan_baseline.json'
+PLAN_ROWS_TOLERANCE = 0.5
+
+# Default number of movies per search page
+PAGE_SIZE = 10
+
+# Slow-query log: threshold in milliseconds and optional plan capture ('explain', 'analyze' or None)
+SLOW_QUERY_MS = 200
+SLOW_QUERY_EXPLAIN = None
+
+# Result tables: widest text column and what to do with longer values ('truncate' or 'wrap')
+TABLE_MAX_WIDTH = 60
+TABLE_OVERFLOW = 'truncate'
+
+# Resident server for the thin main.py client (SAKILA_SOCKET overrides the socket path)
+DAEMON_SOCKET = None  # None: sakila-<uid>.sock in the temporary directory
+DAEMON_TIMEOUT = 30
+
+# Search backend: 'database', or 'snapshot' to answer the searches from the
+# columnar file written by snapshot.py (SAKILA_BACKEND overrides it).
+SEARCH_BACKEND = 'database'
+SNAPSHOT_PATH = 'sakila.snapshot'
+# Seconds an asyncio search trusts the last check that the file was not replaced
+SNAPSHOT_CHECK_INTERVAL = 1
+
+# asyncio API (aio.py): 'auto' uses aiomysql when it is installed, 'executor'
+# always runs the searches in threads; SAKILA_ASYNC_DRIVER overrides it.
+ASYNC_DRIVER = 'auto'
+ASYNC_WORKERS = None  # None: one thread per pooled connection (POOL_SIZE)
+ASYNC_TIMEOUT = 30  # Default per-call timeout in seconds (None waits forever)
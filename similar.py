@@ -0,0 +1,288 @@
+# similar.py
+
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+import numpy as np
+from db import MySakilaConnection, locked
+from catalog import normalize
+from my_exceptions import DatabaseConnectionError, QueryExecutionError
+from snapshot import csr, key_sql, key_sum
+import sql_queries as sql
+from user_exceptions import MovieNotFoundError, UserInputError
+
+METRICS = ("cosine", "jaccard")
+
+# Tables read by the index: full and incremental statement, and the key kept per row
+TABLES = {
+    "film": (sql.sql_snapshot_film_all, sql.sql_snapshot_film_since, ("film_id",)),
+    "film_actor": (sql.sql_snapshot_film_actor_all, sql.sql_snapshot_film_actor_since, ("film_id", "actor_id")),
+    "film_category": (sql.sql_snapshot_film_category_all, sql.sql_snapshot_film_category_since,
+                      ("film_id", "category_id")),
+}
+
+
+class SimilarFilms:
+    """
+    Finds the films most similar to a film by their actors, categories and
+    rating.
+
+    Every film is a row of a sparse binary film x feature matrix, kept in
+    CSR form together with its transpose. The neighbours of a film are found
+    by counting, with one ``bincount``, the features every other film shares
+    with it, and scoring the counts by cosine or Jaccard similarity.
+
+    The rows of ``film``, ``film_actor`` and ``film_category`` are loaded once
+    and refreshed from ``last_update``; a table whose row count or key sum
+    shows deletions is re-read, and all of them are every
+    ``full_reload_interval`` seconds. The matrix is rebuilt from them after
+    a change.
+
+    One thread at a time loads, refreshes and rebuilds, under ``_lock``.
+    Lookups take no lock: they read the last built index, which is replaced
+    as a whole, so a reload never blocks them. When the database fails, the
+    last index is served for ``retry_interval`` seconds before it is tried
+    again.
+    """
+    def __init__(self, refresh_interval: float = 60.0, metric: str = "cosine",
+                 full_reload_interval: float = 3600.0, retry_interval: float = 10.0) -> None:
+        if metric not in METRICS:
+            raise ValueError(f"Invalid similarity metric: {metric}")
+        self.refresh_interval = refresh_interval
+        self.full_reload_interval = full_reload_interval
+        self.retry_interval = retry_interval
+        self.metric = metric
+        # film_id: (title, release_year, rating)
+        self.films: Dict[int, Tuple[str, Optional[int], Optional[str]]] = {}
+        self.pairs: Dict[str, Set[Tuple[int, int]]] = {"film_actor": set(), "film_category": set()}
+        self.last_update: Dict[str, Optional[str]] = {}
+        self.loaded_at: Optional[float] = None
+        self.full_load_at: Optional[float] = None
+        self.failed_at: Optional[float] = None
+        self._index: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._index is not None
+
+    def load(self) -> None:
+        """
+        Reads the three tables from scratch and rebuilds the index.
+        """
+        with self._lock:
+            self._update(True)
+
+    def refresh(self) -> None:
+        """
+        Reads the rows changed since the last refresh and rebuilds the index
+        if any changed.
+        """
+        with self._lock:
+            self._update(False)
+
+    def ensure_fresh(self) -> None:
+        """
+        Loads or refreshes the index when it is older than ``refresh_interval``.
+
+        :raises DatabaseConnectionError: If the index never loaded and the
+                                         last attempt failed under
+                                         ``retry_interval`` seconds ago.
+        """
+        if not self._due():
+            return
+        with locked(self._lock):
+            # Checked again: another thread may have loaded it meanwhile.
+            if self._due():
+                self._update(False)
+
+    def _due(self) -> bool:
+        now = time.monotonic()
+        if self.failed_at is not None and now - self.failed_at < self.retry_interval:
+            if not self.ready:
+                raise DatabaseConnectionError("Similar films index unavailable; the database is retried shortly.")
+            return False
+        return not self.ready or now - self.loaded_at > self.refresh_interval
+
+    def _update(self, full: bool) -> None:
+        """
+        Loads the index when asked, when the last full load failed or is too
+        old, and refreshes it otherwise.
+        """
+        try:
+            if full or self.full_load_at is None or time.monotonic() - self.full_load_at > self.full_reload_interval:
+                self._load()
+            else:
+                self._refresh()
+        except (DatabaseConnectionError, QueryExecutionError):
+            self.failed_at = time.monotonic()
+            raise
+        self.failed_at = None
+
+    def _load(self) -> None:
+        # Cleared until every table was read again, so a failed load is retried in full.
+        self.full_load_at = None
+        with MySakilaConnection(read_only=True) as base:
+            for table, (sql_all, _, _) in TABLES.items():
+                self._read(base, table, sql_all, None, True)
+        index = self._build()
+        self.loaded_at = self.full_load_at = time.monotonic()
+        self._index = index
+
+    def _refresh(self) -> None:
+        with MySakilaConnection(read_only=True) as base:
+            changed = False
+            for table, (sql_all, sql_since, key) in TABLES.items():
+                since = self.last_update.get(table)
+                changed |= self._read(base, table, sql_since, (since,), False) > 0
+                totals = base.execute_query(sql.sql_snapshot_totals.format(table=table, key=key_sql(key)))[0]
+                keys = [(film_id,) for film_id in self.films] if table == "film" else self.pairs[table]
+                if totals['row_count'] != len(keys) or totals['id_sum'] != key_sum(keys):
+                    self._read(base, table, sql_all, None, True)
+                    changed = True
+        if changed:
+            self._index = self._build()
+        self.loaded_at = time.monotonic()
+
+    def _read(self, base: MySakilaConnection, table: str, query: str, params: Optional[tuple],
+              replace: bool) -> int:
+        """
+        Merges the rows of a statement into a table, replacing it first if asked.
+
+        :return: The number of rows read.
+        """
+        if replace:
+            if table == "film":
+                self.films = {}
+            else:
+                self.pairs[table] = set()
+            self.last_update[table] = None
+        newest, count = self.last_update.get(table), 0
+        for row in base.iter_query(query, params):
+            if table == "film":
+                self.films[row['film_id']] = (row['title'], row['release_year'], row['rating'])
+            elif table == "film_actor":
+                self.pairs[table].add((row['film_id'], row['actor_id']))
+            else:
+                self.pairs[table].add((row['film_id'], row['category_id']))
+            stamp = str(row['last_update'])
+            if newest is None or stamp > newest:
+                newest = stamp
+            count += 1
+        self.last_update[table] = newest
+        return count
+
+    def _build(self) -> Dict[str, Any]:
+        """
+        Builds the film x feature matrix: one column per actor, category and
+        rating, with copies of the titles so lookups never read the tables
+        being refreshed.
+        """
+        film_ids = np.array(sorted(self.films), dtype=np.int64)
+        rows: List[np.ndarray] = []
+        columns: List[np.ndarray] = []
+        offset = 0
+        for table in ("film_actor", "film_category"):
+            pairs = np.array(sorted(self.pairs[table]), dtype=np.int64).reshape(-1, 2)
+            positions = np.searchsorted(film_ids, pairs[:, 0]) if len(film_ids) else np.zeros(len(pairs), np.int64)
+            # Pairs of deleted films are dropped.
+            known = positions < len(film_ids)
+            known[known] = film_ids[positions[known]] == pairs[known, 0]
+            features, feature_columns = np.unique(pairs[known, 1], return_inverse=True)
+            rows.append(positions[known])
+            columns.append(feature_columns.reshape(-1) + offset)
+            offset += len(features)
+        ratings = [self.films[film_id][2] for film_id in film_ids.tolist()]
+        labels = sorted({rating for rating in ratings if rating is not None})
+        rating_column = {rating: offset + i for i, rating in enumerate(labels)}
+        rated = [(row, rating_column[rating]) for row, rating in enumerate(ratings) if rating is not None]
+        rows.append(np.array([row for row, _ in rated], dtype=np.int64))
+        columns.append(np.array([column for _, column in rated], dtype=np.int64))
+        offset += len(labels)
+
+        rows_all, columns_all = np.concatenate(rows), np.concatenate(columns)
+        indptr, indices = csr(rows_all, columns_all, len(film_ids))
+        feature_ptr, feature_films = csr(columns_all, rows_all, offset)
+        return {
+            "films": dict(self.films),
+            "titles": {normalize(self.films[film_id][0] or ""): film_id for film_id in film_ids.tolist()},
+            "film_id": film_ids,
+            "indptr": indptr,
+            "indices": indices,
+            "feature_ptr": feature_ptr,
+            "feature_films": feature_films,
+            "sizes": np.diff(indptr).astype(np.float64),
+        }
+
+    def _current(self) -> Dict[str, Any]:
+        index = self._index
+        if index is None:
+            self.ensure_fresh()
+            index = self._index
+        return index
+
+    def resolve(self, title: str) -> int:
+        """
+        Returns the id of the film with a title, or of the only film whose
+        title contains it.
+
+        :raises MovieNotFoundError: If no film matches.
+        :raises UserInputError: If several films match.
+        """
+        index = self._current()
+        needle = normalize(title)
+        film_id = index["titles"].get(needle)
+        if film_id is not None:
+            return film_id
+        matches = sorted(film_id for name, film_id in index["titles"].items() if needle in name)
+        if not matches:
+            raise MovieNotFoundError(f"No movie titled '{title}' found.")
+        if len(matches) > 1:
+            names = ", ".join(index["films"][film_id][0] for film_id in matches[:5])
+            raise UserInputError(f"Several movies match: {names}{', ...' if len(matches) > 5 else '.'}", title)
+        return matches[0]
+
+    def similar(self, film_id: int, limit: Optional[int] = 10,
+                after: Optional[Sequence] = None) -> List[Dict[str, Any]]:
+        """
+        Returns the films sharing features with a film, the most similar first
+        (ties by film_id).
+
+        :param limit: The maximum number of films, or None for all of them.
+        :param after: The (score, film_id) of the last film of the previous
+                      page; only films ranked below it are returned.
+        """
+        m = self._current()
+        row = int(np.searchsorted(m["film_id"], film_id))
+        if row >= len(m["film_id"]) or m["film_id"][row] != film_id:
+            raise MovieNotFoundError(f"No movie with id {film_id} found.")
+        features = m["indices"][m["indptr"][row]:m["indptr"][row + 1]]
+        if not len(features):
+            return []
+        ptr, films = m["feature_ptr"], m["feature_films"]
+        shared = np.bincount(np.concatenate([films[ptr[feature]:ptr[feature + 1]] for feature in features]),
+                             minlength=len(m["film_id"]))
+        shared[row] = 0
+        candidates = np.flatnonzero(shared)
+        overlap = shared[candidates].astype(np.float64)
+        if self.metric == "cosine":
+            scores = overlap / np.sqrt(m["sizes"][row] * m["sizes"][candidates])
+        else:
+            scores = overlap / (m["sizes"][row] + m["sizes"][candidates] - overlap)
+        # Rounded so that page tokens compare equal to the scores they came from.
+        scores = np.round(scores, 6)
+        ids = m["film_id"][candidates]
+        if after is not None:
+            keep = (scores < after[0]) | ((scores == after[0]) & (ids > after[1]))
+            scores, ids, candidates = scores[keep], ids[keep], candidates[keep]
+        if limit is not None and len(scores) > limit:
+            # Every film scoring at least the limit-th best score, then the exact order.
+            threshold = np.partition(scores, len(scores) - limit)[len(scores) - limit]
+            keep = scores >= threshold
+            scores, ids = scores[keep], ids[keep]
+        order = np.lexsort((ids, -scores))[:limit]
+        results = []
+        for score, other in zip(scores[order].tolist(), ids[order].tolist()):
+            title, release_year, _ = m["films"][other]
+            results.append({"film_id": other, "title": title, "release_year": release_year, "score": score})
+        return results
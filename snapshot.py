@@ -0,0 +1,514 @@
+# snapshot.py
+
+import argparse
+import json
+import os
+import struct
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from db import MySakilaConnection, locked
+from catalog import normalize
+from actor_index import ActorIndex
+from keyword_index import relevance
+import setting as se
+import sql_queries as sql
+
+MAGIC = b"SAKSNAP1"
+ALIGN = 64
+VERSION = 1
+
+# Exported tables: full and incremental statement, primary key and kept columns
+TABLES = {
+    "film": (sql.sql_snapshot_film_all, sql.sql_snapshot_film_since, ("film_id",),
+             ("film_id", "title", "description", "release_year", "rating")),
+    "actor": (sql.sql_actor_names_all, sql.sql_actor_names_since, ("actor_id",),
+              ("actor_id", "first_name", "last_name")),
+    "category": (sql.sql_snapshot_category_all, sql.sql_snapshot_category_since, ("category_id",),
+                 ("category_id", "name")),
+    "film_actor": (sql.sql_snapshot_film_actor_all, sql.sql_snapshot_film_actor_since, ("actor_id", "film_id"),
+                   ("actor_id", "film_id")),
+    "film_category": (sql.sql_snapshot_film_category_all, sql.sql_snapshot_film_category_since,
+                      ("film_id", "category_id"), ("film_id", "category_id")),
+}
+
+TableRows = Dict[Tuple, Tuple]
+
+# Sakila ids are SMALLINT UNSIGNED, so a composite key packs into one number
+KEY_BASE = 65536
+
+
+class _StringTable:
+    """
+    Interns strings while a snapshot is written; every distinct string is
+    stored once as UTF-8 and referenced by its index.
+    """
+    def __init__(self) -> None:
+        self.ids: Dict[str, int] = {}
+
+    def add(self, text: Optional[str]) -> int:
+        text = text or ""
+        index = self.ids.get(text)
+        if index is None:
+            index = self.ids[text] = len(self.ids)
+        return index
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        encoded = [text.encode() for text in self.ids]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(data) for data in encoded], out=offsets[1:])
+        return offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def _positions(sorted_ids: np.ndarray, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Maps ids to their row numbers in ``sorted_ids``.
+
+    :return: The row numbers and a mask of the ids that were found.
+    """
+    if not len(sorted_ids):
+        return np.zeros(len(ids), dtype=np.int64), np.zeros(len(ids), dtype=bool)
+    positions = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+    return positions, sorted_ids[positions] == ids
+
+
+def csr(rows: np.ndarray, columns: np.ndarray, size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Builds a compressed sparse row adjacency: the columns of row ``r`` are
+    ``indices[indptr[r]:indptr[r + 1]]``, in ascending order. Also used by
+    similar.py.
+    """
+    order = np.lexsort((columns, rows))
+    indptr = np.zeros(size + 1, dtype=np.int32)
+    np.cumsum(np.bincount(rows, minlength=size), out=indptr[1:])
+    return indptr, columns[order].astype(np.int32)
+
+
+def _merge(rows: TableRows, changed: Iterable[Dict], table: str, newest: Optional[str]) -> Tuple[int, Optional[str]]:
+    """
+    Adds or replaces rows by primary key.
+
+    :return: The number of rows read and the newest ``last_update`` seen.
+    """
+    _, _, key, columns = TABLES[table]
+    count = 0
+    for row in changed:
+        rows[tuple(row[column] for column in key)] = tuple(row[column] for column in columns)
+        stamp = str(row['last_update'])
+        if newest is None or stamp > newest:
+            newest = stamp
+        count += 1
+    return count, newest
+
+
+def key_sum(keys: Iterable[Tuple[int, ...]]) -> int:
+    """
+    Sums the primary keys of a table like sql_snapshot_totals does. Also
+    used by similar.py.
+    """
+    total = 0
+    for key in keys:
+        packed = 0
+        for value in key:
+            packed = packed * KEY_BASE + value
+        total += packed
+    return total
+
+
+def key_sql(key: Sequence[str]) -> str:
+    """
+    Returns the SQL expression packing a primary key like key_sum().
+    """
+    expression = key[0]
+    for column in key[1:]:
+        expression = f"({expression}) * {KEY_BASE} + {column}"
+    return expression
+
+
+def write_snapshot(path: str, tables: Dict[str, TableRows], last_update: Dict[str, Optional[str]],
+                   full_load: float) -> None:
+    """
+    Writes the tables as a columnar snapshot, replacing ``path`` atomically so
+    that open readers keep their (old) mapping.
+
+    :param full_load: When the tables were last read in full (time.time()).
+    """
+    strings = _StringTable()
+    films = sorted(tables["film"].values())
+    actors = sorted(tables["actor"].values())
+    categories = sorted(tables["category"].values())
+    ratings = {value: code for code, value in enumerate(se.RATINGS)}
+
+    film_id = np.array([film[0] for film in films], dtype=np.int32)
+    actor_id = np.array([actor[0] for actor in actors], dtype=np.int32)
+    category_id = np.array([category[0] for category in categories], dtype=np.int32)
+    arrays = {
+        "film_id": film_id,
+        "film_title": np.array([strings.add(film[1]) for film in films], dtype=np.int32),
+        "film_description": np.array([strings.add(film[2]) for film in films], dtype=np.int32),
+        "film_year": np.array([-1 if film[3] is None else film[3] for film in films], dtype=np.int32),
+        "film_rating": np.array([ratings.get(film[4], -1) for film in films], dtype=np.int8),
+        "actor_id": actor_id,
+        "actor_first": np.array([strings.add(actor[1]) for actor in actors], dtype=np.int32),
+        "actor_last": np.array([strings.add(actor[2]) for actor in actors], dtype=np.int32),
+        "category_id": category_id,
+        "category_name": np.array([strings.add(category[1]) for category in categories], dtype=np.int32),
+    }
+    # Link rows pointing at rows that are not in the snapshot are dropped.
+    links = (("actor", actor_id, [(actor, film) for actor, film in tables["film_actor"].values()]),
+             ("category", category_id, [(category, film) for film, category in tables["film_category"].values()]))
+    for name, other_id, pairs in links:
+        pairs = np.array(pairs, dtype=np.int64).reshape(-1, 2)
+        other_rows, other_found = _positions(other_id, pairs[:, 0])
+        film_rows, film_found = _positions(film_id, pairs[:, 1])
+        found = other_found & film_found
+        other_rows, film_rows = other_rows[found], film_rows[found]
+        arrays[f"film_{name}_indptr"], arrays[f"film_{name}_indices"] = csr(film_rows, other_rows, len(film_id))
+        arrays[f"{name}_film_indptr"], arrays[f"{name}_film_indices"] = csr(other_rows, film_rows, len(other_id))
+    arrays["string_offsets"], arrays["string_data"] = strings.arrays()
+
+    layout, offset = {}, 0
+    for name, array in arrays.items():
+        layout[name] = [array.dtype.str, list(array.shape), offset]
+        offset = _align(offset + array.nbytes)
+    header = json.dumps({
+        "version": VERSION,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "ratings": list(se.RATINGS),
+        "last_update": last_update,
+        "full_load": full_load,
+        "counts": {table: len(rows) for table, rows in tables.items()},
+        "arrays": layout,
+    }).encode()
+    start = _align(len(MAGIC) + 8 + len(header))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temporary = tempfile.mkstemp(prefix=".snapshot-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(MAGIC + struct.pack("<Q", len(header)) + header)
+            for name, array in arrays.items():
+                file.seek(start + layout[name][2])
+                file.write(np.ascontiguousarray(array).tobytes())
+            file.truncate(start + offset)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+class Snapshot:
+    """
+    A read-only, memory-mapped view of a catalog snapshot that answers the
+    searches with vectorized filters instead of SQL.
+
+    Results match the statements planned by planner.py: rows are dicts
+    with the same keys, in the same order, one page of at most ``limit`` rows
+    continuing after the keyset ``after``.
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"Not a catalog snapshot: {path}")
+            (size,) = struct.unpack("<Q", file.read(8))
+            header = json.loads(file.read(size))
+        if header["version"] != VERSION:
+            raise ValueError(f"Unsupported snapshot version {header['version']}: {path}")
+        self.header = header
+        start = _align(len(MAGIC) + 8 + size)
+        arrays = {}
+        for name, (dtype, shape, offset) in header["arrays"].items():
+            if 0 in shape:
+                arrays[name] = np.empty(shape, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(path, dtype=dtype, mode="r", offset=start + offset, shape=tuple(shape))
+        self.arrays = arrays
+        self.ratings = header["ratings"]
+        self._lowered: Optional[np.ndarray] = None
+        self._actor_names: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self._actor_index: Optional[ActorIndex] = None
+        self._actor_index_lock = threading.Lock()
+        self._categories: Optional[Dict[str, int]] = None
+
+    def string(self, index: int) -> str:
+        offsets = self.arrays["string_offsets"]
+        return self.arrays["string_data"][offsets[index]:offsets[index + 1]].tobytes().decode()
+
+    def _lowered_strings(self) -> np.ndarray:
+        """
+        Returns every interned string lower-cased as UTF-8 bytes, built on first use.
+        Substring matches on UTF-8 bytes are the same as on the decoded text.
+        """
+        if self._lowered is None:
+            count = len(self.arrays["string_offsets"]) - 1
+            self._lowered = np.array([self.string(i).lower().encode() for i in range(count)], dtype=bytes)
+        return self._lowered
+
+    def _film_rows(self, rows: np.ndarray) -> List[Dict[str, Any]]:
+        film_id, title, year = self.arrays["film_id"], self.arrays["film_title"], self.arrays["film_year"]
+        return [{"film_id": int(film_id[row]), "title": self.string(title[row]),
+                 "release_year": None if year[row] < 0 else int(year[row])} for row in rows]
+
+    def category_id(self, genre: str) -> Optional[int]:
+        if self._categories is None:
+            self._categories = {normalize(self.string(name)): int(category_id) for category_id, name
+                                in zip(self.arrays["category_id"], self.arrays["category_name"])}
+        return self._categories.get(normalize(genre))
+
+    def genres(self) -> List[str]:
+        return sorted(self.string(name) for name in self.arrays["category_name"])
+
+    def resolve_actor(self, name: str, threshold: float) -> List[int]:
+        """
+        Resolves an actor's name to actor ids exactly like the database
+        backend's ActorIndex, with an index built from the snapshot's actors.
+        """
+        if self._actor_index is None:
+            with locked(self._actor_index_lock):
+                if self._actor_index is None:
+                    a, text = self.arrays, self.string
+                    self._actor_index = ActorIndex.from_rows(
+                        ({"actor_id": int(i), "first_name": text(f), "last_name": text(l)}
+                         for i, f, l in zip(a["actor_id"], a["actor_first"], a["actor_last"])), threshold)
+        return self._actor_index.resolve(name)
+
+    def _keyword_mask(self, keyword: str) -> np.ndarray:
+        """
+        Returns a mask of the films whose title or description contains the keyword.
+        """
+        a = self.arrays
+        hits = np.char.find(self._lowered_strings(), keyword.lower().encode()) >= 0
+        return hits[a["film_title"]] | hits[a["film_description"]]
+
+    def count_keyword(self, keyword: str) -> int:
+        """
+        Returns the number of films whose title or description contains the keyword.
+        """
+        return int(self._keyword_mask(keyword).sum())
+
+    def _match_actors(self, name: str) -> np.ndarray:
+        """
+        Returns the rows of the actors whose "lastfirst" or "firstlast" name
+        contains ``name``, like the LIKE filter of the actor search.
+        """
+        if self._actor_names is None:
+            first = [self.string(i).lower() for i in self.arrays["actor_first"]]
+            last = [self.string(i).lower() for i in self.arrays["actor_last"]]
+            self._actor_names = (np.array([(l + f).encode() for f, l in zip(first, last)], dtype=bytes),
+                                 np.array([(f + l).encode() for f, l in zip(first, last)], dtype=bytes))
+        if not name:
+            return np.empty(0, dtype=np.int64)
+        pattern = name.lower().encode()
+        last_first, first_last = self._actor_names
+        return np.flatnonzero((np.char.find(last_first, pattern) >= 0) | (np.char.find(first_last, pattern) >= 0))
+
+    def _actor_films(self, actors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the (film row, actor row) pairs of the given actors.
+        """
+        indptr = self.arrays["actor_film_indptr"]
+        starts, lengths = indptr[actors], indptr[actors + 1] - indptr[actors]
+        # Concatenate the CSR slices of all matching actors without a Python loop.
+        offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+        return self.arrays["actor_film_indices"][offsets + np.arange(lengths.sum())], np.repeat(actors, lengths)
+
+    def search(self, rating: Optional[str] = None, category_id: Optional[int] = None,
+               year_from: Optional[int] = None, year_to: Optional[int] = None, actor: Optional[str] = None,
+               keyword: Optional[str] = None, order: Sequence[Tuple[str, bool]] = (("film_id", False),),
+               after: Optional[Sequence] = None, limit: int = 10,
+               actor_ids: Optional[Sequence[int]] = None) -> List[Dict]:
+        """
+        Films matching every given filter, like the statements of planner.py.
+
+        Each filter narrows one boolean mask over the films. With an actor
+        there is one row per (film, matching actor) pair, ordered by actor_id
+        after ``order``.
+
+        :param order: (field, descending) pairs of film_id, release_year and,
+                      to rank by relevance to the keyword, score and title.
+                      Ranked rows carry their "score" like the keyword index's.
+        :param after: The keyset of the previous page's last row.
+        :param actor_ids: The ids ``actor`` resolved to (see resolve_actor),
+                          or None to match the name as a substring.
+        """
+        a = self.arrays
+        mask = np.ones(len(a["film_id"]), dtype=bool)
+        if rating is not None:
+            if rating not in self.ratings:
+                return []
+            mask &= a["film_rating"] == self.ratings.index(rating)
+        # A missing release year is stored as -1 and matches no year filter.
+        if year_from is not None:
+            mask &= a["film_year"] >= year_from
+        if year_to is not None:
+            mask &= (a["film_year"] >= 0) & (a["film_year"] <= year_to)
+        if category_id is not None:
+            positions, found = _positions(a["category_id"], np.array([category_id]))
+            if not found[0]:
+                return []
+            indptr = a["category_film_indptr"]
+            members = np.zeros_like(mask)
+            members[a["category_film_indices"][indptr[positions[0]]:indptr[positions[0] + 1]]] = True
+            mask &= members
+        if keyword is not None:
+            mask &= self._keyword_mask(keyword)
+
+        if actor is None:
+            films, actors = np.flatnonzero(mask), None
+        else:
+            if actor_ids is None:
+                matched = self._match_actors(actor)
+            else:
+                positions, found = _positions(a["actor_id"], np.array(actor_ids, dtype=np.int64))
+                matched = np.unique(positions[found])
+            films, actors = self._actor_films(matched)
+            keep = mask[films]
+            films, actors = films[keep], actors[keep]
+        # Sort keys as ascending columns; descending ones are negated.
+        fields = {"film_id": a["film_id"][films].astype(np.int64),
+                  "release_year": a["film_year"][films].astype(np.int64)}
+        scores = None
+        if any(field == "score" for field, _ in order):
+            scores, fields["title"] = self._rank(films, keyword or "")
+            fields["score"] = scores
+        columns = [-fields[field] if descending else fields[field] for field, descending in order]
+        if actors is not None:
+            columns.append(a["actor_id"][actors])
+        if after is not None:
+            key = [-1 if value is None else value for value in after]
+            key = [-value if descending else value for value, (_, descending) in zip(key, order)] + key[len(order):]
+            keep, equal = np.zeros(len(films), dtype=bool), np.ones(len(films), dtype=bool)
+            for column, value in zip(columns, key):
+                keep |= equal & (column > value)
+                equal &= column == value
+            films, columns = films[keep], [column[keep] for column in columns]
+            if actors is not None:
+                actors = actors[keep]
+            if scores is not None:
+                scores = scores[keep]
+        rows = np.lexsort(columns[::-1])[:limit]
+        results = self._film_rows(films[rows])
+        if actors is not None:
+            first, last = a["actor_first"], a["actor_last"]
+            for result, actor_row in zip(results, actors[rows]):
+                result["actor_id"] = int(a["actor_id"][actor_row])
+                result["actor_name"] = f"{self.string(first[actor_row])} {self.string(last[actor_row])}"
+        if scores is not None:
+            for result, score in zip(results, scores[rows]):
+                result["score"] = float(score)
+        return results
+
+    def _rank(self, films: np.ndarray, keyword: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the keyword index score and the title of each film row.
+        """
+        a, lowered, needle = self.arrays, self._lowered_strings(), keyword.lower()
+        unique, inverse = np.unique(films, return_inverse=True)
+        scores = np.array([relevance(lowered[a["film_title"][row]].decode(),
+                                     lowered[a["film_description"][row]].decode(), needle) for row in unique],
+                          dtype=np.float64)
+        titles = np.array([self.string(a["film_title"][row]) for row in unique], dtype=str)
+        return scores[inverse], titles[inverse]
+
+    def table_rows(self) -> Dict[str, TableRows]:
+        """
+        Reads the snapshot back into rows keyed like TABLES, for a refresh.
+        """
+        a, text = self.arrays, self.string
+        films = {(int(i),): (int(i), text(t), text(d) or None, None if y < 0 else int(y),
+                             self.ratings[r] if r >= 0 else None)
+                 for i, t, d, y, r in zip(a["film_id"], a["film_title"], a["film_description"],
+                                          a["film_year"], a["film_rating"])}
+        actors = {(int(i),): (int(i), text(f), text(l)) for i, f, l in zip(a["actor_id"], a["actor_first"],
+                                                                          a["actor_last"])}
+        categories = {(int(i),): (int(i), text(n)) for i, n in zip(a["category_id"], a["category_name"])}
+        tables = {"film": films, "actor": actors, "category": categories, "film_actor": {}, "film_category": {}}
+        for name, table in (("actor", "film_actor"), ("category", "film_category")):
+            indptr, indices, ids = a[f"film_{name}_indptr"], a[f"film_{name}_indices"], a[f"{name}_id"]
+            for row, film in enumerate(a["film_id"]):
+                for other in indices[indptr[row]:indptr[row + 1]]:
+                    pair = (int(ids[other]), int(film)) if name == "actor" else (int(film), int(ids[other]))
+                    tables[table][pair] = pair
+        return tables
+
+
+def export_snapshot(path: str) -> Dict[str, int]:
+    """
+    Exports the catalog tables from the database into a snapshot file.
+
+    :return: The number of rows per table.
+    """
+    tables: Dict[str, TableRows] = {}
+    last_update: Dict[str, Optional[str]] = {}
+    with MySakilaConnection(read_only=True) as base:
+        for table, (sql_all, _, _, _) in TABLES.items():
+            tables[table] = {}
+            _, last_update[table] = _merge(tables[table], base.iter_query(sql_all), table, None)
+    write_snapshot(path, tables, last_update, time.time())
+    return {table: len(rows) for table, rows in tables.items()}
+
+
+def refresh_snapshot(path: str, full_reload_interval: float = se.INDEX_FULL_RELOAD) -> Dict[str, int]:
+    """
+    Brings a snapshot up to date with the rows changed since its newest
+    ``last_update``. A table whose row count or primary key sum shows
+    deletions is re-read in full, and so is every table once the last full
+    read is ``full_reload_interval`` seconds old, in case deletions and
+    insertions cancelled out.
+
+    :return: The number of rows read per table.
+    """
+    snapshot = Snapshot(path)
+    header = snapshot.header
+    if time.time() - header.get("full_load", 0) >= full_reload_interval:
+        del snapshot
+        return export_snapshot(path)
+    tables = snapshot.table_rows()
+    last_update = dict(header["last_update"])
+    del snapshot
+    read = {}
+    with MySakilaConnection(read_only=True) as base:
+        for table, (sql_all, sql_since, key, _) in TABLES.items():
+            since = last_update.get(table)
+            changed = base.iter_query(sql_since, (since,)) if since is not None else base.iter_query(sql_all)
+            read[table], last_update[table] = _merge(tables[table], changed, table, since)
+            totals = base.execute_query(sql.sql_snapshot_totals.format(table=table, key=key_sql(key)))[0]
+            if totals['row_count'] != len(tables[table]) or totals['id_sum'] != key_sum(tables[table]):
+                tables[table] = {}
+                read[table], last_update[table] = _merge(tables[table], base.iter_query(sql_all), table, None)
+    write_snapshot(path, tables, last_update, header["full_load"])
+    return read
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """
+    Command-line entry point for the catalog snapshot.
+    """
+    parser = argparse.ArgumentParser(description="Export the MySakila catalog to a columnar snapshot.")
+    parser.add_argument("command", choices=("export", "refresh", "info"))
+    parser.add_argument("--path", default=se.SNAPSHOT_PATH, help=f"snapshot file (default: {se.SNAPSHOT_PATH})")
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        counts = export_snapshot(args.path)
+        print(f"Exported {', '.join(f'{count} {table}' for table, count in counts.items())} rows.")
+    elif args.command == "refresh":
+        counts = refresh_snapshot(args.path)
+        print(f"Read {', '.join(f'{count} {table}' for table, count in counts.items())} changed rows.")
+    else:
+        header = Snapshot(args.path).header
+        print(f"Created {header['created']}, {os.path.getsize(args.path)} bytes")
+        for table, count in header["counts"].items():
+            print(f"  {table}: {count} rows, last update {header['last_update'][table]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,43 @@
-# Query new movies by rating
-sql_query_rating = """
-        SELECT title, release_year
-        FROM film
-        WHERE rating = %s
-        ORDER BY release_year DESC
-        LIMIT 10
+from functools import lru_cache
+
+# Search statements, assembled by planner.py for each filter combination:
+# {columns} and {source} follow from the filters, {where} holds their
+# conditions, the most selective first, and {order} the sort key. The last
+# %s is the page size (plus one row to detect a next page); the variant for
+# a later page adds the keyset condition after the previous page's last row.
+sql_search = """
+        SELECT {columns}
+        FROM {source}
+        WHERE {where}
+        ORDER BY {order}
+        LIMIT %s
+    """
+
+# Relevance-ranked searches fetch every match and rank it by the keyword index
+sql_search_all = """
+        SELECT {columns}
+        FROM {source}
+        WHERE {where}
     """
 
-# Query by keyword in title or in description
-sql_query_keyword = """
-        SELECT title, release_year
+# Film counts per rating and year, per category and per actor: the cardinality
+# estimates of the search planner
+sql_stats_film = """
+        SELECT rating, release_year, COUNT(*) AS films
         FROM film
-        WHERE LOWER(title) LIKE %s OR LOWER(description) LIKE %s
-        LIMIT 10
+        GROUP BY rating, release_year
     """
 
-# Query by genre and release year
-sql_query_genre_year = """
-        SELECT f.title, f.release_year
-        FROM film AS f
-        JOIN film_category AS fc ON f.film_id = fc.film_id
-        JOIN category AS ca ON fc.category_id = ca.category_id
-        WHERE LOWER(ca.name) = %s
-        AND f.release_year = %s
-        LIMIT 10
+sql_stats_category = """
+        SELECT category_id, COUNT(*) AS films
+        FROM film_category
+        GROUP BY category_id
     """
 
-# Query by actor's name and release year
-sql_query_actor_year = """
-        SELECT f.title, f.release_year, CONCAT(a.first_name, ' ', a.last_name) AS actor_name
-        FROM film AS f
-        JOIN film_actor AS fa ON f.film_id = fa.film_id
-        JOIN actor AS a ON fa.actor_id = a.actor_id
-        WHERE (LOWER(CONCAT(a.last_name, a.first_name)) LIKE %s
-        OR LOWER(CONCAT(a.first_name, a.last_name)) LIKE %s)
-        AND f.release_year = %s
-        LIMIT 10
+sql_stats_actor = """
+        SELECT actor_id, COUNT(*) AS films
+        FROM film_actor
+        GROUP BY actor_id
     """
 
 # Query to insert a user request into a table
@@ -45,10 +47,189 @@ sql_table_record = """
             ON DUPLICATE KEY UPDATE execution_count = execution_count + 1
         """
 
+# Add several user requests at once; the VALUES row is repeated per request
+sql_table_record_batch = """
+            INSERT INTO queries (query_name, execution_count)
+            VALUES {rows}
+            ON DUPLICATE KEY UPDATE execution_count = execution_count + VALUES(execution_count)
+        """
+
+
+@lru_cache(maxsize=None)
+def build_table_record_batch(rows: int) -> str:
+    """
+    Returns the multi-row upsert for the given number of requests. The same
+    string object is returned for the same size so it can stay prepared.
+    """
+    return sql_table_record_batch.format(rows=", ".join(["(%s, %s)"] * rows))
+
 # Output of the top-10 popular requests
 sql_popular_queries = """
         SELECT query_name, execution_count
         FROM queries
         ORDER BY execution_count DESC
         LIMIT 10
-        """
\ No newline at end of file
+        """
+
+# Load the searchable text of every film for the in-process keyword index
+sql_film_text_all = """
+        SELECT film_id, title, description, release_year, last_update
+        FROM film
+    """
+
+# Films changed since the keyword index was last refreshed
+sql_film_text_since = """
+        SELECT film_id, title, description, release_year, last_update
+        FROM film
+        WHERE last_update >= %s
+    """
+
+# Number of films, used to detect deletions
+sql_film_count = """
+        SELECT COUNT(*) AS row_count, COALESCE(SUM(film_id), 0) AS id_sum
+        FROM film
+    """
+
+# The head of the popularity table, used to seed the in-memory top-K tracker
+sql_popular_queries_head = """
+        SELECT query_name, execution_count
+        FROM queries
+        ORDER BY execution_count DESC
+        LIMIT %s
+        """
+
+# Delete a batch of rarely used requests from the long tail
+sql_prune_queries = """
+        DELETE FROM queries
+        WHERE execution_count <= %s
+        LIMIT %s
+        """
+
+# Rebuild a table after a large prune to give the space back
+sql_optimize_table = "OPTIMIZE TABLE {table}"
+
+# Whether an index already exists in the current database
+sql_index_exists = """
+        SELECT COUNT(*) AS found
+        FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        """
+
+sql_create_index = "CREATE INDEX {name} ON {table} ({columns})"
+
+# Versioned schema migrations creating the indexes that back the statements
+# above, applied in order by maintenance.py: (version, description, indexes
+# as (table, index name, columns)). Never edit an applied migration; add one.
+MIGRATIONS = (
+    (1, "Popularity sort on queries.execution_count",
+     (('queries', 'idx_queries_execution_count', 'execution_count'),)),
+    (2, "Release year filter of the genre and actor searches",
+     (('film', 'idx_film_release_year', 'release_year'),)),
+    (3, "Rating filter in newest-first order",
+     (('film', 'idx_film_rating_year', 'rating, release_year DESC, film_id'),)),
+)
+
+# The applied migrations
+sql_create_migrations_table = """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            description VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+
+sql_applied_migrations = """
+        SELECT version, description, applied_at
+        FROM schema_migrations
+        ORDER BY version
+        """
+
+sql_record_migration = """
+        INSERT INTO schema_migrations (version, description)
+        VALUES (%s, %s)
+        """
+
+# Replication status of a read replica, for its lag (MySQL 8.0.22+ and older)
+sql_replica_status = "SHOW REPLICA STATUS"
+sql_slave_status = "SHOW SLAVE STATUS"
+
+# Execution plan of a statement, checked by plans.py
+sql_explain_json = "EXPLAIN FORMAT=JSON {query}"
+
+# All film categories for the catalog cache
+sql_categories = """
+        SELECT category_id, name
+        FROM category
+    """
+
+# Actor names for the in-process actor index
+sql_actor_names_all = """
+        SELECT actor_id, first_name, last_name, last_update
+        FROM actor
+    """
+
+# Actors changed since the actor index was last refreshed
+sql_actor_names_since = """
+        SELECT actor_id, first_name, last_name, last_update
+        FROM actor
+        WHERE last_update >= %s
+    """
+
+# Number of actors, used to detect deletions
+sql_actor_count = """
+        SELECT COUNT(*) AS row_count, COALESCE(SUM(actor_id), 0) AS id_sum
+        FROM actor
+    """
+
+# Tables exported to the columnar snapshot (snapshot.py) and read by the
+# similar-films index (similar.py); the *_since variants return the rows
+# changed since the previous read
+sql_snapshot_film_all = """
+        SELECT film_id, title, description, release_year, rating, last_update
+        FROM film
+    """
+
+sql_snapshot_film_since = """
+        SELECT film_id, title, description, release_year, rating, last_update
+        FROM film
+        WHERE last_update >= %s
+    """
+
+sql_snapshot_category_all = """
+        SELECT category_id, name, last_update
+        FROM category
+    """
+
+sql_snapshot_category_since = """
+        SELECT category_id, name, last_update
+        FROM category
+        WHERE last_update >= %s
+    """
+
+sql_snapshot_film_actor_all = """
+        SELECT actor_id, film_id, last_update
+        FROM film_actor
+    """
+
+sql_snapshot_film_actor_since = """
+        SELECT actor_id, film_id, last_update
+        FROM film_actor
+        WHERE last_update >= %s
+    """
+
+sql_snapshot_film_category_all = """
+        SELECT film_id, category_id, last_update
+        FROM film_category
+    """
+
+sql_snapshot_film_category_since = """
+        SELECT film_id, category_id, last_update
+        FROM film_category
+        WHERE last_update >= %s
+    """
+
+# Row count and primary key sum of an exported table, used to detect deletions
+sql_snapshot_totals = """
+        SELECT COUNT(*) AS row_count, COALESCE(SUM({key}), 0) AS id_sum
+        FROM {table}
+    """
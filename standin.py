@@ -0,0 +1,230 @@
+# standin.py
+
+import re
+import sqlite3
+from typing import Any, List, Optional, Sequence
+from mysql.connector import errors
+
+SCHEMA = """
+        CREATE TABLE IF NOT EXISTS film (
+            film_id INTEGER PRIMARY KEY,
+            title TEXT NOT NULL,
+            description TEXT,
+            release_year INTEGER,
+            rating TEXT DEFAULT 'G',
+            last_update TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_film_release_year ON film (release_year);
+        CREATE INDEX IF NOT EXISTS idx_film_rating ON film (rating);
+        CREATE TABLE IF NOT EXISTS category (
+            category_id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            last_update TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS film_category (
+            film_id INTEGER NOT NULL,
+            category_id INTEGER NOT NULL,
+            last_update TEXT NOT NULL,
+            PRIMARY KEY (film_id, category_id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_fk_category_id ON film_category (category_id);
+        CREATE TABLE IF NOT EXISTS actor (
+            actor_id INTEGER PRIMARY KEY,
+            first_name TEXT NOT NULL,
+            last_name TEXT NOT NULL,
+            last_update TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS film_actor (
+            actor_id INTEGER NOT NULL,
+            film_id INTEGER NOT NULL,
+            last_update TEXT NOT NULL,
+            PRIMARY KEY (actor_id, film_id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_fk_film_id ON film_actor (film_id);
+        CREATE TABLE IF NOT EXISTS queries (
+            query_name VARCHAR(255) PRIMARY KEY,
+            execution_count INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_queries_execution_count ON queries (execution_count);
+        CREATE TABLE IF NOT EXISTS replica_status (
+            seconds_behind_source INTEGER
+        );
+    """
+
+_CONCAT = re.compile(r"\bCONCAT\(", re.IGNORECASE)
+_UPSERT = re.compile(r"ON DUPLICATE KEY UPDATE", re.IGNORECASE)
+_VALUES_REF = re.compile(r"\bVALUES\((\w+)\)", re.IGNORECASE)
+_DELETE_LIMIT = re.compile(r"DELETE FROM (\w+)\s+WHERE (.*?)\s+LIMIT \?", re.IGNORECASE | re.DOTALL)
+_INDEX_EXISTS = re.compile(r"FROM information_schema\.statistics\s+WHERE table_schema = DATABASE\(\) "
+                           r"AND table_name = \? AND index_name = \?", re.IGNORECASE)
+# A stand-in plays a replica when its replica_status table has a row (NULL: replication stopped).
+_REPLICA_STATUS = re.compile(r"^SHOW (?:REPLICA|SLAVE) STATUS$", re.IGNORECASE)
+
+
+def _replace_concat(query: str) -> str:
+    """
+    Rewrites CONCAT(a, b, ...) as (a || b || ...), honouring nested parentheses.
+    """
+    while True:
+        match = _CONCAT.search(query)
+        if not match:
+            return query
+        depth, args, start = 1, [], match.end()
+        i = start
+        while depth:
+            char = query[i]
+            if char == "(":
+                depth += 1
+            elif char == ")":
+                depth -= 1
+            elif char == "," and depth == 1:
+                args.append(query[start:i].strip())
+                start = i + 1
+            elif char == "'":
+                i = query.index("'", i + 1)
+            i += 1
+        args.append(query[start:i - 1].strip())
+        query = query[:match.start()] + "(" + " || ".join(args) + ")" + query[i:]
+
+
+def translate(query: str) -> str:
+    """
+    Translates the MySQL dialect used in sql_queries.py to SQLite.
+    """
+    query = query.replace("%s", "?")
+    query = _replace_concat(query)
+    if _UPSERT.search(query):
+        query = _UPSERT.sub("ON CONFLICT DO UPDATE SET", query)
+        query = _VALUES_REF.sub(r"excluded.\1", query)
+    query = _DELETE_LIMIT.sub(r"DELETE FROM \1 WHERE rowid IN (SELECT rowid FROM \1 WHERE \2 LIMIT ?)", query)
+    query = _REPLICA_STATUS.sub("SELECT seconds_behind_source AS Seconds_Behind_Source FROM replica_status", query)
+    query = _INDEX_EXISTS.sub("FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND name = ?", query)
+    return query
+
+
+class StandInCursor:
+    """
+    The subset of a mysql.connector cursor that MySakilaConnection uses.
+    """
+    def __init__(self, connection: "StandInConnection", dictionary: bool = False) -> None:
+        self._connection = connection
+        self._dictionary = dictionary
+        self._cursor: Optional[sqlite3.Cursor] = None
+        self.rowcount = -1
+
+    @property
+    def with_rows(self) -> bool:
+        return self._cursor is not None and self._cursor.description is not None
+
+    @property
+    def column_names(self) -> tuple:
+        return tuple(column[0] for column in self._cursor.description) if self.with_rows else ()
+
+    def execute(self, operation: str, params: Sequence[Any] = ()) -> None:
+        try:
+            self._cursor = self._connection.raw.execute(translate(operation), tuple(params))
+        except sqlite3.Error as e:
+            raise errors.DatabaseError(msg=f"stand-in: {e}") from e
+        self.rowcount = self._cursor.rowcount
+
+    def fetchall(self) -> List[Any]:
+        return self._convert(self._fetch(lambda cursor: cursor.fetchall()))
+
+    def fetchmany(self, size: int = 1) -> List[Any]:
+        return self._convert(self._fetch(lambda cursor: cursor.fetchmany(size)))
+
+    def _fetch(self, fetch) -> List[Any]:
+        if not self.with_rows:
+            raise errors.InterfaceError(msg="No result set to fetch from.")
+        try:
+            return fetch(self._cursor)
+        except sqlite3.Error as e:
+            raise errors.DatabaseError(msg=f"stand-in: {e}") from e
+
+    def _convert(self, rows: List[sqlite3.Row]) -> List[Any]:
+        if self._dictionary:
+            return [dict(row) for row in rows]
+        return [tuple(row) for row in rows]
+
+    def close(self) -> None:
+        self._cursor = None
+
+
+class StandInConnection:
+    """
+    A SQLite connection that behaves like a mysql.connector connection for the
+    queries in sql_queries.py, so the whole stack can run without a MySQL server.
+    """
+    def __init__(self, path: str) -> None:
+        # Autocommit like the pooled MySQL connections; the pool may hand the
+        # connection to another thread.
+        self.raw = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.raw.row_factory = sqlite3.Row
+        self.raw.execute("PRAGMA journal_mode=WAL")
+        self.raw.execute("PRAGMA synchronous=NORMAL")
+        self.closed = False
+
+    def cursor(self, dictionary: bool = False, prepared: bool = False, **kwargs) -> StandInCursor:
+        return StandInCursor(self, dictionary)
+
+    @property
+    def in_transaction(self) -> bool:
+        return self.raw.in_transaction
+
+    def start_transaction(self) -> None:
+        self.raw.execute("BEGIN")
+
+    def commit(self) -> None:
+        if self.raw.in_transaction:
+            self.raw.execute("COMMIT")
+
+    def rollback(self) -> None:
+        if self.raw.in_transaction:
+            self.raw.execute("ROLLBACK")
+
+    def ping(self, reconnect: bool = False, **kwargs) -> None:
+        if self.closed:
+            raise errors.InterfaceError(msg="stand-in: connection is closed")
+
+    def close(self) -> None:
+        self.closed = True
+        self.raw.close()
+
+
+class StandInDatabase:
+    """
+    A Sakila-schema SQLite database file plus a connection factory for db.py.
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with sqlite3.connect(path) as raw:
+            raw.executescript(SCHEMA)
+
+    def connect(self) -> StandInConnection:
+        return StandInConnection(self.path)
+
+    def copy(self, path: str) -> "StandInDatabase":
+        """
+        Copies the database to another file, e.g. to play a read replica.
+        """
+        with sqlite3.connect(self.path) as source, sqlite3.connect(path) as target:
+            source.backup(target)
+        return StandInDatabase(path)
+
+    def set_replication_lag(self, seconds: Optional[int]) -> None:
+        """
+        Makes the database report itself as a replica this many seconds behind
+        (None: replication stopped), as SHOW REPLICA STATUS would.
+        """
+        with sqlite3.connect(self.path) as raw:
+            raw.execute("DELETE FROM replica_status")
+            raw.execute("INSERT INTO replica_status (seconds_behind_source) VALUES (?)", (seconds,))
+
+    def insert_rows(self, table: str, columns: Sequence[str], rows) -> None:
+        """
+        Bulk-inserts rows into a table in one transaction.
+        """
+        with sqlite3.connect(self.path) as raw:
+            placeholders = ", ".join("?" * len(columns))
+            raw.executemany(f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+                            rows)
@@ -0,0 +1,107 @@
+# statements.py
+
+import threading
+import weakref
+from typing import Any, Dict
+
+
+class StatementCounters:
+    """
+    Execution counters of one named statement.
+    """
+    def __init__(self) -> None:
+        self.prepared_executions = 0
+        self.text_executions = 0
+        self.prepares = 0
+
+    @property
+    def parses_saved(self) -> int:
+        """
+        Executions that reused an already prepared statement instead of
+        having the server parse the SQL again.
+        """
+        return self.prepared_executions - self.prepares
+
+    def as_dict(self) -> Dict[str, int]:
+        return {
+            "prepared_executions": self.prepared_executions,
+            "text_executions": self.text_executions,
+            "prepares": self.prepares,
+            "parses_saved": self.parses_saved,
+        }
+
+
+class StatementRegistry:
+    """
+    Keeps one server-side prepared statement per named query and connection.
+
+    The first execution of a name on a pooled connection prepares the SQL on
+    a dedicated prepared cursor; later executions on that connection reuse it
+    and only send the parameters, receiving rows in the binary protocol.
+    With ``prepared`` switched off every execution uses the text protocol, so
+    both modes can be compared with the same counters.
+    """
+    def __init__(self, prepared: bool = True) -> None:
+        self.prepared = prepared
+        self.counters: Dict[str, StatementCounters] = {}
+        self._cursors: "weakref.WeakKeyDictionary[Any, Dict[tuple, Any]]" = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def cursor_for(self, connection: Any, name: str, dictionary: bool = True) -> Any:
+        """
+        Returns the prepared cursor of a named statement on a connection,
+        creating it on first use.
+
+        :param dictionary: Return rows as dicts rather than tuples; each kind
+                           has its own prepared cursor.
+        """
+        with self._lock:
+            cursors = self._cursors.setdefault(connection, {})
+            cursor = cursors.get((name, dictionary))
+            counters = self.counters.setdefault(name, StatementCounters())
+            counters.prepared_executions += 1
+            if cursor is None:
+                cursor = connection.cursor(prepared=True, dictionary=dictionary)
+                cursors[(name, dictionary)] = cursor
+                counters.prepares += 1
+            return cursor
+
+    def count_text(self, name: str) -> None:
+        """
+        Counts a text-protocol execution of a named statement.
+        """
+        with self._lock:
+            self.counters.setdefault(name, StatementCounters()).text_executions += 1
+
+    def forget(self, connection: Any, name: str) -> None:
+        """
+        Drops the prepared cursors of a statement, e.g. after it failed.
+        """
+        with self._lock:
+            cursors = self._cursors.get(connection, {})
+            dropped = [cursors.pop((name, dictionary), None) for dictionary in (True, False)]
+        for cursor in dropped:
+            if cursor is not None:
+                try:
+                    cursor.close()
+                except Exception:
+                    pass
+
+    def close(self, connection: Any) -> None:
+        """
+        Closes every prepared cursor of a connection, before the pool closes it.
+        """
+        with self._lock:
+            cursors = self._cursors.pop(connection, {})
+        for cursor in cursors.values():
+            try:
+                cursor.close()
+            except Exception:
+                pass
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Returns the counters of every named statement.
+        """
+        with self._lock:
+            return {name: counters.as_dict() for name, counters in self.counters.items()}
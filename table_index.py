@@ -0,0 +1,118 @@
+# table_index.py
+
+import copy
+import threading
+import time
+from itertools import islice
+from typing import Dict, Iterable, List, Optional, Tuple
+from db import MySakilaConnection, locked
+
+
+class TableIndex:
+    """
+    Base class for in-process indexes built from one catalog table.
+
+    The index is loaded once with ``sql_all`` and refreshed incrementally with
+    ``sql_since`` (rows whose ``last_update`` is not older than the newest one
+    seen). ``sql_count`` returns the row count and the sum of the ids; when
+    either differs from the index, rows were deleted (even if as many were
+    inserted) and the index is reloaded in full, as it also is every
+    ``full_reload_interval`` seconds. One thread at a time loads or refreshes.
+
+    A full load builds new structures without holding ``_lock``, which the
+    lookups take, and swaps them in at the end: searches keep using the old
+    index for the whole database read. Subclasses name their structures in
+    ``data_attributes`` and implement _clear() (binding new empty ones),
+    _add_rows(), _ids() and __len__().
+    """
+    sql_all: str
+    sql_since: str
+    sql_count: str
+    data_attributes: Tuple[str, ...] = ()
+    chunk_size = 500
+
+    def __init__(self, refresh_interval: float = 60.0, full_reload_interval: float = 3600.0) -> None:
+        self.refresh_interval = refresh_interval
+        self.full_reload_interval = full_reload_interval
+        self.last_update = None
+        self.loaded_at: Optional[float] = None
+        self.full_load_at: Optional[float] = None
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.RLock()
+
+    @property
+    def ready(self) -> bool:
+        return self.loaded_at is not None
+
+    def load(self) -> None:
+        """
+        Builds the index from scratch.
+        """
+        with self._refresh_lock:
+            # A shallow copy whose structures are rebound empty: filling it leaves this index untouched.
+            fresh = copy.copy(self)
+            fresh._clear()
+            fresh.last_update = None
+            with MySakilaConnection(read_only=True) as base:
+                # Index the table chunk by chunk instead of materializing it first.
+                rows = base.iter_query(self.sql_all)
+                while True:
+                    chunk = list(islice(rows, self.chunk_size))
+                    if not chunk:
+                        break
+                    fresh._add(chunk)
+            with self._lock:
+                for name in self.data_attributes:
+                    setattr(self, name, getattr(fresh, name))
+                self.last_update = fresh.last_update
+                self.loaded_at = self.full_load_at = time.monotonic()
+
+    def refresh(self) -> None:
+        """
+        Re-indexes the rows changed since the last refresh. Falls back to a
+        full reload when rows were deleted or the last one is too old.
+        """
+        with self._refresh_lock:
+            if not self.ready or time.monotonic() - self.full_load_at > self.full_reload_interval:
+                self.load()
+                return
+            with MySakilaConnection(read_only=True) as base:
+                totals = base.execute_query(self.sql_count)[0]
+                rows = base.execute_query(self.sql_since, (self.last_update,))
+            with self._lock:
+                self._add(rows)
+                self.loaded_at = time.monotonic()
+                stale = totals['row_count'] != len(self) or totals['id_sum'] != sum(self._ids())
+            if stale:
+                self.load()
+
+    def ensure_fresh(self) -> None:
+        """
+        Loads or refreshes the index when it is older than ``refresh_interval``.
+        """
+        if self.ready and time.monotonic() - self.loaded_at <= self.refresh_interval:
+            return
+        with locked(self._refresh_lock):
+            # Checked again: another thread may have loaded it while this one waited.
+            if not self.ready:
+                self.load()
+            elif time.monotonic() - self.loaded_at > self.refresh_interval:
+                self.refresh()
+
+    def _add(self, rows: List[Dict]) -> None:
+        self._add_rows(rows)
+        for row in rows:
+            if self.last_update is None or row['last_update'] > self.last_update:
+                self.last_update = row['last_update']
+
+    def _clear(self) -> None:
+        raise NotImplementedError
+
+    def _add_rows(self, rows: List[Dict]) -> None:
+        raise NotImplementedError
+
+    def _ids(self) -> Iterable[int]:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
@@ -1,7 +1,6 @@
 # ui.py
 
-from typing import Tuple
-from db import MySakilaConnection
+from typing import Optional, Tuple
 import setting as se
 import sys
 
@@ -90,4 +89,26 @@ def get_actor_and_year() -> Tuple[str, int]:
                 return actor, year
         except ValueError:
             print("Error: Please enter the year in numeric format.")
-        
\ No newline at end of file
+
+
+def get_title() -> str:
+    """
+    Gets a movie title from the user.
+    """
+    while True:
+        title = input("Enter the movie title: ").strip()
+        if title:
+            return title
+        print("Error: The title cannot be empty!")
+
+
+def get_popular_window() -> Optional[str]:
+    """
+    Gets the time window for the popular queries from the user.
+    """
+    print('\n'.join(se.WINDOW_ITEMS))
+    while True:
+        choice = input(f"Enter the period number. (1-{len(se.WINDOW_CHOICES)}): ").strip()
+        if choice in se.WINDOW_CHOICES:
+            return se.WINDOW_CHOICES[choice]
+        print(f"Error: Please select a number from 1 to {len(se.WINDOW_CHOICES)}.")